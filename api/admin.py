@@ -1,3 +1,162 @@
+"""
+Admin for the api tables, which are too large for the ModelAdmin defaults.
+
+* Changelists never ``COUNT(*)`` a big table: EstimatedCountPaginator uses the
+  database's row estimate for unfiltered lists and a capped count otherwise.
+* Searches only use indexed lookups. Each term is an exact match, or a
+  ``^``-prefixed field is a case-sensitive prefix match run as an index
+  range. A term that a field cannot hold (text for an integer) skips that
+  field instead of raising.
+* Foreign keys shown in lists are joined (``list_select_related``), and so
+  are the ones each ``__str__`` touches. Large related tables get raw-id
+  widgets. ``AuthUser.extra_data`` (the full GitHub profile) is only loaded
+  on the change form.
+"""
 from django.contrib import admin
+from django.contrib.admin.utils import lookup_spawns_duplicates
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.text import smart_split
+
+from .filters import clean_value
+from .models import AppDetail, AppPlan, AuthUser, GithbRepo, Plan
+
+# Unfiltered lists of tables with at least this many (estimated) rows show the
+# estimate; filtered lists count at most this many rows.
+COUNT_LIMIT = 10000
+
+
+def estimated_count(model, using):
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s", [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # The highest rowid is one seek and ignores deleted rows, so it
+            # overestimates a little.
+            cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ('-pk',)
+    # Applied to every queryset, not only the changelist, so change and
+    # delete pages get __str__'s relations in the same query.
+    select_related = ()
+    defer = ()
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.select_related:
+            # The changelist skips list_select_related once a queryset has
+            # any select_related, so both go in here.
+            related = self.list_select_related if isinstance(self.list_select_related, (list, tuple)) else ()
+            queryset = queryset.select_related(*self.select_related, *related)
+        if self.defer:
+            queryset = queryset.defer(*self.defer)
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        if not (search_fields and search_term):
+            return queryset, False
+        for term in smart_split(search_term):
+            term = term.strip('"\'')
+            matches = Q()
+            for search_field in search_fields:
+                prefix = search_field.startswith('^')
+                lookup = search_field.lstrip('^')
+                try:
+                    value = clean_value(self.model, lookup, term)
+                except ValidationError:
+                    continue
+                if prefix:
+                    matches |= Q(**{f'{lookup}__gte': value, f'{lookup}__lt': value + '\U0010ffff'})
+                else:
+                    matches |= Q(**{lookup: value})
+            if not matches:
+                return queryset.none(), False
+            queryset = queryset.filter(matches)
+        may_have_duplicates = any(lookup_spawns_duplicates(self.opts, field.lstrip('^')) for field in search_fields)
+        return queryset, may_have_duplicates
+
+
+@admin.register(AuthUser)
+class AuthUserAdmin(LargeTableAdmin):
+    list_display = ('id', 'uid', 'provider', 'last_login', 'created_at')
+    search_fields = ('id', 'uid')
+    defer = ('extra_data',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith('_change'):
+            # The change form edits extra_data, so load it with the row.
+            queryset = queryset.defer(None)
+        return queryset
+
+
+@admin.register(GithbRepo)
+class GithbRepoAdmin(LargeTableAdmin):
+    list_display = ('id', 'repository', 'organizer', 'branches', 'created_at')
+    list_select_related = ('organizer',)
+    search_fields = ('id', '^repository', 'organizer')
+    raw_id_fields = ('organizer',)
+    select_related = ('organizer',)
+    defer = ('organizer__extra_data',)
+
+
+@admin.register(AppDetail)
+class AppDetailAdmin(LargeTableAdmin):
+    list_display = ('id', 'organizer', 'region', 'framework', 'current_plan', 'node', 'created_at')
+    list_select_related = ('organizer', 'current_plan', 'node')
+    list_filter = ('framework',)
+    search_fields = ('id', 'organizer', '^region')
+    raw_id_fields = ('organizer',)
+    # Maintained by AppPlan saves and api.placement.
+    readonly_fields = ('current_plan', 'current_plan_assigned_at', 'node')
+    select_related = ('organizer__organizer',)
+    defer = ('organizer__organizer__extra_data',)
+
+
+@admin.register(AppPlan)
+class AppPlanAdmin(LargeTableAdmin):
+    list_display = ('id', 'app', 'plan', 'created_at')
+    list_select_related = ('app__organizer', 'plan')
+    search_fields = ('id', 'app', 'plan')
+    raw_id_fields = ('app',)
+    autocomplete_fields = ('plan',)
+    select_related = ('app__organizer', 'plan')
+
 
-# Register your models here.
+@admin.register(Plan)
+class PlanAdmin(admin.ModelAdmin):
+    list_display = ('id', 'plan_type', 'cpu', 'memory', 'storage', 'bandwidth', 'monthly_cost')
+    list_filter = ('plan_type',)
+    search_fields = ('plan_type',)
+    ordering = ('monthly_cost', 'pk')
@@ -4,3 +4,33 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+        from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+        from . import placement, usage
+        from .models import AppDetail, DatabasePlan, GithbRepo, Plan, plan_deleted, plan_deleting
+        from .search import create_index, reindex, unindex
+        from .signals import current_plan_changed, plan_changed
+        from .writebehind import update_last_login
+
+        user_logged_in.disconnect(dispatch_uid="update_last_login")
+        user_logged_in.connect(update_last_login, dispatch_uid="update_last_login")
+        post_migrate.connect(create_index, sender=self, dispatch_uid="search.create_index")
+        post_save.connect(reindex, sender=GithbRepo, dispatch_uid="search.reindex")
+        post_delete.connect(unindex, sender=GithbRepo, dispatch_uid="search.unindex")
+        pre_delete.connect(plan_deleting, sender=Plan, dispatch_uid="models.plan_deleting")
+        post_delete.connect(plan_deleted, sender=Plan, dispatch_uid="models.plan_deleted")
+
+        current_plan_changed.connect(usage.current_plan_moved, dispatch_uid="usage.current_plan_moved")
+        pre_delete.connect(usage.app_deleting, sender=AppDetail, dispatch_uid="usage.app_deleting")
+        plan_changed.connect(usage.plan_updated, dispatch_uid="usage.plan_updated")
+        pre_delete.connect(usage.plan_deleting, sender=Plan, dispatch_uid="usage.plan_deleting")
+        pre_save.connect(usage.database_plan_saving, sender=DatabasePlan, dispatch_uid="usage.database_plan_saving")
+        post_save.connect(usage.database_plan_saved, sender=DatabasePlan, dispatch_uid="usage.database_plan_saved")
+        post_delete.connect(usage.database_plan_deleted, sender=DatabasePlan, dispatch_uid="usage.database_plan_deleted")
+
+        current_plan_changed.connect(placement.current_plan_moved, dispatch_uid="placement.current_plan_moved")
+        pre_delete.connect(placement.app_deleting, sender=AppDetail, dispatch_uid="placement.app_deleting")
+        plan_changed.connect(placement.plan_updated, dispatch_uid="placement.plan_updated")
+        pre_delete.connect(placement.plan_deleting, sender=Plan, dispatch_uid="placement.plan_deleting")
@@ -0,0 +1,100 @@
+"""
+Per-endpoint circuit breakers for outbound calls.
+
+A breaker opens once at least BREAKER_MIN_CALLS calls were made in the last
+BREAKER_WINDOW seconds and the share of failures among them reached
+BREAKER_FAILURE_RATE. While open, calls are refused without touching the
+network. After BREAKER_RESET_TIMEOUT seconds a single probe call is let
+through (half-open): success closes the breaker, failure re-opens it.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = None
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._probing = False
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < settings.BREAKER_RESET_TIMEOUT:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, success):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if success:
+                    self.state = CLOSED
+                    self._events.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._events.append((now, success))
+            while self._events and now - self._events[0][0] > settings.BREAKER_WINDOW:
+                self._events.popleft()
+            failures = sum(1 for _, ok in self._events if not ok)
+            if (len(self._events) >= settings.BREAKER_MIN_CALLS
+                    and failures / len(self._events) >= settings.BREAKER_FAILURE_RATE):
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self._events.clear()
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed (0 unless open)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0
+            return max(0.0, settings.BREAKER_RESET_TIMEOUT - (time.monotonic() - self.opened_at))
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.opened_at = None
+            self._events.clear()
+            self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def reset_all():
+    with _breakers_lock:
+        for breaker in _breakers.values():
+            breaker.reset()
@@ -0,0 +1,127 @@
+"""
+A local stand-in for the GitHub endpoints the API calls, for fault-injection
+tests and load tests.
+
+    with FakeGitHub(repos=50) as fake:
+        settings.USER_REPO_URL = fake.url('/user/repos')
+        fake.mode = 'hang'     # or 'ok', 'error', 'slow'
+
+Modes: ``ok`` answers immediately, ``slow`` waits ``delay`` seconds before
+answering, ``hang`` holds the connection open until the server is stopped
+(or ``hang_for`` seconds), ``error`` answers 502. With ``users_by_token``
+``/user`` answers a different user per Authorization header, as GitHub does
+for different tokens; otherwise every token is the same user.
+"""
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.fake.handle(self)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        self.server.fake.handle(self)
+
+
+class FakeGitHub:
+    def __init__(self, repos=10, branches=2, mode='ok', delay=0.05, hang_for=30, users_by_token=False):
+        self.repos = repos
+        self.branches = branches
+        self.mode = mode
+        self.delay = delay
+        self.hang_for = hang_for
+        self.users_by_token = users_by_token
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+
+    def url(self, path=''):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}{path}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def payload(self, path, authorization=None):
+        if path.startswith('/login/oauth/access_token'):
+            return {'access_token': 'gho_' + 'a' * 36, 'token_type': 'bearer', 'scope': 'user'}
+        if path.startswith('/user/repos'):
+            return [
+                {
+                    'id': i,
+                    'name': f'repo-{i}',
+                    'full_name': f'octocat/repo-{i}',
+                    'private': False,
+                    'clone_url': f'https://github.com/octocat/repo-{i}.git',
+                    'url': self.url(f'/repos/octocat/repo-{i}'),
+                    'owner': {'login': 'octocat', 'id': 1},
+                }
+                for i in range(self.repos)
+            ]
+        if path.endswith('/branches'):
+            return [{'name': f'branch-{i}', 'protected': False, 'commit': {'sha': f'{i:040x}'}} for i in range(self.branches)]
+        if path.startswith('/user'):
+            if self.users_by_token and authorization:
+                user_id = zlib.crc32(authorization.encode()) + 2
+                return {'id': user_id, 'login': f'user-{user_id}', 'name': f'User {user_id}'}
+            return {'id': 1, 'login': 'octocat', 'name': 'The Octocat'}
+        return None
+
+    def handle(self, handler):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.mode == 'hang':
+                self._stopped.wait(self.hang_for)
+                return
+            if self.mode == 'slow':
+                time.sleep(self.delay)
+            if self.mode == 'error':
+                self.respond(handler, 502, {'message': 'Bad Gateway'})
+                return
+            payload = self.payload(handler.path, handler.headers.get('Authorization'))
+            if payload is None:
+                self.respond(handler, 404, {'message': 'Not Found'})
+            else:
+                self.respond(handler, 200, payload)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def respond(self, handler, status_code, payload):
+        body = json.dumps(payload).encode()
+        handler.send_response(status_code)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
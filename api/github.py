@@ -0,0 +1,267 @@
+"""
+GitHub REST calls used by the auth views.
+
+GitHub returns ~100 fields per repository and most of them are never used.
+Responses are read as a stream and each top-level array item is decoded and
+projected to a declared field set as soon as it is complete, so a 2,000-repo
+listing never sits in memory as full objects.
+"""
+import codecs
+import hashlib
+import itertools
+import json
+import math
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import circuitbreaker, metrics, tracing
+from .singleflight import SingleFlight
+
+# Dotted names select nested keys, e.g. 'owner.login'.
+USER_FIELDS = ('id', 'login', 'name', 'email', 'avatar_url', 'html_url', 'type', 'company', 'location')
+REPO_FIELDS = (
+    'id', 'name', 'full_name', 'private', 'clone_url', 'html_url', 'url', 'description',
+    'default_branch', 'language', 'visibility', 'created_at', 'updated_at', 'pushed_at', 'owner.login',
+)
+BRANCH_FIELDS = ('name', 'protected', 'commit.sha')
+
+CHUNK_SIZE = 64 * 1024
+
+flight = SingleFlight('github')
+
+
+class GitHubUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'GitHub is currently unavailable, please retry later.'
+    default_code = 'github_unavailable'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        # Picked up by DRF's exception handler as a Retry-After header.
+        self.wait = max(1, math.ceil(wait)) if wait is not None else None
+
+
+def compile_fields(fields):
+    """Turn ``('id', 'owner.login')`` into ``{'id': None, 'owner': {'login': None}}``."""
+    tree = {}
+    for name in fields:
+        node = tree
+        *parents, leaf = name.split('.')
+        for part in parents:
+            if node.get(part) is None:
+                node[part] = {}
+            node = node[part]
+        node.setdefault(leaf, None)
+    return tree
+
+
+def project(obj, tree):
+    if tree is None:
+        return obj
+    if isinstance(obj, list):
+        return [project(item, tree) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    return {key: project(obj[key], sub) for key, sub in tree.items() if key in obj}
+
+
+def compact(obj):
+    """Drop null values from a projected object, for persisting."""
+    if isinstance(obj, dict):
+        return {key: compact(value) for key, value in obj.items() if value is not None}
+    if isinstance(obj, list):
+        return [compact(item) for item in obj]
+    return obj
+
+
+def iter_json(chunks):
+    """
+    Incrementally decode a JSON document from an iterable of byte chunks.
+
+    Yields each element of a top-level array as soon as it has been fully
+    received; any other document is yielded once, whole.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos, eof, is_array = '', 0, False, None
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buffer):
+            if is_array is None:
+                is_array = buffer[pos] == '['
+                if is_array:
+                    pos += 1
+                    continue
+            if is_array and buffer[pos] == ']':
+                return
+            if is_array or eof:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # A number at the end of the buffer may still be growing.
+                    if end < len(buffer) or eof:
+                        yield item
+                        if not is_array:
+                            return
+                        buffer, pos = buffer[end:], 0
+                        continue
+        elif eof:
+            if is_array:
+                raise json.JSONDecodeError('Unterminated array', buffer, pos)
+            return
+
+        try:
+            buffer = buffer[pos:] + utf8.decode(next(chunks))
+        except StopIteration:
+            buffer = buffer[pos:] + utf8.decode(b'', final=True)
+            eof = True
+        pos = 0
+
+
+def load_projected(chunks, fields):
+    """Decode a streamed JSON body, projecting each object to ``fields``."""
+    tree = compile_fields(fields)
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if head.strip():
+            break
+    body = itertools.chain([head], chunks)
+    if head.lstrip()[:1] == b'[':
+        return [project(item, tree) for item in iter_json(body)]
+    return project(next(iter_json(body), None), tree)
+
+
+def auth_headers(access_token):
+    return {"Authorization": f"token {access_token}"}
+
+
+def flight_key(url, access_token, fields):
+    # Hash rather than embed the token, since keys may land in a shared cache.
+    raw = '\0'.join([access_token, url, ','.join(fields or ())])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get(url, access_token, fields=None, endpoint='other'):
+    """
+    GET ``url`` and return ``(status_code, data)``. Successful responses are
+    projected to ``fields``; error bodies are returned unchanged.
+
+    Identical concurrent requests (same token, URL and fields) share a single
+    upstream call, so the returned data must be treated as read-only.
+    """
+    return flight.do(flight_key(url, access_token, fields), lambda: fetch(url, access_token, fields, endpoint))
+
+
+async def aget(url, access_token, fields=None, endpoint='other'):
+    """asyncio variant of :func:`get`, coalescing concurrent tasks."""
+    return await flight.ado(
+        flight_key(url, access_token, fields),
+        lambda: sync_to_async(fetch)(url, access_token, fields, endpoint),
+    )
+
+
+def fetch(url, access_token, fields=None, endpoint='other'):
+    """
+    Make the upstream call behind ``endpoint``'s circuit breaker. When the
+    breaker is open, the call fails (a malformed body included) or GitHub
+    answers 5xx, the last good response for the same request is served if
+    one is cached; otherwise GitHubUnavailable is raised (5xx responses are
+    returned as-is).
+    """
+    breaker = circuitbreaker.get_breaker(endpoint)
+    stale_key = f'github:stale:{flight_key(url, access_token, fields)}'
+    if not breaker.allow():
+        metrics.registry.inc('github_requests_total', {'endpoint': endpoint, 'status': 'open'})
+        return serve_stale(stale_key, endpoint, breaker)
+
+    try:
+        with tracing.span(f'github.{endpoint}', url=url) as span, \
+                metrics.timed('github_request_duration_seconds', endpoint=endpoint):
+            headers = tracing.inject(auth_headers(access_token))
+            response = requests.get(url, headers=headers, stream=True, timeout=settings.GITHUB_TIMEOUT)
+            metrics.registry.inc('github_requests_total', {'endpoint': endpoint, 'status': response.status_code})
+            span.set(status_code=response.status_code)
+            try:
+                if response.status_code != 200 or fields is None:
+                    result = response.status_code, error_body(response)
+                else:
+                    result = response.status_code, load_projected(response.iter_content(CHUNK_SIZE), fields)
+            finally:
+                response.close()
+    except (requests.RequestException, ValueError):
+        # ValueError: a truncated or malformed body, as much a failed call as
+        # a dropped connection.
+        breaker.record(False)
+        metrics.registry.inc('github_requests_total', {'endpoint': endpoint, 'status': 'error'})
+        return serve_stale(stale_key, endpoint, breaker)
+    except Exception:
+        # Still a failed call, and a half-open breaker must hear about its probe.
+        breaker.record(False)
+        metrics.registry.inc('github_requests_total', {'endpoint': endpoint, 'status': 'error'})
+        raise
+
+    breaker.record(result[0] < 500)
+    if result[0] >= 500:
+        return cache.get(stale_key) or result
+    if result[0] == 200 and settings.GITHUB_STALE_TTL:
+        cache.set(stale_key, result, settings.GITHUB_STALE_TTL)
+    return result
+
+
+def error_body(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {'message': response.text[:500]}
+
+
+def serve_stale(stale_key, endpoint, breaker):
+    result = cache.get(stale_key)
+    if result is None:
+        raise GitHubUnavailable(wait=breaker.retry_after())
+    metrics.registry.inc('github_requests_total', {'endpoint': endpoint, 'status': 'stale'})
+    return result
+
+
+def exchange_code(code):
+    """Exchange an OAuth ``code`` for an access token; returns the token payload."""
+    breaker = circuitbreaker.get_breaker('token')
+    if not breaker.allow():
+        metrics.registry.inc('github_requests_total', {'endpoint': 'token', 'status': 'open'})
+        raise GitHubUnavailable(wait=breaker.retry_after())
+
+    data = {
+        'client_id': settings.CLIENT_ID,
+        'client_secret': settings.CLIENT_SECRET,
+        'code': code
+    }
+    try:
+        with tracing.span('github.token', url=settings.TOKEN_URL) as span, \
+                metrics.timed('github_request_duration_seconds', endpoint='token'):
+            headers = tracing.inject({'Accept': 'application/json'})
+            response = requests.post(settings.TOKEN_URL, data=data, headers=headers, timeout=settings.GITHUB_TIMEOUT)
+            metrics.registry.inc('github_requests_total', {'endpoint': 'token', 'status': response.status_code})
+            span.set(status_code=response.status_code)
+    except requests.RequestException:
+        breaker.record(False)
+        metrics.registry.inc('github_requests_total', {'endpoint': 'token', 'status': 'error'})
+        raise GitHubUnavailable(wait=breaker.retry_after())
+    except Exception:
+        breaker.record(False)
+        raise
+    breaker.record(response.status_code < 500)
+    return error_body(response)
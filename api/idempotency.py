@@ -0,0 +1,146 @@
+"""
+``Idempotency-Key`` handling for unsafe requests.
+
+The first request with a given key (per client, method and path) runs and its
+rendered response is kept for IDEMPOTENCY_TTL seconds; repeats get the stored
+bytes back with ``Idempotent-Replayed: true``. While the first request is
+still running, duplicates wait for its result (up to IDEMPOTENCY_LOCK_TIMEOUT
+seconds, then 409) instead of executing again. Reusing a key for a different
+body is a 422. Server errors are not stored, so a retry after a 5xx runs
+again.
+
+Claims and responses are IdempotencyKey rows: inserting the primary key is an
+atomic claim in every worker. A claim lasts until its request finishes,
+however long that takes; only one older than IDEMPOTENCY_LOCK_TTL (the
+original's worker died) is taken over. ``manage.py purge_idempotency_keys``
+deletes expired rows.
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+STORED_HEADERS = ('Content-Type', 'Location', 'Allow', 'Vary')
+
+
+def client_ident(request):
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if credentials:
+        return hashlib.sha256(credentials.encode()).hexdigest()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def scope_key(request, key):
+    raw = '\0'.join([client_ident(request), request.method, request.path, key])
+    return 'idempotency:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def fingerprint(request):
+    return hashlib.sha256(request.body).hexdigest()
+
+
+def error(status, detail, **headers):
+    response = JsonResponse({'error': detail}, status=status)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def replay(entry):
+    response = HttpResponse(bytes(entry.content), status=entry.status)
+    for header, value in entry.headers.items():
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def expired(entry, now):
+    if entry.status is None:
+        return entry.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TTL)
+    return entry.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+
+
+def claim(scope, digest):
+    """The stored entry or running claim for ``scope``, or None once this request holds it."""
+    while True:
+        entry = IdempotencyKey.objects.filter(key=scope).first()
+        now = timezone.now()
+        if entry is not None and not expired(entry, now):
+            return entry
+        if entry is not None:
+            # Only delete the row we read, not a claim made since.
+            IdempotencyKey.objects.filter(key=scope, created_at=entry.created_at).delete()
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=scope, fingerprint=digest, created_at=now)
+            return None
+        except IntegrityError:
+            # Another worker claimed it first; read what it stored.
+            continue
+
+
+def run(request, key, handler):
+    """Run ``handler()`` at most once per idempotency key and replay its response."""
+    if len(key) > MAX_KEY_LENGTH:
+        return error(400, f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    scope = scope_key(request, key)
+    digest = fingerprint(request)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_TIMEOUT
+
+    while True:
+        entry = claim(scope, digest)
+        if entry is None:
+            break
+        if entry.fingerprint != digest:
+            return error(422, "Idempotency-Key was already used for a different request")
+        if entry.status is not None:
+            return replay(entry)
+        if time.monotonic() >= deadline:
+            return error(409, "A request with this Idempotency-Key is still in progress", **{'Retry-After': '1'})
+        # The original is still running; wait for its response.
+        time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+
+    release = lambda: IdempotencyKey.objects.filter(key=scope, status__isnull=True).delete()
+    try:
+        response = handler()
+    except BaseException:
+        release()
+        raise
+    if response.status_code >= 500 or response.streaming:
+        release()
+        return response
+
+    def store(rendered):
+        IdempotencyKey.objects.filter(key=scope).update(
+            status=rendered.status_code,
+            content=rendered.content,
+            headers={header: rendered[header] for header in STORED_HEADERS if rendered.has_header(header)},
+            created_at=timezone.now(),
+        )
+
+    if getattr(response, 'is_rendered', True):
+        store(response)
+    else:
+        response.add_post_render_callback(store)
+    return response
+
+
+def purge():
+    """Delete expired responses and abandoned claims; returns the number of rows."""
+    now = timezone.now()
+    deleted, _ = IdempotencyKey.objects.filter(
+        status__isnull=False, created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_TTL),
+    ).delete()
+    abandoned, _ = IdempotencyKey.objects.filter(
+        status__isnull=True, created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TTL),
+    ).delete()
+    return deleted + abandoned
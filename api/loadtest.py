@@ -0,0 +1,584 @@
+"""
+In-process and localhost load generation for ``manage.py loadtest``.
+
+Every virtual client is an asyncio task that sends requests drawn from a
+scenario's weighted mix, one at a time, until the run's duration or request
+budget is used up. Clients talk to one of three targets:
+
+* ``asgi``: ``kubern_test.asgi.application`` called directly with ASGI
+  events, in this event loop.
+* ``wsgi``: ``kubern_test.wsgi.application`` called in a pool of ``threads``
+  threads, like a threaded WSGI server.
+* ``http``: a server already listening at a URL, over one keep-alive
+  connection per client.
+
+In-process, each client has its own address and GitHub token, so per-client
+throttles see thousands of clients rather than one.
+
+A scenario is a dict (or a JSON file of one)::
+
+    {
+        "requests": [
+            {"name": "plans", "path": "/api/plans/", "weight": 5},
+            {"name": "assign_plan", "method": "POST", "weight": 1,
+             "path": "/api/app-plans/{app}/assign_plan/", "body": {"plan_id": "{plan}"},
+             "slo": {"p99_ms": 800}}
+        ],
+        "fake_github": {"repos": 20},
+        "slo": {"p99_ms": 500, "error_rate": 0.01, "min_rps": 200}
+    }
+
+``{app}`` and ``{plan}`` are replaced by a random existing AppDetail/Plan id,
+``{token}`` by the client's GitHub token and ``{client}`` by its number.
+Responses with a status of 400 or more, timeouts and connection errors count
+as errors, unless the request lists the statuses it ``expect``s.
+
+A request still running at its timeout is recorded as a timeout and left
+behind rather than awaited: cancelling an in-process ASGI request waits for
+its sync view's thread. Requests still running at the end of the run are
+left behind the same way and reported as ``unfinished``, so the duration and
+rates cover the requested duration only. A run that completes no request
+misses its SLOs.
+"""
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import re
+import resource
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from django.db import transaction
+
+from . import responsecache
+from .models import AppDetail, AppPlan, AuthUser, GithbRepo, Plan, refresh_current_plans
+
+SCENARIOS = {
+    'read': {
+        'requests': [
+            {'name': 'plans', 'path': '/api/plans/', 'weight': 3},
+            {'name': 'apps', 'path': '/api/apps/', 'weight': 2},
+            {'name': 'app', 'path': '/api/apps/{app}/', 'weight': 2},
+            {'name': 'current_plan', 'path': '/api/apps/{app}/current_plan/', 'weight': 1},
+        ],
+        'slo': {'p99_ms': 1000, 'error_rate': 0.01},
+    },
+    'mixed': {
+        'requests': [
+            {'name': 'plans', 'path': '/api/plans/', 'weight': 4},
+            {'name': 'apps', 'path': '/api/apps/', 'weight': 3},
+            {'name': 'app', 'path': '/api/apps/{app}/', 'weight': 2},
+            {
+                'name': 'assign_plan', 'method': 'POST', 'path': '/api/app-plans/{app}/assign_plan/',
+                'body': {'plan_id': '{plan}'}, 'weight': 1,
+            },
+            {
+                'name': 'github_repos', 'method': 'POST', 'path': '/api/auth/github/repo/',
+                'body': {'access_token': '{token}'}, 'weight': 1,
+            },
+        ],
+        'fake_github': {'repos': 20},
+        'slo': {'p99_ms': 2000, 'error_rate': 0.01},
+    },
+    'github': {
+        'requests': [
+            {
+                'name': 'github_repos', 'method': 'POST', 'path': '/api/auth/github/repo/',
+                'body': {'access_token': '{token}'}, 'weight': 3,
+            },
+            {
+                'name': 'fetch_details', 'method': 'GET', 'path': '/api/auth/github/fetch-details/',
+                'body': {'access_token': '{token}'}, 'weight': 1,
+            },
+        ],
+        # Distinct tokens log in as distinct users, as on GitHub.
+        'fake_github': {'repos': 10, 'branches': 2, 'users_by_token': True},
+        'slo': {'p99_ms': 3000, 'error_rate': 0.01},
+    },
+}
+
+SLO_KEYS = ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms', 'error_rate', 'min_rps')
+PLACEHOLDER = re.compile(r'\{(app|plan|token|client)\}')
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+# Scenarios.
+
+@dataclass
+class RequestSpec:
+    name: str
+    path: str
+    method: str = 'GET'
+    body: object = None
+    headers: dict = field(default_factory=dict)
+    weight: float = 1
+    expect: tuple = ()
+    slo: dict = field(default_factory=dict)
+
+    def placeholders(self):
+        return set(PLACEHOLDER.findall(self.path + json.dumps(self.body)))
+
+
+@dataclass
+class Scenario:
+    name: str
+    requests: list
+    slo: dict = field(default_factory=dict)
+    fake_github: dict = None
+
+    def placeholders(self):
+        return set().union(*(spec.placeholders() for spec in self.requests))
+
+
+def check_slo(slo, where):
+    unknown = set(slo) - set(SLO_KEYS)
+    if unknown:
+        raise ScenarioError(f"Unknown SLO keys in {where}: {', '.join(sorted(unknown))}")
+    for key, value in slo.items():
+        if not isinstance(value, (int, float)) or value < 0:
+            raise ScenarioError(f"SLO {key} in {where} must be a non-negative number")
+    return dict(slo)
+
+
+def load_scenario(name_or_path):
+    """A built-in scenario by name, or one read from a JSON file."""
+    if name_or_path in SCENARIOS:
+        name, data = name_or_path, SCENARIOS[name_or_path]
+    else:
+        try:
+            with open(name_or_path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise ScenarioError(
+                f"No scenario file {name_or_path!r}; built-in scenarios are {', '.join(SCENARIOS)}"
+            )
+        except ValueError as exc:
+            raise ScenarioError(f"{name_or_path} is not valid JSON: {exc}")
+        name = os.path.splitext(os.path.basename(name_or_path))[0]
+    if not isinstance(data, dict) or not data.get('requests'):
+        raise ScenarioError(f"Scenario {name!r} has no requests")
+
+    specs = []
+    for index, item in enumerate(data['requests']):
+        if not isinstance(item, dict) or not item.get('path', '').startswith('/'):
+            raise ScenarioError(f"Request {index} of {name!r} needs a path starting with /")
+        spec = RequestSpec(
+            name=item.get('name') or f"{item.get('method', 'GET')} {item['path']}",
+            path=item['path'],
+            method=item.get('method', 'GET').upper(),
+            body=item.get('body'),
+            headers=item.get('headers', {}),
+            weight=item.get('weight', 1),
+            expect=tuple(item.get('expect', ())),
+            slo=check_slo(item.get('slo', {}), item.get('name') or item['path']),
+        )
+        if not isinstance(spec.weight, (int, float)) or spec.weight <= 0:
+            raise ScenarioError(f"Request {spec.name!r} needs a positive weight")
+        specs.append(spec)
+    return Scenario(name=name, requests=specs, slo=check_slo(data.get('slo', {}), name), fake_github=data.get('fake_github'))
+
+
+def seed(apps):
+    """Make sure there are plans and at least ``apps`` apps to draw ids from."""
+    if not Plan.objects.exists():
+        Plan.objects.bulk_create([
+            Plan(plan_type=plan_type, cpu=cpu, memory=cpu * 2, storage=cpu * 10, bandwidth=cpu * 100, monthly_cost=cpu * 10)
+            for plan_type, cpu in (('starter', 1), ('pro', 4), ('enterprise', 16))
+        ])
+        # bulk_create skips post_save: invalidate cached plans and the catalog.
+        responsecache.bump(Plan)
+    missing = apps - AppDetail.objects.count()
+    if missing <= 0:
+        return 0
+    user, _ = AuthUser.objects.get_or_create(uid=0, provider='loadtest')
+    repo, _ = GithbRepo.objects.get_or_create(organizer=user, repository='loadtest')
+    plan_ids = list(Plan.objects.values_list('pk', flat=True))
+    with transaction.atomic():
+        created = AppDetail.objects.bulk_create(
+            [AppDetail(organizer=repo, region='loadtest', framework='react') for _ in range(missing)],
+            batch_size=1000,
+        )
+        AppPlan.objects.bulk_create([AppPlan(app=app, plan_id=random.choice(plan_ids)) for app in created], batch_size=1000)
+        refresh_current_plans([app.pk for app in created])
+    return missing
+
+
+def id_pools(scenario, limit=10000):
+    pools = {}
+    if 'app' in scenario.placeholders():
+        pools['app'] = list(AppDetail.objects.order_by().values_list('pk', flat=True)[:limit])
+    if 'plan' in scenario.placeholders():
+        pools['plan'] = list(Plan.objects.order_by().values_list('pk', flat=True)[:limit])
+    empty = [name for name, ids in pools.items() if not ids]
+    if empty:
+        raise ScenarioError(f"Scenario {scenario.name!r} needs existing {' and '.join(empty)} rows; pass --seed")
+    return pools
+
+
+class Client:
+    def __init__(self, number, pools):
+        self.number = number
+        self.address = f'10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}'
+        self.token = f'gho_loadtest{number:028d}'
+        self.pools = pools
+        self.connection = None
+
+    def fill(self, text):
+        def replace(match):
+            name = match.group(1)
+            if name == 'token':
+                return self.token
+            if name == 'client':
+                return str(self.number)
+            return str(random.choice(self.pools[name]))
+        return PLACEHOLDER.sub(replace, text)
+
+    def build(self, spec):
+        """``(method, path, headers, body bytes)`` for one request of ``spec``."""
+        headers = {'accept': 'application/json', **{k.lower(): v for k, v in spec.headers.items()}}
+        body = b''
+        if spec.body is not None:
+            body = self.fill(json.dumps(spec.body)).encode()
+            headers.setdefault('content-type', 'application/json')
+        return spec.method, self.fill(spec.path), headers, body
+
+
+# Targets.
+
+class ASGITarget:
+    label = 'asgi (in-process)'
+
+    def __init__(self, application):
+        self.application = application
+
+    async def request(self, client, method, path, headers, body):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'loadtest'), *((k.encode(), v.encode()) for k, v in headers.items()),
+                        (b'content-length', str(len(body)).encode())],
+            'client': (client.address, 50000), 'server': ('loadtest', 80),
+        }
+        done = asyncio.Event()
+        sent_body = False
+        status = None
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                done.set()
+
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            done.set()
+        return status
+
+    async def close(self):
+        pass
+
+
+class WSGITarget:
+    label = 'wsgi (in-process)'
+
+    def __init__(self, application, threads):
+        self.application = application
+        self.label = f'wsgi (in-process, {threads} threads)'
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='loadtest')
+
+    def call(self, client, method, path, headers, body):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method, 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'loadtest', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': client.address, 'CONTENT_LENGTH': str(len(body)),
+            'CONTENT_TYPE': headers.get('content-type', ''),
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            if name not in ('content-type', 'content-length'):
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        status = []
+        result = self.application(environ, lambda line, response_headers, exc_info=None: status.append(line))
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(status[0].split(' ', 1)[0])
+
+    async def request(self, client, method, path, headers, body):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.call, client, method, path, headers, body)
+
+    async def close(self):
+        # Requests still running were left behind at their timeout or the end
+        # of the run; don't wait for them.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HTTPTarget:
+    """A minimal HTTP/1.1 keep-alive client; one connection per virtual client."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise ScenarioError(f"Only http:// URLs are supported, not {url!r}")
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.label = f'http ({self.host}:{self.port})'
+        self.connections = []
+
+    async def request(self, client, method, path, headers, body):
+        if client.connection is None:
+            client.connection = await asyncio.open_connection(self.host, self.port)
+            self.connections.append(client.connection)
+        reader, writer = client.connection
+        head = [f'{method} {self.prefix}{path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+        head += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        try:
+            status, keep_alive = await self.read_response(reader)
+        except BaseException:
+            self.drop(client)
+            raise
+        if not keep_alive:
+            self.drop(client)
+        return status
+
+    async def read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        elif status >= 200 and status not in (204, 304):
+            await reader.read()
+            keep_alive = False
+        return status, keep_alive
+
+    def drop(self, client):
+        if client.connection is not None:
+            client.connection[1].close()
+            client.connection = None
+
+    async def close(self):
+        for _, writer in self.connections:
+            writer.close()
+
+
+# Measurement.
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak rather than current outside Linux; ru_maxrss is in KiB there.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)    # name -> seconds
+        self.statuses = defaultdict(Counter)  # name -> status (or exception name) -> count
+        self.errors = Counter()               # name -> count
+        self.window = []                      # (latency, error) since the last sample
+
+        self.unfinished = 0                   # cut off by the end of the run
+
+    def record(self, name, latency, status, error):
+        self.latencies[name].append(latency)
+        self.statuses[name][status] += 1
+        if error:
+            self.errors[name] += 1
+        self.window.append((latency, error))
+
+    def take_window(self):
+        window, self.window = self.window, []
+        return window
+
+
+def summarize(latencies, errors, duration):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    ms = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        'requests': count,
+        'rps': round(count / duration, 1) if duration else 0.0,
+        'errors': errors,
+        'error_rate': round(errors / count, 4) if count else 0.0,
+        'p50_ms': ms(percentile(ordered, 0.50)),
+        'p90_ms': ms(percentile(ordered, 0.90)),
+        'p95_ms': ms(percentile(ordered, 0.95)),
+        'p99_ms': ms(percentile(ordered, 0.99)),
+        'max_ms': ms(ordered[-1] if ordered else None),
+    }
+
+
+def missed_slos(summary, slo, where):
+    """``["where: key actual > limit"]`` for every objective ``summary`` misses."""
+    missed = []
+    for key, limit in slo.items():
+        actual = summary['rps'] if key == 'min_rps' else summary[key]
+        if actual is None:
+            continue
+        if (actual < limit) if key == 'min_rps' else (actual > limit):
+            missed.append(f"{where}: {key} {actual} {'<' if key == 'min_rps' else '>'} {limit}")
+    return missed
+
+
+# Running.
+
+async def run(scenario, target, pools, clients=100, duration=10.0, max_requests=None, ramp_up=0.0,
+              think=0.0, timeout=30.0, interval=1.0):
+    """Drive ``target`` with ``clients`` concurrent clients; returns the report dict."""
+    stats = Stats()
+    weights = [spec.weight for spec in scenario.requests]
+    budget = {'left': max_requests}
+    timeline = []
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def take():
+        if budget['left'] is None:
+            return True
+        if budget['left'] <= 0:
+            return False
+        budget['left'] -= 1
+        return True
+
+    def until_deadline(seconds):
+        return asyncio.sleep(max(0, min(seconds, deadline - time.perf_counter())))
+
+    def abandon(task):
+        # Cancelled but not awaited; see the module docstring.
+        abandoned.add(task)
+        task.add_done_callback(lambda task: abandoned.discard(task) or task.cancelled() or task.exception())
+        task.cancel()
+
+    async def client_loop(client):
+        if ramp_up:
+            await until_deadline(ramp_up * client.number / clients)
+        while time.perf_counter() < deadline and take():
+            spec = random.choices(scenario.requests, weights)[0]
+            method, path, headers, body = client.build(spec)
+            start = time.perf_counter()
+            task = asyncio.ensure_future(target.request(client, method, path, headers, body))
+            limit = min(timeout, deadline - start)
+            await asyncio.wait({task}, timeout=max(limit, 0))
+            if not task.done():
+                abandon(task)
+                if limit < timeout:
+                    stats.unfinished += 1
+                    return
+                status, error = 'timeout', True
+            else:
+                try:
+                    status = task.result()
+                    error = status not in spec.expect if spec.expect else status is None or status >= 400
+                except Exception as exc:
+                    status, error = type(exc).__name__, True
+            stats.record(spec.name, time.perf_counter() - start, status, error)
+            if think:
+                await until_deadline(think)
+
+    async def sample():
+        cpu, wall = time.process_time(), time.perf_counter()
+        while True:
+            await asyncio.sleep(interval)
+            now_cpu, now = time.process_time(), time.perf_counter()
+            window = stats.take_window()
+            ordered = sorted(latency for latency, _ in window)
+            p99 = percentile(ordered, 0.99)
+            timeline.append({
+                't': round(now - started, 2),
+                'rps': round(len(window) / (now - wall), 1),
+                'errors': sum(1 for _, error in window if error),
+                'p99_ms': None if p99 is None else round(p99 * 1000, 2),
+                'cpu_percent': round(100 * (now_cpu - cpu) / (now - wall), 1),
+                'rss_mb': round(rss_bytes() / 2 ** 20, 1),
+            })
+            cpu, wall = now_cpu, now
+
+    abandoned = set()
+    sampler = asyncio.create_task(sample())
+    try:
+        await asyncio.gather(*(client_loop(Client(number, pools)) for number in range(clients)))
+        elapsed = time.perf_counter() - started
+    finally:
+        sampler.cancel()
+        await target.close()
+
+    names = [spec.name for spec in scenario.requests]
+    by_name = {
+        name: {**summarize(stats.latencies[name], stats.errors[name], elapsed),
+               'statuses': {str(status): n for status, n in stats.statuses[name].most_common()}}
+        for name in dict.fromkeys(names) if stats.latencies[name]
+    }
+    overall = summarize([latency for values in stats.latencies.values() for latency in values], sum(stats.errors.values()), elapsed)
+
+    missed = missed_slos(overall, scenario.slo, 'overall')
+    if not overall['requests']:
+        missed.append("overall: no requests completed")
+    for spec in scenario.requests:
+        if spec.slo and spec.name in by_name:
+            missed += missed_slos(by_name[spec.name], spec.slo, spec.name)
+    return {
+        'scenario': scenario.name,
+        'target': target.label,
+        'clients': clients,
+        'duration': round(elapsed, 2),
+        'overall': overall,
+        'unfinished': stats.unfinished,
+        'requests': by_name,
+        'timeline': timeline,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'missed_slos': missed,
+    }
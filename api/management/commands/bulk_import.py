@@ -0,0 +1,160 @@
+import csv
+import itertools
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+
+from api import responsecache
+from api.models import AppDetail, AppPlan, GithbRepo, ImportCheckpoint, Plan, refresh_current_plans
+from api.renderers import orjson
+from api.search import index_many
+from api.serializers import AppDetailSerializer, AppPlanSerializer, OrganizerGithubSerializer, PlanSerializer
+
+TARGETS = {
+    'repos': (GithbRepo, OrganizerGithubSerializer),
+    'apps': (AppDetail, AppDetailSerializer),
+    'plans': (Plan, PlanSerializer),
+    'app-plans': (AppPlan, AppPlanSerializer),
+}
+
+
+class LookupRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField resolving ids from a preloaded ``{pk: instance}`` map."""
+
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return self.lookup[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+def read_ndjson(fh):
+    loads = orjson.loads if orjson is not None else json.loads
+    for line in fh:
+        if line.strip():
+            yield loads(line)
+
+
+def read_csv(fh):
+    yield from csv.DictReader(fh)
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream NDJSON or CSV records into repos, apps, plans or app-plans, validating "
+        "them with the API serializers and writing with bulk_create in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=sorted(TARGETS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keep-ids', action='store_true', help="Insert rows with the ids from the file.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of a previous run.")
+        parser.add_argument('--errors', help="Write rejected rows as NDJSON to this file.")
+        parser.add_argument('--strict', action='store_true', help="Stop at the first invalid row.")
+
+    def handle(self, *args, **options):
+        model, serializer_class = TARGETS[options['target']]
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        batch_size = options['batch_size']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+
+        source = f"{options['target']}:{os.path.abspath(path)}"
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=source)
+        if options['restart']:
+            checkpoint.rows_done = 0
+            checkpoint.save(update_fields=['rows_done', 'updated_at'])
+        skip = checkpoint.rows_done
+        if skip:
+            self.stdout.write(f"Resuming after {skip} rows")
+
+        errors_fh = open(options['errors'], 'a') if options['errors'] else None
+        created = rejected = 0
+        start = time.perf_counter()
+        try:
+            with open(path, newline='' if fmt == 'csv' else None) as fh:
+                records = read_csv(fh) if fmt == 'csv' else read_ndjson(fh)
+                records = itertools.islice(records, skip, None)
+                line = skip
+                while True:
+                    batch = list(itertools.islice(records, batch_size))
+                    if not batch:
+                        break
+                    objs, invalid = self.validate(model, serializer_class, batch, line, options['keep_ids'])
+                    if invalid and options['strict']:
+                        raise CommandError(f"Row {invalid[0]['row']}: {invalid[0]['errors']}")
+                    for error in invalid:
+                        if errors_fh:
+                            errors_fh.write(json.dumps(error) + '\n')
+
+                    with transaction.atomic():
+                        model.objects.bulk_create(objs)
+                        # bulk_create skips post_save and Model.save(), so
+                        # maintain the search index and current plans here.
+                        if model is GithbRepo:
+                            index_many(objs)
+                        elif model is AppPlan:
+                            refresh_current_plans({obj.app_id for obj in objs})
+                        line += len(batch)
+                        ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(rows_done=line)
+                    if model is Plan:
+                        # Once committed: cached plan responses and every
+                        # worker's plan-matching catalog follow this.
+                        responsecache.bump(Plan)
+
+                    created += len(objs)
+                    rejected += len(invalid)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"{line} rows read, {created} created, {rejected} rejected "
+                        f"({(line - skip) / elapsed:,.0f} rows/s)"
+                    )
+        finally:
+            if errors_fh:
+                errors_fh.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} {options['target']} in {elapsed:.1f}s, {rejected} rejected"
+        ))
+
+    def validate(self, model, serializer_class, batch, offset, keep_ids):
+        serializer = serializer_class(data=batch, many=True)
+        child = serializer.child
+
+        # One in_bulk() per foreign key per batch instead of a query per row.
+        for name, field in list(child.fields.items()):
+            if not isinstance(field, serializers.PrimaryKeyRelatedField) or field.read_only:
+                continue
+            ids = {int(row[name]) for row in batch if str(row.get(name) or '').isdigit()}
+            lookup = field.queryset.in_bulk(ids) if ids else {}
+            child.fields[name] = LookupRelatedField(
+                lookup, queryset=field.queryset, required=field.required, allow_null=field.allow_null,
+            )
+
+        objs, invalid = [], []
+        for index, row in enumerate(batch):
+            try:
+                validated = child.run_validation(row)
+            except serializers.ValidationError as exc:
+                invalid.append({'row': offset + index + 1, 'errors': exc.detail, 'data': row})
+                continue
+            obj = model(**validated)
+            if keep_ids and row.get('id') not in (None, ''):
+                obj.pk = int(row['id'])
+            objs.append(obj)
+        return objs, invalid
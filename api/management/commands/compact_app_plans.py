@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import AppDetail, AppPlan, AppPlanArchive, refresh_current_plans
+
+
+class Command(BaseCommand):
+    help = (
+        "Move AppPlan history older than --older-than days into AppPlanArchive, collapsing "
+        "consecutive assignments of the same plan. Each app's current assignment is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=90, help="Age in days (default 90).")
+        parser.add_argument('--batch-size', type=int, default=500, help="Apps per transaction.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        archived = runs = 0
+        last_app = 0
+        # Apps assigned before current_plan existed have no pointer yet.
+        refresh_current_plans(AppDetail.objects.filter(current_plan_assigned_at__isnull=True).values('pk'))
+        while True:
+            app_ids = list(
+                AppPlan.objects.filter(created_at__lt=cutoff, app_id__gt=last_app)
+                .order_by('app_id').values_list('app_id', flat=True).distinct()[:batch_size]
+            )
+            if not app_ids:
+                break
+            last_app = app_ids[-1]
+            with transaction.atomic():
+                moved, written = self.compact(app_ids, cutoff)
+            archived += moved
+            runs += written
+            self.stdout.write(f"{archived} assignments archived into {runs} rows")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} assignments into {runs} rows in {time.perf_counter() - start:.1f}s"
+        ))
+
+    def compact(self, app_ids, cutoff):
+        current = dict(AppDetail.objects.filter(pk__in=app_ids).values_list('pk', 'current_plan_assigned_at'))
+        rows = (
+            AppPlan.objects.filter(app_id__in=app_ids, created_at__lt=cutoff)
+            .order_by('app_id', 'created_at', 'id').values_list('id', 'app_id', 'plan_id', 'created_at')
+        )
+        tails = {
+            archive.app_id: archive
+            for archive in AppPlanArchive.objects.filter(app_id__in=app_ids).order_by('app_id', 'last_assigned_at')
+        }
+
+        archived_ids, new_runs, extended = [], [], {}
+        for app_id, history in groupby(rows, key=lambda row: row[1]):
+            history = list(history)
+            if current[app_id] is None or history[-1][3] >= current[app_id]:
+                # The latest assignment is the current plan; it stays in AppPlan.
+                history.pop()
+            tail = tails.get(app_id)
+            for pk, _, plan_id, created_at in history:
+                archived_ids.append(pk)
+                if tail is not None and tail.plan_id == plan_id:
+                    tail.last_assigned_at = created_at
+                    tail.assignments += 1
+                    if tail.pk is not None:
+                        extended[tail.pk] = tail
+                else:
+                    tail = AppPlanArchive(
+                        app_id=app_id, plan_id=plan_id, first_assigned_at=created_at, last_assigned_at=created_at,
+                    )
+                    new_runs.append(tail)
+
+        AppPlanArchive.objects.bulk_update(extended.values(), ['last_assigned_at', 'assignments'])
+        AppPlanArchive.objects.bulk_create(new_runs)
+        # Queryset delete skips AppPlan.delete(): the current plans don't change.
+        AppPlan.objects.filter(pk__in=archived_ids).delete()
+        return len(archived_ids), len(new_runs)
@@ -0,0 +1,117 @@
+import asyncio
+import contextlib
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils.module_loading import import_string
+
+from api import loadtest
+from api.fakegithub import FakeGitHub
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the API with concurrent asyncio clients, in-process (ASGI or WSGI) or against a "
+        "running server; fails when the scenario's SLOs are missed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', nargs='?', default='read', help=f"Built-in scenario ({', '.join(loadtest.SCENARIOS)}) or a JSON file.")
+        parser.add_argument('--target', choices=['asgi', 'wsgi'], default='asgi', help="In-process application to drive.")
+        parser.add_argument('--url', help="Drive a server listening at this http:// URL instead.")
+        parser.add_argument('--clients', type=int, default=100, help="Concurrent clients.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run.")
+        parser.add_argument('--requests', type=int, help="Stop after this many requests.")
+        parser.add_argument('--ramp-up', type=float, default=0, help="Seconds over which clients start.")
+        parser.add_argument('--think', type=float, default=0, help="Seconds each client waits between requests.")
+        parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request counts as an error.")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds between CPU/RSS/throughput samples.")
+        parser.add_argument('--seed', type=int, default=0, help="Create plans and up to this many apps first.")
+        parser.add_argument('--slo', action='append', default=[], metavar='KEY=VALUE', help=f"Override an overall SLO ({', '.join(loadtest.SLO_KEYS)}).")
+        parser.add_argument('--json', help="Also write the full report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            scenario = loadtest.load_scenario(options['scenario'])
+            scenario.slo.update(loadtest.check_slo(self.parse_slos(options['slo']), '--slo'))
+            if options['seed']:
+                self.stdout.write(f"Seeded {loadtest.seed(options['seed'])} apps")
+            pools = loadtest.id_pools(scenario)
+            if options['url']:
+                target = loadtest.HTTPTarget(options['url'])
+            elif options['target'] == 'wsgi':
+                target = loadtest.WSGITarget(import_string('kubern_test.wsgi.application'), options['threads'])
+            else:
+                target = loadtest.ASGITarget(import_string('kubern_test.asgi.application'))
+        except loadtest.ScenarioError as exc:
+            raise CommandError(exc)
+
+        with self.fake_github(scenario, in_process=not options['url']):
+            report = asyncio.run(loadtest.run(
+                scenario, target, pools,
+                clients=options['clients'], duration=options['duration'], max_requests=options['requests'],
+                ramp_up=options['ramp_up'], think=options['think'], timeout=options['timeout'],
+                interval=options['interval'],
+            ))
+
+        self.print_report(report)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if report['missed_slos']:
+            raise CommandError("Missed SLOs:\n  " + "\n  ".join(report['missed_slos']))
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['overall']['requests']} requests in {report['duration']:.1f}s, all SLOs met"
+        ))
+
+    def parse_slos(self, values):
+        slos = {}
+        for value in values:
+            key, _, number = value.partition('=')
+            try:
+                slos[key] = float(number)
+            except ValueError:
+                raise CommandError(f"--slo expects KEY=NUMBER, got {value!r}")
+        return slos
+
+    @contextlib.contextmanager
+    def fake_github(self, scenario, in_process):
+        if scenario.fake_github is None or not in_process:
+            # A remote server calls whatever GitHub it is configured with.
+            yield None
+            return
+        with FakeGitHub(**scenario.fake_github) as fake, override_settings(
+            TOKEN_URL=fake.url('/login/oauth/access_token'),
+            USER_INFO_URL=fake.url('/user'),
+            USER_REPO_URL=fake.url('/user/repos'),
+        ):
+            yield fake
+
+    def print_report(self, report):
+        overall = report['overall']
+        self.stdout.write(
+            f"Scenario '{report['scenario']}' against {report['target']}: {report['clients']} clients, "
+            f"{report['duration']:.1f}s, {overall['requests']} requests, {overall['rps']} req/s, "
+            f"{overall['error_rate']:.2%} errors"
+            + (f", {report['unfinished']} unfinished at the end" if report['unfinished'] else "")
+        )
+        self.stdout.write(f"  {'request':<20} {'count':>8} {'req/s':>8} {'err%':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}  statuses")
+        for name, row in [*report['requests'].items(), ('overall', {**overall, 'statuses': {}})]:
+            latencies = ' '.join(
+                f"{'-':>8}" if row[key] is None else f"{row[key]:8.1f}" for key in ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms')
+            )
+            statuses = ' '.join(f"{status}:{n}" for status, n in row['statuses'].items())
+            self.stdout.write(
+                f"  {name:<20} {row['requests']:8d} {row['rps']:8.1f} {row['error_rate'] * 100:6.2f}% {latencies}  {statuses}"
+            )
+        if report['timeline']:
+            self.stdout.write(f"  {'t':>6} {'req/s':>8} {'errors':>7} {'p99 ms':>8} {'cpu%':>6} {'rss MB':>8}")
+            for sample in report['timeline']:
+                p99 = '-' if sample['p99_ms'] is None else f"{sample['p99_ms']:.1f}"
+                self.stdout.write(
+                    f"  {sample['t']:6.1f} {sample['rps']:8.1f} {sample['errors']:7d} {p99:>8} "
+                    f"{sample['cpu_percent']:6.1f} {sample['rss_mb']:8.1f}"
+                )
+        self.stdout.write(f"  peak RSS {report['peak_rss_mb']} MB")
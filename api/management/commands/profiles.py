@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import profiling
+
+
+class Command(BaseCommand):
+    help = "List the slowest requests captured by ProfilingMiddleware, or print a profiling header token."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help="Number of profiles to list.")
+        parser.add_argument('--view', help="Only list profiles of this view name.")
+        parser.add_argument('--frames', type=int, default=3, help="Hottest leaf frames to show per profile.")
+        parser.add_argument('--token', action='store_true', help=f"Print a signed {settings.PROFILE_HEADER} value and exit.")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profiling.profile_token())
+            return
+
+        summaries = profiling.load_summaries()
+        if options['view']:
+            summaries = [summary for summary in summaries if summary['view'] == options['view']]
+        if not summaries:
+            self.stdout.write(f"No profiles in {settings.PROFILE_DIR}")
+            return
+
+        summaries.sort(key=lambda summary: summary['duration'], reverse=True)
+        for summary in summaries[:options['limit']]:
+            split = ', '.join(
+                f"{category} {share:.0%}"
+                for category, share in sorted(summary['split'].items(), key=lambda item: -item[1])
+            )
+            self.stdout.write(
+                f"{summary['duration'] * 1000:9.1f} ms  {summary['method']} {summary['path']} "
+                f"[{summary['view']}] status={summary['status']} samples={summary['samples']}"
+            )
+            if split:
+                self.stdout.write(f"             {split}")
+            for frame, count in profiling.top_frames(summary['name'], limit=options['frames']):
+                self.stdout.write(f"             {count:5d}  {frame}")
+            self.stdout.write(f"             {settings.PROFILE_DIR}/{summary['name']}.collapsed")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from api import idempotency
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key responses older than IDEMPOTENCY_TTL and abandoned claims."
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Deleted {idempotency.purge()} idempotency keys"))
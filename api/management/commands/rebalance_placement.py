@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import placement
+
+
+class Command(BaseCommand):
+    help = (
+        "Plan moves that relieve overcommitted nodes, drain unschedulable ones and place "
+        "apps without a node, best-fit-decreasing. Only prints the plan unless --apply is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--region', help="Only rebalance this region.")
+        parser.add_argument('--apply', action='store_true', help="Write the planned moves.")
+        parser.add_argument('--refresh', action='store_true', help="Recompute node usage counters first.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['refresh']:
+            placement.refresh_usage()
+        rebalance = placement.plan_rebalance(options['region'])
+        planned = time.perf_counter() - start
+        self.stdout.write(
+            f"{rebalance.overcommitted} overcommitted nodes, {len(rebalance.moves)} moves, "
+            f"{len(rebalance.unplaceable)} apps without room (planned in {planned:.2f}s)"
+        )
+        if options['verbosity'] > 1:
+            for app_id, from_node, to_node, region in rebalance.moves:
+                self.stdout.write(f"app {app_id}: {from_node or '-'} -> {to_node} ({region})")
+
+        if options['apply']:
+            moved = placement.apply_rebalance(rebalance)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(f"Moved {moved} apps in {elapsed:.1f}s"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import search
+from api.models import GithbRepo
+
+
+class Command(BaseCommand):
+    help = "Rebuild the repository search index from scratch."
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stdout.write("The database has no FTS5 support; search runs unindexed.")
+            return
+        start = time.perf_counter()
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {GithbRepo.objects.count()} repositories in {time.perf_counter() - start:.1f}s"
+        ))
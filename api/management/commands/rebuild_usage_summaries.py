@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every OwnerUsageSummary from apps, plans and database plans. "
+        "With --check, only report summaries that differ from a full recompute."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Report drift without writing; exit 1 if any.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['check']:
+            drift = usage.check()
+            for owner_id, field, stored, expected in drift:
+                self.stdout.write(f"owner {owner_id}: {field} is {stored}, expected {expected}")
+            elapsed = time.perf_counter() - start
+            if drift:
+                owners = len({owner_id for owner_id, *_ in drift})
+                raise CommandError(f"{owners} usage summaries out of date ({elapsed:.1f}s)")
+            self.stdout.write(self.style.SUCCESS(f"Usage summaries consistent ({elapsed:.1f}s)"))
+            return
+
+        owners = usage.recompute()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt usage summaries of {owners} owners in {elapsed:.1f}s"))
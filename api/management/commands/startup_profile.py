@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import startup
+
+# Runs in a fresh interpreter under -X importtime; every import it triggers is
+# reported on stderr, after the phase marker that was current at the time.
+CHILD = """
+import json, sys, time
+
+def phase(name):
+    sys.stderr.write(f'phase: {name}\\n')
+    sys.stderr.flush()
+    return time.perf_counter()
+
+timings = {}
+start = phase('setup')
+import django
+django.setup()
+start, timings['setup'] = phase('application'), time.perf_counter() - start
+if %(asgi)r:
+    from django.core.asgi import get_asgi_application as get_application
+else:
+    from django.core.wsgi import get_wsgi_application as get_application
+get_application()
+start, timings['application'] = phase('first_request'), time.perf_counter() - start
+# What the first request imports: the URLconf with every view, and DRF's
+# renderer, parser and authentication classes.
+from django.urls import get_resolver
+get_resolver().url_patterns
+from rest_framework.settings import api_settings
+for name in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES'):
+    getattr(api_settings, name)
+timings['first_request'] = time.perf_counter() - start
+if %(warmup)r:
+    start = phase('warmup')
+    from api.startup import warm
+    timings['warmup_steps'] = warm()
+    timings['warmup'] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+PHASES = ('setup', 'application', 'first_request', 'warmup')
+
+
+class Command(BaseCommand):
+    help = "Start the app in a fresh interpreter and report where startup time goes, import by import."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=['full', 'api'], default=settings.RUNTIME_PROFILE, help="RUNTIME_PROFILE to start with.")
+        parser.add_argument('--asgi', action='store_true', help="Build the ASGI instead of the WSGI application.")
+        parser.add_argument('--no-warmup', action='store_true', help="Skip api.startup.warm().")
+        parser.add_argument('--limit', type=int, default=20, help="Number of modules and packages to list.")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, RUNTIME_PROFILE=options['profile'])
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+        script = CHILD % {'asgi': options['asgi'], 'warmup': not options['no_warmup']}
+        child = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if child.returncode:
+            raise CommandError(f"Startup failed:\n{child.stderr[-2000:]}")
+        timings = json.loads(child.stdout.strip().splitlines()[-1])
+        imports = startup.parse_importtime(child.stderr.splitlines())
+
+        total = sum(self_us for _, _, self_us, _, _ in imports) / 1000
+        self.stdout.write(f"Profile '{options['profile']}': {len(imports)} modules imported, {total:.1f} ms in imports")
+        for phase in PHASES:
+            if phase not in timings:
+                continue
+            phase_imports = [entry for entry in imports if entry[0] == phase]
+            self.stdout.write(
+                f"  {phase:<12} {timings[phase] * 1000:8.1f} ms  "
+                f"({len(phase_imports)} imports, {sum(entry[2] for entry in phase_imports) / 1000:.1f} ms)"
+            )
+        for step, seconds in timings.get('warmup_steps', {}).items():
+            self.stdout.write(f"    {step:<12} {seconds * 1000:6.1f} ms")
+
+        self.stdout.write("Slowest imports (cumulative / self ms, phase):")
+        slowest = sorted(imports, key=lambda entry: entry[3], reverse=True)[:options['limit']]
+        for phase, module, self_us, cumulative_us, depth in slowest:
+            self.stdout.write(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:7.1f}  {phase:<12} {'  ' * depth}{module}")
+
+        self.stdout.write("Packages by own import time (ms, modules):")
+        packages = sorted(startup.by_package(imports).items(), key=lambda item: item[1][0], reverse=True)
+        for name, (self_us, count) in packages[:options['limit']]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} {count:5d}  {name}")
+
+        self.stdout.write(self.style.SUCCESS(f"Started and ready for a first request in {sum(timings.get(phase, 0) for phase in PHASES) * 1000:.1f} ms"))
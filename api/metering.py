@@ -0,0 +1,408 @@
+"""
+Usage metering: batched event ingestion and time-bucketed rollups.
+
+``POST /api/metering/events/`` takes a batch of events
+
+    {"app": 12, "ts": 1760000000, "cpu_seconds": 1.5, "bytes_out": 20480, "gb_stored": 3.2}
+
+(``ts`` in epoch seconds or ISO-8601). Events are checked with plain Python
+comparisons rather than a serializer per event, summed per app and minute, and
+merged into an in-process buffer. The buffer is flushed every
+METERING_FLUSH_INTERVAL seconds, or sooner once METERING_FLUSH_MAX_PENDING
+app-minutes are waiting. A flush rolls each minute up into its hour and day
+and upserts all three in one ``executemany`` that adds to existing buckets
+(``INSERT ... ON CONFLICT DO UPDATE``), so the write volume follows the
+number of active app-minutes rather than the number of events.
+``gb_stored`` is a gauge, so buckets keep its peak rather than its sum.
+
+Buffered events are lost if the process dies before a flush. With
+METERING_WRITE_BEHIND=False each request's batch is written before the
+response.
+
+``invoice`` covers a period with the coarsest buckets that fit: whole days,
+then hours, then minutes at the edges. It prices every app of an owner in one
+grouped query, each bucket at the plan the app's AppPlan history had in
+effect when the bucket started.
+"""
+import atexit
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Max, Min, OuterRef, Q, Subquery, Sum
+
+from .models import AppDetail, AppPlan, UsageBucket
+
+MINUTE, HOUR, DAY = UsageBucket.MINUTE, UsageBucket.HOUR, UsageBucket.DAY
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+CENT = Decimal('0.01')
+GB = 10 ** 9
+NUMBER = (int, float)
+# Timestamps from 1970 up to the end of year 9999, which datetime can hold.
+MAX_TS = 253402300800
+# Keeps `pk__in` lists under SQLite's bound-parameter limit.
+ID_CHUNK = 10000
+
+
+def timestamp(value):
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=dt_timezone.utc)
+        value = parsed.timestamp()
+    elif type(value) not in NUMBER:
+        raise ValueError("ts must be epoch seconds or an ISO-8601 string")
+    if not 0 <= value < MAX_TS:
+        raise ValueError("ts is out of range")
+    return value
+
+
+def quantity(event, name):
+    value = event.get(name, 0)
+    if type(value) not in NUMBER or not 0 <= value < math.inf:
+        raise ValueError(f"{name} must be a non-negative number")
+    return value
+
+
+def combine(into, values):
+    into[0] += values[0]
+    into[1] += values[1]
+    if values[2] > into[2]:
+        into[2] = values[2]
+    into[3] += values[3]
+
+
+def existing_apps(ids):
+    ids = list(ids)
+    found = set()
+    for offset in range(0, len(ids), ID_CHUNK):
+        found.update(AppDetail.objects.filter(pk__in=ids[offset:offset + ID_CHUNK]).values_list('pk', flat=True))
+    return found
+
+
+class KnownApps:
+    """
+    App ids seen to exist, so steady-state batches need no lookup. An app
+    deleted since is still accepted here and dropped when flushed.
+    """
+
+    def __init__(self, limit=1_000_000):
+        self.limit = limit
+        self._ids = set()
+
+    def check(self, ids):
+        missing = {app for app in ids if type(app) is int} - self._ids
+        if missing:
+            if len(self._ids) + len(missing) > self.limit:
+                self._ids = set()
+            self._ids |= existing_apps(missing)
+        return self._ids
+
+    def clear(self):
+        self._ids = set()
+
+
+known_apps = KnownApps()
+
+
+def clean(event, known):
+    """``(app, minute, values)`` of one event, or ValueError saying what is wrong with it."""
+    if not isinstance(event, dict):
+        raise ValueError("event must be an object")
+    app = event.get('app')
+    if type(app) is not int or app not in known:
+        raise ValueError(f"app {app!r} does not exist")
+    if 'ts' not in event:
+        raise ValueError("ts is required")
+    minute = int(timestamp(event['ts']) // MINUTE) * MINUTE
+    values = [quantity(event, 'cpu_seconds'), int(quantity(event, 'bytes_out')), quantity(event, 'gb_stored'), 1]
+    return app, minute, values
+
+
+def parse_events(events):
+    """
+    ``({(app_id, minute): [cpu_seconds, bytes_out, gb_stored, events]}, rejected)``
+    where ``minute`` is the epoch second the event's minute starts at.
+    """
+    known = known_apps.check(event.get('app') for event in events if isinstance(event, dict))
+    sums, rejected = {}, []
+    inf = math.inf
+    for index, event in enumerate(events):
+        # Fast path for well-formed events with numeric timestamps; anything
+        # else goes through clean(), which also explains rejections.
+        try:
+            app, ts = event['app'], event['ts']
+            cpu, out, gb = event.get('cpu_seconds', 0), event.get('bytes_out', 0), event.get('gb_stored', 0)
+            fast = (
+                type(app) is int and app in known
+                and type(ts) in NUMBER and 0 <= ts < MAX_TS
+                and type(cpu) in NUMBER and 0 <= cpu < inf
+                and type(out) is int and out >= 0
+                and type(gb) in NUMBER and 0 <= gb < inf
+            )
+        except (KeyError, TypeError, AttributeError):
+            fast = False
+        if fast:
+            key = (app, int(ts // MINUTE) * MINUTE)
+            values = [cpu, out, gb, 1]
+        else:
+            try:
+                app, minute, values = clean(event, known)
+            except ValueError as exc:
+                rejected.append({'index': index, 'error': str(exc)})
+                continue
+            key = (app, minute)
+        bucket = sums.get(key)
+        if bucket is None:
+            sums[key] = values
+        else:
+            combine(bucket, values)
+    return sums, rejected
+
+
+def rollup(sums):
+    """Minute sums as ``{(app_id, resolution, start): values}`` at every resolution."""
+    buckets = {}
+    for (app, minute), values in sums.items():
+        for resolution in RESOLUTIONS:
+            key = (app, resolution, minute - minute % resolution)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = list(values)
+            else:
+                combine(bucket, values)
+    return buckets
+
+
+def upsert_sql():
+    table = UsageBucket._meta.db_table
+    greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+    return (
+        f"INSERT INTO {table} (app_id, resolution, start, cpu_seconds, bytes_out, gb_stored, events) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (app_id, resolution, start) DO UPDATE SET "
+        f"cpu_seconds = {table}.cpu_seconds + excluded.cpu_seconds, "
+        f"bytes_out = {table}.bytes_out + excluded.bytes_out, "
+        f"gb_stored = {greatest}({table}.gb_stored, excluded.gb_stored), "
+        f"events = {table}.events + excluded.events"
+    )
+
+
+def write(sums):
+    """Add minute sums to the minute, hour and day buckets. Returns the buckets written."""
+    buckets = rollup(sums)
+    starts = {}
+    for _, _, start in buckets:
+        if start not in starts:
+            starts[start] = connection.ops.adapt_datetimefield_value(datetime.fromtimestamp(start, dt_timezone.utc))
+    with transaction.atomic():
+        # Apps deleted since their events were accepted would fail the FK check.
+        known = existing_apps({app for app, _ in sums})
+        rows = [
+            (app, resolution, starts[start], *values)
+            for (app, resolution, start), values in buckets.items() if app in known
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(upsert_sql(), rows)
+    return len(rows)
+
+
+class UsageBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        # After a failed flush, size-triggered flushes wait for this
+        # (time.monotonic()) and leave the retry to the timer.
+        self._retry_at = 0
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'METERING_WRITE_BEHIND', True)
+
+    def add(self, sums):
+        if not self.enabled:
+            write(sums)
+            return
+        with self._lock:
+            pending = self._merge(sums)
+        if pending >= settings.METERING_FLUSH_MAX_PENDING and time.monotonic() >= self._retry_at:
+            try:
+                self.flush()
+            except DatabaseError:
+                # The usage is buffered again and the timer retries it; the
+                # events were accepted either way.
+                pass
+
+    def _merge(self, sums):
+        # Called with self._lock held.
+        for key, values in sums.items():
+            bucket = self._pending.get(key)
+            if bucket is None:
+                self._pending[key] = values
+            else:
+                combine(bucket, values)
+        if self._timer is None:
+            self._timer = threading.Timer(settings.METERING_FLUSH_INTERVAL, self.flush_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+        return len(self._pending)
+
+    def pending(self):
+        with self._lock:
+            return {key: list(values) for key, values in self._pending.items()}
+
+    def flush(self):
+        """Write every buffered app-minute. Returns the number of app-minutes written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            write(pending)
+        except BaseException:
+            # Keep the usage for the next flush rather than dropping billable
+            # data. Not through add(): at the size limit it would flush again
+            # straight away, and fail the same way.
+            with self._lock:
+                self._merge(pending)
+                self._retry_at = time.monotonic() + settings.METERING_FLUSH_INTERVAL
+            raise
+        self._retry_at = 0
+        return len(pending)
+
+    def flush_in_background(self):
+        # Runs on the timer's own thread, whose connection nothing else closes.
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
+
+
+usage_buffer = UsageBuffer()
+atexit.register(usage_buffer.flush)
+
+
+def ingest(events):
+    """Validate and buffer a batch of events. Returns ``(accepted, rejected)``."""
+    sums, rejected = parse_events(events)
+    usage_buffer.add(sums)
+    return len(events) - len(rejected), rejected
+
+
+def cover(start, end):
+    """
+    ``[(resolution, lo, hi)]`` covering ``[start, end)`` (epoch seconds, whole
+    minutes) with whole days, then whole hours, then minutes.
+    """
+    ranges = []
+
+    def split(lo, hi, sizes):
+        if lo >= hi:
+            return
+        size, finer = sizes[0], sizes[1:]
+        aligned_lo, aligned_hi = -(-lo // size) * size, hi // size * size
+        if not finer:
+            ranges.append((size, lo, hi))
+        elif aligned_lo >= aligned_hi:
+            split(lo, hi, finer)
+        else:
+            ranges.append((size, aligned_lo, aligned_hi))
+            split(lo, aligned_lo, finer)
+            split(aligned_hi, hi, finer)
+
+    split(start, end, (DAY, HOUR, MINUTE))
+    return ranges
+
+
+def to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, dt_timezone.utc)
+
+
+def invoice(owner_id, start, end):
+    """
+    Metered charges of every app of ``owner_id`` between ``start`` and ``end``
+    (truncated to whole minutes). Each bucket is priced with the plan in effect
+    at its start (the latest AppPlan assigned by then), so an hour or day
+    bucket spanning a plan change is priced whole at the earlier plan; usage
+    from before an app's first assignment has no price. CPU time costs the
+    plan's ``price_per_hour`` per ``cpu`` cores. Traffic and peak storage
+    beyond the ``bandwidth``/``storage`` of the plan in effect last are charged
+    at the METERING_*_PRICE_PER_GB rates.
+    """
+    start = int(start.timestamp()) // MINUTE * MINUTE
+    end = int(end.timestamp()) // MINUTE * MINUTE
+    period = Q()
+    for resolution, lo, hi in cover(start, end):
+        period |= Q(resolution=resolution, start__gte=to_datetime(lo), start__lt=to_datetime(hi))
+
+    rows = []
+    if period:
+        assignment = AppPlan.objects.filter(app=OuterRef('app'), created_at__lte=OuterRef('start')).order_by('-created_at', '-id')
+
+        def in_effect(field):
+            return Subquery(assignment.values(field)[:1])
+
+        rows = (
+            UsageBucket.objects.filter(period, app__organizer__organizer=owner_id)
+            .values(
+                'app',
+                plan=in_effect('plan'),
+                price_per_hour=in_effect('plan__price_per_hour'),
+                cores=in_effect('plan__cpu'),
+                included_bandwidth=in_effect('plan__bandwidth'),
+                included_storage=in_effect('plan__storage'),
+            )
+            .annotate(
+                since=Min('start'),
+                total_cpu_seconds=Sum('cpu_seconds'),
+                total_bytes_out=Sum('bytes_out'),
+                peak_gb_stored=Max('gb_stored'),
+                total_events=Sum('events'),
+            )
+            .order_by('app', 'since')
+        )
+
+    # One row per app and plan in effect, oldest plan first.
+    usage = {}
+    for row in rows:
+        core_hours = Decimal(repr(row['total_cpu_seconds'])) / HOUR
+        compute = core_hours * (row['price_per_hour'] or 0) / (row['cores'] or 1)
+        line = {'plan': row['plan'], 'cpu_seconds': row['total_cpu_seconds'], 'compute': compute.quantize(CENT)}
+        app = usage.setdefault(row['app'], {'plans': [], 'bytes_out': 0, 'gb_stored': 0.0, 'events': 0})
+        app['plans'].append(line)
+        app['bytes_out'] += row['total_bytes_out']
+        app['gb_stored'] = max(app['gb_stored'], row['peak_gb_stored'])
+        app['events'] += row['total_events']
+        app['allowances'] = (row['included_bandwidth'] or 0, row['included_storage'] or 0)
+
+    bandwidth_rate = Decimal(settings.METERING_BANDWIDTH_PRICE_PER_GB)
+    storage_rate = Decimal(settings.METERING_STORAGE_PRICE_PER_GB)
+    apps, total = [], Decimal(0)
+    for app_id, app in usage.items():
+        included_bandwidth, included_storage = app.pop('allowances')
+        gb_out = Decimal(app['bytes_out']) / GB
+        bandwidth = max(gb_out - included_bandwidth, 0) * bandwidth_rate
+        storage = max(Decimal(repr(app['gb_stored'])) - included_storage, 0) * storage_rate
+        charges = {
+            'compute': sum(line['compute'] for line in app['plans']),
+            'bandwidth': bandwidth.quantize(CENT),
+            'storage': storage.quantize(CENT),
+        }
+        charges['total'] = sum(charges.values())
+        total += charges['total']
+        apps.append({
+            'app': app_id,
+            'plan': app['plans'][-1]['plan'],
+            'cpu_seconds': sum(line['cpu_seconds'] for line in app['plans']),
+            **app,
+            **charges,
+        })
+    return {'owner': owner_id, 'start': to_datetime(start), 'end': to_datetime(end), 'apps': apps, 'total': total}
@@ -0,0 +1,178 @@
+import gzip
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence
+
+from . import metrics, profiling, tracing
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+accept_encoding_re = _lazy_re_compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def parse_accept_encoding(header):
+    """Return a ``{coding: qvalue}`` mapping for an Accept-Encoding header."""
+    codings = {}
+    for part in header.split(','):
+        match = accept_encoding_re.match(part)
+        if not match:
+            continue
+        coding, qvalue = match.groups()
+        try:
+            codings[coding.lower()] = float(qvalue) if qvalue is not None else 1.0
+        except ValueError:
+            continue
+    return codings
+
+
+class CompressionMiddleware:
+    """
+    Content-negotiated brotli/gzip compression for API responses.
+
+    Responses smaller than COMPRESSION_MIN_SIZE are sent as-is, since the
+    framing overhead outweighs the savings. brotli is only offered when the
+    ``brotli`` package is installed; streaming responses are always gzipped.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def select_encoding(self, request, streaming=False):
+        codings = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        available = ['gzip'] if streaming or brotli is None else ['br', 'gzip']
+        best, best_q = None, 0.0
+        for coding in available:
+            qvalue = codings.get(coding, codings.get('*', 0.0))
+            if qvalue > best_q:
+                best, best_q = coding, qvalue
+        return best
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.select_encoding(request, streaming=response.streaming)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=settings.COMPRESSION_LEVEL)
+            else:
+                compressed = gzip.compress(response.content, compresslevel=settings.COMPRESSION_LEVEL, mtime=0)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # A strong ETag no longer matches the encoded body; weaken it.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Records per-view request latency, response size and SQL time.
+
+    Should sit first in MIDDLEWARE so the latency covers the whole stack and
+    the size is measured after compression.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        def record_query(execute, sql, params, many, context):
+            with metrics.timed('db_query_duration_seconds', view=view_label(request)):
+                return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(record_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        view = view_label(request)
+        metrics.registry.observe('http_request_duration_seconds', {'view': view, 'method': request.method, 'status': response.status_code}, elapsed)
+        if not response.streaming:
+            metrics.registry.observe('http_response_size_bytes', {'view': view}, len(response.content))
+        metrics.registry.maybe_flush()
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests carrying a valid signed PROFILE_HEADER, plus a random
+    PROFILE_SAMPLE_RATE fraction of all requests, into PROFILE_DIR.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.headers.get(settings.PROFILE_HEADER)
+        if token and profiling.valid_token(token):
+            return True
+        return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        with profiling.Sampler() as sampler:
+            response = self.get_response(request)
+        profiling.save(sampler, request, response)
+        return response
+
+
+class TracingMiddleware:
+    """
+    Opens the root span of each request, continuing an inbound W3C
+    ``traceparent``, adds a child span per SQL query and returns the root
+    span's ``traceparent`` on the response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not tracing.enabled():
+            return self.get_response(request)
+
+        def trace_query(execute, sql, params, many, context):
+            with tracing.span('sql', statement=sql, many=many):
+                return execute(sql, params, many, context)
+
+        with tracing.span(f'HTTP {request.method}', traceparent=request.headers.get('traceparent'),
+                          path=request.path) as span:
+            with connection.execute_wrapper(trace_query):
+                response = self.get_response(request)
+            span.set(view=view_label(request), status_code=response.status_code)
+        response.headers['traceparent'] = span.traceparent
+        return response
@@ -0,0 +1,243 @@
+import csv
+import decimal
+import itertools
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from . import idempotency, responsecache
+from .filters import clean_value
+from .renderers import orjson
+
+
+def parse_field_list(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class SparseFieldsetMixin:
+    """
+    Viewset mixin for ``?fields=`` / ``?omit=`` query parameters.
+
+    Trims the serializer to the requested fields and pushes the same selection
+    down to the queryset with ``.only()`` / ``.defer()``, so columns that are
+    not rendered are never read. Only applies to safe (read) requests; writes
+    always see the full serializer.
+    """
+
+    def get_sparse_fieldset(self):
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return None, None
+        params = self.request.query_params
+        return parse_field_list(params.get('fields')) or None, parse_field_list(params.get('omit')) or None
+
+    def get_serializer(self, *args, **kwargs):
+        fields, omit = self.get_sparse_fieldset()
+        if fields:
+            kwargs.setdefault('fields', fields)
+        if omit:
+            kwargs.setdefault('omit', omit)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields, omit = self.get_sparse_fieldset()
+        if fields:
+            columns = self.get_model_columns(queryset.model, fields)
+            queryset = queryset.only(queryset.model._meta.pk.name, *columns)
+        elif omit:
+            pk_name = queryset.model._meta.pk.name
+            columns = [name for name in self.get_model_columns(queryset.model, omit) if name != pk_name]
+            if columns:
+                queryset = queryset.defer(*columns)
+        return queryset
+
+    @staticmethod
+    def get_model_columns(model, names):
+        columns = []
+        for name in names:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete and not field.many_to_many:
+                columns.append(field.name)
+        return columns
+
+
+class CachedResponseMixin:
+    """
+    Viewset mixin serving GET/HEAD responses from the rendered-response
+    cache (see api.responsecache). The lookup runs after authentication,
+    permissions and throttles; a hit then returns the stored bytes without
+    running the handler, so it costs no serialization.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if getattr(cls, 'queryset', None) is not None:
+            responsecache.watch(cls.queryset.model)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.cache_miss = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        model = self.queryset.model
+        lookup = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        gen = responsecache.generation(model, lookup)
+        key = responsecache.entry_key(request)
+        lock_key = f'{key}:revalidate'
+
+        entry = cache.get(key)
+        if entry is not None and entry['gen'] == gen:
+            if time.time() - entry['created'] < settings.RESPONSE_CACHE_TIMEOUT:
+                return self.answer(request, responsecache.build_response(entry, 'HIT'))
+            if not cache.add(lock_key, 1, settings.RESPONSE_CACHE_STALE or 1):
+                # Another request is already re-rendering this entry.
+                return self.answer(request, responsecache.build_response(entry, 'STALE'))
+        self.cache_miss = (key, gen, lock_key)
+
+    def answer(self, request, response):
+        # Replace the handler DRF is about to call.
+        setattr(self, request.method.lower(), lambda *args, **kwargs: response)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        miss = getattr(self, 'cache_miss', None)
+        if miss is None:
+            return response
+        key, gen, lock_key = miss
+        response['X-Cache'] = 'MISS'
+        if response.status_code == 200:
+            def store(rendered):
+                responsecache.store(key, gen, rendered)
+                cache.delete(lock_key)
+            response.add_post_render_callback(store)
+        else:
+            cache.delete(lock_key)
+        return response
+
+
+class IdempotencyMixin:
+    """
+    Viewset mixin honouring the ``Idempotency-Key`` header on POST requests
+    (``create`` and POST actions such as ``assign_plan``); see api.idempotency.
+    """
+    idempotent_methods = ('POST',)
+
+    def dispatch(self, request, *args, **kwargs):
+        key = request.META.get(idempotency.HEADER)
+        if not key or request.method not in self.idempotent_methods:
+            return super().dispatch(request, *args, **kwargs)
+        handler = super().dispatch
+        return idempotency.run(request, key, lambda: handler(request, *args, **kwargs))
+
+
+class _Echo:
+    """File-like object whose write() returns the written line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def export_default(obj):
+    # Match the API's serializer output: decimals as strings.
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        record = dict(zip(columns, row))
+        if orjson is not None:
+            yield orjson.dumps(record, default=export_default) + b'\n'
+        else:
+            yield json.dumps(record, cls=DjangoJSONEncoder).encode() + b'\n'
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns).encode()
+    for row in rows:
+        yield writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row]).encode()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+}
+
+
+class ExportMixin:
+    """
+    Adds a streaming ``export`` list action:
+
+        GET /api/apps/export/?output=ndjson|csv&after=<id>&region=eu-west
+
+    Rows are read with ``values_list().iterator()`` in pk order and written
+    out chunk by chunk, so memory stays flat regardless of table size.
+    ``after`` resumes an interrupted export from the last id received;
+    ``export_filter_fields`` may be passed as exact-match filters (parsed like
+    api.filters, so a malformed value is a 400) and ``fields`` limits the
+    columns.
+    """
+    export_filter_fields = ()
+    export_chunk_size = 2000
+
+    def get_export_columns(self, model):
+        fields = model._meta.concrete_fields
+        requested = parse_field_list(self.request.query_params.get('fields'))
+        if requested:
+            fields = [field for field in fields if field.name in requested or field.primary_key]
+        return [field.name for field in fields], [field.attname for field in fields]
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({"error": f"Unsupported output '{output}'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.queryset.model._default_manager.order_by('pk')
+        lookups, errors = {}, {}
+        for name in self.export_filter_fields:
+            if name not in request.query_params:
+                continue
+            try:
+                lookups[name] = clean_value(queryset.model, name, request.query_params[name])
+            except DjangoValidationError as exc:
+                errors[name] = exc.messages
+        if errors:
+            raise ValidationError(errors)
+        queryset = queryset.filter(**lookups)
+        after = request.query_params.get('after')
+        if after is not None:
+            if not after.isdigit():
+                return Response({"error": "after must be an id"}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(pk__gt=int(after))
+
+        columns, attnames = self.get_export_columns(queryset.model)
+        rows = queryset.values_list(*attnames).iterator(chunk_size=self.export_chunk_size)
+        write_lines, content_type = EXPORT_FORMATS[output]
+        lines = write_lines(columns, rows)
+
+        def chunks():
+            while True:
+                chunk = b''.join(itertools.islice(lines, self.export_chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+
+        response = StreamingHttpResponse(chunks(), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{queryset.model._meta.model_name}.{output}"'
+        return response
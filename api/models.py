@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from .signals import current_plan_changed, plan_changed
 
 # Create your models here.
 
@@ -11,6 +14,10 @@ class AuthUser(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # GitHub id lookups: login and the admin search.
+        indexes = [models.Index(fields=['uid'], name='api_authuser_uid')]
+
     def __str__(self):
         return f"AuthUser_{self.uid}"
     
@@ -21,10 +28,39 @@ class GithbRepo(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # One index per list filter (OrganizerGithubViewSet.filter_fields),
+        # with created_at appended for ?ordering=created_at.
+        indexes = [
+            models.Index(fields=['organizer', 'created_at'], name='api_githbrepo_org_created'),
+            models.Index(fields=['repository', 'created_at'], name='api_githbrepo_repo_created'),
+            models.Index(fields=['created_at'], name='api_githbrepo_created'),
+        ]
+
     def __str__(self):
         return f"{self.organizer.uid}_{self.repository}"
     
 
+class Node(models.Model):
+    # A machine in a region that apps are placed on. cpu_used/memory_used sum
+    # the current plans of its apps and are maintained by api.placement; they
+    # can exceed the capacity after plan upgrades until a rebalance.
+    region = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    cpu = models.IntegerField(help_text="CPU cores")
+    memory = models.IntegerField(help_text="Memory (RAM) in GB")
+    cpu_used = models.IntegerField(default=0)
+    memory_used = models.IntegerField(default=0)
+    schedulable = models.BooleanField(default=True, help_text="False drains the node on the next rebalance")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['region', 'name'], name='api_node_region_name')]
+
+    def __str__(self):
+        return f"{self.region}/{self.name}"
+
+
 class AppDetail(models.Model):
     organizer = models.ForeignKey(GithbRepo, on_delete=models.CASCADE, blank=True, null=True) 
     region = models.CharField(max_length=255, blank=True, null=True)
@@ -34,9 +70,24 @@ class AppDetail(models.Model):
         ('expressjs', 'Express.js'),
         ('rubyonrails', 'Ruby on Rails')
     ])
+    # Latest AppPlan assignment, denormalized so the current plan is a single
+    # indexed read; kept in step by AppPlan.save()/delete().
+    current_plan = models.ForeignKey('Plan', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    current_plan_assigned_at = models.DateTimeField(blank=True, null=True)
+    # Where the app runs; set by api.placement, which also keeps `region` in step.
+    node = models.ForeignKey('Node', on_delete=models.SET_NULL, blank=True, null=True, related_name='apps')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Covers the per-repository app filter of api.search.
+            models.Index(fields=['organizer', 'region', 'framework'], name='api_appdetail_org_region_fw'),
+            models.Index(fields=['region', 'framework', 'created_at'], name='api_appdetail_region_fw'),
+            models.Index(fields=['framework', 'created_at'], name='api_appdetail_framework'),
+            models.Index(fields=['created_at'], name='api_appdetail_created'),
+        ]
+
     def __str__(self):
         return f"{self.organizer.repository} ({self.region} - {self.framework})"
     
@@ -59,6 +110,21 @@ class Plan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    # Fields whose old values are sent with plan_changed.
+    TRACKED_FIELDS = ('monthly_cost', 'cpu', 'memory', 'storage', 'bandwidth')
+
+    class Meta:
+        indexes = [models.Index(fields=['plan_type'], name='api_plan_type')]
+
+    def save(self, *args, **kwargs):
+        before = None
+        if not self._state.adding:
+            before = Plan.objects.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if before is not None:
+                plan_changed.send(sender=Plan, plan=self, before=before)
+
     def __str__(self):
         return f"{self.plan_type} Plan"
     
@@ -69,9 +135,88 @@ class AppPlan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['app', 'created_at'], name='api_appplan_app_created'),
+            models.Index(fields=['plan', 'created_at'], name='api_appplan_plan_created'),
+            models.Index(fields=['created_at'], name='api_appplan_created'),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                advance_current_plan(self)
+            else:
+                refresh_current_plans([self.app_id])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            refresh_current_plans([self.app_id])
+        return result
+
 
     def __str__(self):
         return f"{self.app.region} - {self.plan.plan_type}"
+
+
+def advance_current_plan(app_plan):
+    """Point the app at a new assignment unless a newer one is already current."""
+    apps = AppDetail.objects.filter(pk=app_plan.app_id)
+    previous = apps.select_for_update().values_list('current_plan', flat=True).first()
+    updated = apps.filter(
+        Q(current_plan_assigned_at__isnull=True) | Q(current_plan_assigned_at__lte=app_plan.created_at)
+    ).update(current_plan=app_plan.plan_id, current_plan_assigned_at=app_plan.created_at)
+    if updated and previous != app_plan.plan_id:
+        current_plan_changed.send(sender=AppDetail, changes=[(app_plan.app_id, previous, app_plan.plan_id)])
+
+
+def refresh_current_plans(app_ids):
+    """Recompute the pointer of ``app_ids`` from their history, in one UPDATE."""
+    apps = AppDetail.objects.filter(pk__in=app_ids)
+    before = dict(apps.select_for_update().values_list('pk', 'current_plan'))
+    latest = AppPlan.objects.filter(app=OuterRef('pk')).order_by('-created_at', '-id')
+    apps.update(
+        current_plan=Subquery(latest.values('plan')[:1]),
+        current_plan_assigned_at=Subquery(latest.values('created_at')[:1]),
+    )
+    changes = [
+        (pk, before[pk], plan_id)
+        for pk, plan_id in apps.values_list('pk', 'current_plan') if before.get(pk) != plan_id
+    ]
+    if changes:
+        current_plan_changed.send(sender=AppDetail, changes=changes)
+
+
+def plan_deleting(sender, instance, **kwargs):
+    # Deleting a plan cascades to its AppPlan history and nulls the pointers
+    # to it (SET_NULL, without signals); note whose pointer to recompute.
+    instance._current_plan_apps = list(AppDetail.objects.filter(current_plan=instance.pk).values_list('pk', flat=True))
+
+
+def plan_deleted(sender, instance, **kwargs):
+    app_ids = instance.__dict__.pop('_current_plan_apps', None)
+    if app_ids:
+        # Back to each app's previous assignment, if any.
+        refresh_current_plans(app_ids)
+
+
+class AppPlanArchive(models.Model):
+    # AppPlan history compacted by `manage.py compact_app_plans`: consecutive
+    # assignments of the same plan to an app collapse into one row.
+    app = models.ForeignKey(AppDetail, on_delete=models.CASCADE)
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE)
+    first_assigned_at = models.DateTimeField()
+    last_assigned_at = models.DateTimeField()
+    assignments = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [models.Index(fields=['app', 'last_assigned_at'], name='api_appplanarchive_app_last')]
+
+    def __str__(self):
+        return f"{self.app_id}: {self.plan_id} x{self.assignments}"
     
 
 class DatabasePlan(models.Model):
@@ -87,4 +232,83 @@ class DatabasePlan(models.Model):
     updated_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.owner.uid} Database Plan of {self.database_type}"
\ No newline at end of file
+        return f"{self.owner.uid} Database Plan of {self.database_type}"
+
+
+class ImportCheckpoint(models.Model):
+    # Rows of `source` already committed by `manage.py bulk_import`, updated in
+    # the same transaction as each batch so a resumed import never duplicates.
+    source = models.CharField(max_length=1024, unique=True)
+    rows_done = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.rows_done} rows)"
+
+
+class CacheGeneration(models.Model):
+    # Generation counters of api.responsecache, kept here when the cache is
+    # not shared by all workers, so a save in one worker invalidates them all.
+    key = models.CharField(max_length=255, primary_key=True)
+    value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
+class IdempotencyKey(models.Model):
+    # Claims and stored responses of api.idempotency. Inserting the primary key
+    # is the claim, atomic across workers; a row without a status is a request
+    # still running.
+    key = models.CharField(max_length=255, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True)
+    content = models.BinaryField(default=b'')
+    headers = models.JSONField(default=dict)
+    created_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.status or 'running'})"
+
+
+class OwnerUsageSummary(models.Model):
+    # An owner's current app plans plus database plans, summed. Kept up to date
+    # by deltas (see api.usage); `manage.py rebuild_usage_summaries` recomputes.
+    owner = models.OneToOneField(AuthUser, on_delete=models.CASCADE, primary_key=True, related_name='usage_summary')
+    apps = models.IntegerField(default=0, help_text="Apps with a current plan")
+    databases = models.IntegerField(default=0)
+    monthly_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cpu = models.IntegerField(default=0, help_text="CPU cores")
+    memory = models.IntegerField(default=0, help_text="Memory (RAM) in GB")
+    storage = models.IntegerField(default=0, help_text="Storage in GB")
+    bandwidth = models.IntegerField(default=0, help_text="Bandwidth in GB")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['monthly_cost'], name='api_usage_monthly_cost')]
+
+    def __str__(self):
+        return f"{self.owner_id}: {self.monthly_cost}/month"
+
+
+class UsageBucket(models.Model):
+    # Metered usage of one app, summed over [start, start + resolution seconds).
+    # Written by api.metering, which rolls every event into all three sizes.
+    MINUTE, HOUR, DAY = 60, 3600, 86400
+    RESOLUTION_CHOICES = [(MINUTE, 'minute'), (HOUR, 'hour'), (DAY, 'day')]
+
+    app = models.ForeignKey(AppDetail, on_delete=models.CASCADE)
+    resolution = models.PositiveIntegerField(choices=RESOLUTION_CHOICES)
+    start = models.DateTimeField()
+    cpu_seconds = models.FloatField(default=0)
+    bytes_out = models.BigIntegerField(default=0)
+    gb_stored = models.FloatField(default=0, help_text="Peak GB stored")
+    events = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['app', 'resolution', 'start'], name='api_usagebucket_app_res_start'),
+        ]
+
+    def __str__(self):
+        return f"{self.app_id} {self.get_resolution_display()} {self.start:%Y-%m-%d %H:%M}"
@@ -0,0 +1,251 @@
+"""
+Capacity-aware placement of apps on region nodes.
+
+An app's demand is the ``cpu``/``memory`` of its current plan. Each Node keeps
+``cpu_used``/``memory_used`` counters, so "where does this fit" is one indexed
+query over the nodes and no aggregate over apps is needed. The counters are
+adjusted by deltas when an app is placed or moved, when its current plan
+changes, when it is deleted, and when a plan's cpu/memory are edited.
+``refresh_usage`` recomputes them from scratch.
+
+``place`` puts one app on the best-fitting node: the one with the least
+capacity left after placement. It reserves the capacity with a conditional
+UPDATE, so concurrent placements cannot overfill a node.
+
+``plan_rebalance`` works on the whole fleet in memory. It evicts apps from
+overcommitted nodes (largest first) and from unschedulable ones. Then it
+places them, together with the unplaced apps, best-fit-decreasing: each
+region's nodes sit in a list sorted by free CPU, so a candidate is found by
+bisection. An evicted app's room is only handed out once the app has moved
+to another node; one that fits nowhere else stays where it is (and is listed
+as unplaceable), so no node ends up fuller than before. ``apply_rebalance``
+writes the result.
+"""
+from bisect import bisect_left, insort
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import AppDetail, Node, Plan
+
+
+class NoCapacity(Exception):
+    pass
+
+
+def fits(cpu, memory, region=None, exclude=None):
+    """Schedulable nodes with room for ``cpu``/``memory``, best fit first."""
+    nodes = Node.objects.filter(
+        schedulable=True, cpu_used__lte=F('cpu') - cpu, memory_used__lte=F('memory') - memory,
+    )
+    if region:
+        nodes = nodes.filter(region=region)
+    if exclude is not None:
+        nodes = nodes.exclude(pk=exclude)
+    return nodes.annotate(
+        cpu_free=F('cpu') - F('cpu_used') - cpu,
+        memory_free=F('memory') - F('memory_used') - memory,
+    ).order_by('cpu_free', 'memory_free', 'pk')
+
+
+def fitting_regions(cpu, memory):
+    """``{region: number of nodes with room}``."""
+    rows = fits(cpu, memory).order_by().values_list('region').annotate(n=Count('pk'))
+    return dict(rows)
+
+
+def adjust(node_id, cpu, memory):
+    if node_id is not None and (cpu or memory):
+        Node.objects.filter(pk=node_id).update(cpu_used=F('cpu_used') + cpu, memory_used=F('memory_used') + memory)
+
+
+def place(app_id, region=None, candidates=20):
+    """
+    Move (or first place) an app on the best-fitting node in ``region``, or in
+    any region when it is None. Returns the node; raises NoCapacity when
+    nothing has room.
+    """
+    with transaction.atomic():
+        row = (
+            AppDetail.objects.select_for_update().filter(pk=app_id)
+            .values('node', 'current_plan__cpu', 'current_plan__memory').get()
+        )
+        cpu, memory = row['current_plan__cpu'] or 0, row['current_plan__memory'] or 0
+        for node in fits(cpu, memory, region, exclude=row['node'])[:candidates]:
+            reserved = Node.objects.filter(
+                pk=node.pk, cpu_used__lte=F('cpu') - cpu, memory_used__lte=F('memory') - memory,
+            ).update(cpu_used=F('cpu_used') + cpu, memory_used=F('memory_used') + memory)
+            if reserved:
+                break
+        else:
+            raise NoCapacity(f"No node{' in ' + region if region else ''} has {cpu} CPU and {memory} GB free")
+        adjust(row['node'], -cpu, -memory)
+        AppDetail.objects.filter(pk=app_id).update(node=node, region=node.region)
+    node.refresh_from_db(fields=['cpu_used', 'memory_used'])
+    return node
+
+
+def refresh_usage(node_ids=None):
+    """Recompute node counters from their apps, in one UPDATE."""
+    apps = AppDetail.objects.filter(node=OuterRef('pk')).order_by().values('node')
+    nodes = Node.objects.all() if node_ids is None else Node.objects.filter(pk__in=node_ids)
+    nodes.update(
+        cpu_used=Coalesce(Subquery(apps.annotate(s=Sum('current_plan__cpu')).values('s')), Value(0)),
+        memory_used=Coalesce(Subquery(apps.annotate(s=Sum('current_plan__memory')).values('s')), Value(0)),
+    )
+
+
+# Counter maintenance.
+
+def current_plan_moved(sender, changes, **kwargs):
+    nodes = dict(AppDetail.objects.filter(pk__in=[app_id for app_id, _, _ in changes], node__isnull=False).values_list('pk', 'node'))
+    if not nodes:
+        return
+    plans = Plan.objects.in_bulk({plan_id for _, old, new in changes for plan_id in (old, new) if plan_id})
+    deltas = defaultdict(lambda: [0, 0])
+    for app_id, old, new in changes:
+        if app_id not in nodes:
+            continue
+        for plan_id, sign in ((old, -1), (new, 1)):
+            if plan_id in plans:
+                deltas[nodes[app_id]][0] += sign * plans[plan_id].cpu
+                deltas[nodes[app_id]][1] += sign * plans[plan_id].memory
+    for node_id, (cpu, memory) in deltas.items():
+        adjust(node_id, cpu, memory)
+
+
+def app_deleting(sender, instance, **kwargs):
+    row = AppDetail.objects.filter(pk=instance.pk).values_list('node', 'current_plan__cpu', 'current_plan__memory').first()
+    if row is not None and row[0] is not None:
+        adjust(row[0], -(row[1] or 0), -(row[2] or 0))
+
+
+def plan_updated(sender, plan, before, **kwargs):
+    cpu, memory = plan.cpu - before['cpu'], plan.memory - before['memory']
+    if not (cpu or memory):
+        return
+    rows = AppDetail.objects.filter(current_plan=plan.pk, node__isnull=False).values_list('node').annotate(n=Count('pk'))
+    for node_id, n in rows.order_by():
+        adjust(node_id, cpu * n, memory * n)
+
+
+def plan_deleting(sender, instance, **kwargs):
+    # Apps lose their plan through SET_NULL, which sends no signals.
+    rows = AppDetail.objects.filter(current_plan=instance.pk, node__isnull=False).values_list('node').annotate(n=Count('pk'))
+    for node_id, n in rows.order_by():
+        adjust(node_id, -instance.cpu * n, -instance.memory * n)
+
+
+# Bulk rebalancing.
+
+@dataclass
+class Rebalance:
+    moves: list = field(default_factory=list)         # (app_id, from_node_id, to_node_id, region)
+    unplaceable: list = field(default_factory=list)   # app ids
+    overcommitted: int = 0                            # nodes over capacity before
+
+
+class Pool:
+    """Free capacity of a region's schedulable nodes, sorted by free CPU."""
+
+    def __init__(self):
+        self.entries = []   # (cpu_free, memory_free, node_id)
+        self.free = {}      # node_id -> (cpu_free, memory_free)
+
+    def add(self, cpu_free, memory_free, node_id):
+        self.free[node_id] = (cpu_free, memory_free)
+        insort(self.entries, (cpu_free, memory_free, node_id))
+
+    def release(self, node_id, cpu, memory):
+        """Give room back to ``node_id``, e.g. that of an app moved off it."""
+        cpu_free, memory_free = self.free[node_id]
+        del self.entries[bisect_left(self.entries, (cpu_free, memory_free, node_id))]
+        self.add(cpu_free + cpu, memory_free + memory, node_id)
+
+    def take(self, cpu, memory, exclude=None):
+        """Reserve room on the best-fitting node other than ``exclude``; returns its id or None."""
+        index = bisect_left(self.entries, (cpu, -1, -1))
+        for position in range(index, len(self.entries)):
+            cpu_free, memory_free, node_id = self.entries[position]
+            if memory_free >= memory and node_id != exclude:
+                del self.entries[position]
+                self.add(cpu_free - cpu, memory_free - memory, node_id)
+                return node_id
+        return None
+
+
+def plan_rebalance(region=None):
+    nodes = {
+        pk: {'region': node_region, 'cpu': cpu, 'memory': memory, 'schedulable': schedulable, 'apps': []}
+        for pk, node_region, cpu, memory, schedulable in (
+            Node.objects.filter(**({'region': region} if region else {}))
+            .values_list('pk', 'region', 'cpu', 'memory', 'schedulable')
+        )
+    }
+    apps = AppDetail.objects.filter(current_plan__isnull=False).values_list(
+        'pk', 'node', 'region', 'current_plan__cpu', 'current_plan__memory',
+    )
+    if region:
+        apps = apps.filter(region=region)
+
+    result = Rebalance()
+    pending = []   # (cpu, memory, app_id, from_node_id, region)
+    for pk, node_id, app_region, cpu, memory in apps.iterator(chunk_size=10000):
+        if node_id in nodes:
+            nodes[node_id]['apps'].append((cpu, memory, pk))
+        elif node_id is None:
+            pending.append((cpu, memory, pk, None, app_region))
+
+    pools = defaultdict(Pool)
+    for node_id, node in nodes.items():
+        cpu_free = node['cpu'] - sum(app[0] for app in node['apps'])
+        memory_free = node['memory'] - sum(app[1] for app in node['apps'])
+        if cpu_free < 0 or memory_free < 0:
+            result.overcommitted += 1
+        if not node['schedulable']:
+            pending.extend((cpu, memory, pk, node_id, node['region']) for cpu, memory, pk in node['apps'])
+            continue
+        # Evict the largest apps until the node fits again. Their room only
+        # becomes free once they are moved: one that fits nowhere else stays.
+        pools[node['region']].add(cpu_free, memory_free, node_id)
+        for cpu, memory, pk in sorted(node['apps'], reverse=True):
+            if cpu_free >= 0 and memory_free >= 0:
+                break
+            cpu_free += cpu
+            memory_free += memory
+            pending.append((cpu, memory, pk, node_id, node['region']))
+
+    for cpu, memory, pk, from_node, app_region in sorted(pending, key=lambda app: (app[0], app[1]), reverse=True):
+        if app_region in pools:
+            candidates = [app_region]
+        else:
+            # No nodes in the app's region (or none given): anywhere.
+            candidates = list(pools)
+        evicted = from_node is not None and from_node in pools[app_region].free
+        for candidate in candidates:
+            node_id = pools[candidate].take(cpu, memory, exclude=from_node)
+            if node_id is not None:
+                result.moves.append((pk, from_node, node_id, candidate))
+                if evicted:
+                    pools[app_region].release(from_node, cpu, memory)
+                break
+        else:
+            result.unplaceable.append(pk)
+    return result
+
+
+def apply_rebalance(rebalance):
+    targets = defaultdict(list)
+    for pk, _, to_node, region in rebalance.moves:
+        targets[to_node, region].append(pk)
+    with transaction.atomic():
+        # One UPDATE per target node; far cheaper than a per-row CASE.
+        for (node_id, region), app_ids in targets.items():
+            AppDetail.objects.filter(pk__in=app_ids).update(node=node_id, region=region)
+        touched = {node for _, from_node, to_node, _ in rebalance.moves for node in (from_node, to_node)}
+        touched.discard(None)
+        refresh_usage(touched)
+    return len(rebalance.moves)
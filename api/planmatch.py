@@ -0,0 +1,97 @@
+"""
+Plan matching: the cheapest plan, or the Pareto-optimal plans, that meet a
+set of resource requirements.
+
+The catalog is loaded once into a list of plain tuples. Only the plans on its
+Pareto frontier are kept: no other plan costs the same or less and offers at
+least as much of every resource. The cheapest match is always on the
+frontier (whatever matches a dominated plan also matches the plan
+dominating it, for no more money). So are the Pareto-optimal matches. The
+frontier is sorted by cost, so a query scans it in price order and stops at
+the first match or at ``max_cost``. Serialized plans are built once with the
+catalog.
+
+The catalog is rebuilt when the Plan generation of api.responsecache moves.
+Every Plan save and delete bumps it where all workers read it (a
+CacheGeneration row, or the cache when CACHE_SHARED), so saves handled by
+other workers are picked up on the next lookup. Checking costs one
+primary-key read per lookup unless the cache is shared.
+"""
+import threading
+from bisect import bisect_right
+
+from . import responsecache
+from .models import Plan
+from .serializers import PlanSerializer
+
+RESOURCES = ('cpu', 'memory', 'storage', 'bandwidth')
+
+
+class Catalog:
+    def __init__(self, plans):
+        self.plans = {plan.pk: data for plan, data in zip(plans, PlanSerializer(plans, many=True).data)}
+        entries = sorted(
+            ((plan.monthly_cost, *(getattr(plan, name) for name in RESOURCES), plan.pk) for plan in plans),
+            # A plan dominating another of the same price has at least its
+            # total resources, so it comes first and the other is dropped.
+            key=lambda entry: (entry[0], -sum(entry[1:5]), entry[5]),
+        )
+        self.frontier = []
+        for entry in entries:
+            if not any(all(kept[i] >= entry[i] for i in range(1, 5)) for kept in self.frontier):
+                self.frontier.append(entry)
+        self.costs = [entry[0] for entry in self.frontier]
+
+    def candidates(self, requirements, max_cost=None):
+        end = len(self.frontier) if max_cost is None else bisect_right(self.costs, max_cost)
+        cpu, memory, storage, bandwidth = requirements
+        for index in range(end):
+            entry = self.frontier[index]
+            if entry[1] >= cpu and entry[2] >= memory and entry[3] >= storage and entry[4] >= bandwidth:
+                yield entry[5]
+
+    def cheapest(self, requirements, max_cost=None):
+        """Serialized cheapest plan meeting ``(cpu, memory, storage, bandwidth)``, or None."""
+        pk = next(self.candidates(requirements, max_cost), None)
+        return None if pk is None else self.plans[pk]
+
+    def pareto(self, requirements, max_cost=None):
+        """Serialized Pareto-optimal plans meeting the requirements, cheapest first."""
+        return [self.plans[pk] for pk in self.candidates(requirements, max_cost)]
+
+
+_lock = threading.Lock()
+_current = (None, None)
+
+responsecache.watch(Plan)
+
+
+def catalog():
+    global _current
+    gen = responsecache.generation(Plan)
+    built_gen, built = _current
+    if built is not None and built_gen == gen:
+        return built
+    with _lock:
+        built_gen, built = _current
+        if built is None or built_gen != gen:
+            built = Catalog(list(Plan.objects.order_by('pk')))
+            _current = (gen, built)
+    return built
+
+
+def match(records, pareto=False):
+    """
+    Match requirement dicts (``cpu``, ``memory``, ``storage``, ``bandwidth``,
+    optional ``max_cost``) against one catalog. Identical requirements are
+    only matched once.
+    """
+    plans = catalog()
+    method = plans.pareto if pareto else plans.cheapest
+    results, seen = [], {}
+    for record in records:
+        key = (tuple(record.get(name, 0) for name in RESOURCES), record.get('max_cost'))
+        if key not in seen:
+            seen[key] = method(*key)
+        results.append(seen[key])
+    return results
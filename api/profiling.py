@@ -0,0 +1,154 @@
+"""
+Statistical per-request profiler.
+
+A background thread samples the request thread's stack every
+PROFILE_INTERVAL seconds. Samples are written in collapsed-stack format
+(``frame;frame;frame count``, as consumed by flamegraph.pl and speedscope)
+next to a JSON summary of the request, including how the samples split
+between ORM, serialization and outbound HTTP.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+SIGNING_SALT = 'api.profiling'
+
+# Matched against frame filenames, innermost frame first.
+CATEGORIES = (
+    ('http', ('/requests/', '/urllib3/', '/http/client.py', '/ssl.py', '/socket.py')),
+    ('orm', ('/django/db/',)),
+    ('serialization', ('/rest_framework/serializers.py', '/rest_framework/fields.py',
+                       '/rest_framework/renderers.py', '/api/renderers.py', '/json/')),
+)
+
+
+def profile_token():
+    """Return a value for the PROFILE_HEADER request header."""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def valid_token(value):
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(value, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def frame_label(code):
+    filename = code.co_filename
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def categorize(filenames):
+    for filename in filenames:
+        for category, fragments in CATEGORIES:
+            if any(fragment in filename for fragment in fragments):
+                return category
+    return 'other'
+
+
+class Sampler:
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or settings.PROFILE_INTERVAL
+        self.stacks = Counter()
+        self.categories = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.start
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels, filenames = [], []
+            while frame is not None:
+                labels.append(frame_label(frame.f_code))
+                filenames.append(frame.f_code.co_filename)
+                frame = frame.f_back
+            if not labels:
+                continue
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.categories[categorize(filenames)] += 1
+
+
+def save(sampler, request, response, directory=None):
+    """Write ``<name>.collapsed`` and ``<name>.json`` and rotate old profiles."""
+    directory = directory or settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match is not None else 'unmatched'
+    name = f'{time.time():.6f}-{os.getpid()}'
+    total = sum(sampler.categories.values())
+    summary = {
+        'name': name,
+        'path': request.get_full_path(),
+        'method': request.method,
+        'view': view,
+        'status': response.status_code,
+        'duration': sampler.duration,
+        'samples': total,
+        'split': {category: count / total for category, count in sampler.categories.items()} if total else {},
+    }
+
+    with open(os.path.join(directory, f'{name}.collapsed'), 'w') as fh:
+        for stack, count in sampler.stacks.most_common():
+            fh.write(f'{stack} {count}\n')
+    with open(os.path.join(directory, f'{name}.json'), 'w') as fh:
+        json.dump(summary, fh)
+
+    rotate(directory, settings.PROFILE_MAX_FILES)
+    return summary
+
+
+def rotate(directory, keep):
+    names = sorted(filename[:-5] for filename in os.listdir(directory) if filename.endswith('.json'))
+    for name in names[:-keep] if keep else names:
+        for suffix in ('.json', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def load_summaries(directory=None):
+    directory = directory or settings.PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as fh:
+                summaries.append(json.load(fh))
+    return summaries
+
+
+def top_frames(name, directory=None, limit=5):
+    """Frames with the most self (leaf) samples in a captured profile."""
+    directory = directory or settings.PROFILE_DIR
+    leaves = Counter()
+    with open(os.path.join(directory, f'{name}.collapsed')) as fh:
+        for line in fh:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            leaves[stack.rsplit(';', 1)[-1]] += int(count)
+    return leaves.most_common(limit)
@@ -0,0 +1,46 @@
+"""
+orjson-backed renderer used for the API's JSON responses.
+
+FetchUserDetails and GithubRepository return full GitHub repository objects
+that can run to several MB, where the stdlib ``json`` encoder dominates the
+response time. Falls back to DRF's JSONRenderer when orjson is not installed
+or when an indented response is requested.
+"""
+import decimal
+
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def default(obj):
+    # orjson handles datetime, date, time and UUID natively; everything else
+    # is coerced the same way DRF's JSONEncoder would.
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    return encoders.JSONEncoder().default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+        # Keep the output a strict javascript subset, as JSONRenderer does.
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
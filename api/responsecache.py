@@ -0,0 +1,110 @@
+"""
+Rendered-response cache for read-mostly viewsets.
+
+Entries are keyed by path, query string and the negotiated ``Accept`` header
+and record the generation of the data they were rendered from: a per-model
+generation for list responses and a per-object generation for detail
+responses. ``post_save``/``post_delete`` bump the model generation and the
+saved object's generation, so editing one plan invalidates every plan list
+but only that plan's detail responses.
+
+Generations must be seen by every worker. With a shared cache
+(CACHE_SHARED) they are cache counters, bumped once the save commits (sooner,
+and another worker could render the old rows under the new generation);
+otherwise they are CacheGeneration rows, bumped in the transaction of the
+save, and a lookup costs one primary-key read instead of none.
+
+Expired entries are served stale for up to RESPONSE_CACHE_STALE seconds while
+a single request re-renders them.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+
+from .models import CacheGeneration
+
+STORED_HEADERS = ('Content-Type', 'Vary', 'Allow')
+
+_watched = set()
+
+
+def generation_key(model, pk=None):
+    label = model._meta.label_lower
+    return f'respcache:gen:{label}' if pk is None else f'respcache:gen:{label}:{pk}'
+
+
+def bump(model, pk=None):
+    key = generation_key(model, pk)
+    if not settings.CACHE_SHARED:
+        if not CacheGeneration.objects.filter(key=key).update(value=F('value') + 1):
+            CacheGeneration.objects.get_or_create(key=key, defaults={'value': time.time_ns()})
+        return
+    transaction.on_commit(lambda: incr(key))
+
+
+def incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Start from a timestamp so a cache flush never reuses a generation.
+        cache.set(key, time.time_ns(), None)
+
+
+def generation(model, pk=None):
+    key = generation_key(model, pk)
+    if not settings.CACHE_SHARED:
+        # A key never bumped is generation 0; bumps start from a timestamp.
+        return CacheGeneration.objects.filter(key=key).values_list('value', flat=True).first() or 0
+    value = cache.get(key)
+    if value is None:
+        incr(key)
+        value = cache.get(key)
+    return value
+
+
+def invalidate(sender, instance, **kwargs):
+    bump(sender)
+    bump(sender, instance.pk)
+
+
+def watch(model):
+    """Invalidate cached responses of ``model`` on every save and delete."""
+    if model in _watched:
+        return
+    _watched.add(model)
+    uid = f'respcache:{model._meta.label_lower}'
+    post_save.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
+
+
+def entry_key(request):
+    raw = '\0'.join([
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        request.META.get('HTTP_ACCEPT', ''),
+    ])
+    return 'respcache:entry:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def build_response(entry, state):
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    response['X-Cache'] = state
+    return response
+
+
+def store(key, gen, response):
+    cache.set(key, {
+        'content': response.content,
+        'headers': {header: response[header] for header in STORED_HEADERS if response.has_header(header)},
+        'status': response.status_code,
+        'created': time.time(),
+        'gen': gen,
+    }, settings.RESPONSE_CACHE_TIMEOUT + settings.RESPONSE_CACHE_STALE)
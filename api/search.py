@@ -0,0 +1,155 @@
+"""
+Repository name search backed by an SQLite FTS5 trigram index.
+
+``api_reposearch`` is an FTS5 table (``rowid`` = GithbRepo pk) using the
+trigram tokenizer, which matches case-insensitive substrings of three or more
+characters. Names are stored behind two START markers, so a prefix query of
+any length is the phrase ``START START <prefix>``; substring queries need at
+least three characters. Matches come back in rowid order, so ``LIMIT`` stops
+early instead of materialising every match.
+
+When a region/framework filter matches fewer than SELECTIVE_APPS apps, the
+query starts from those apps (indexed) and checks their repository names
+instead.
+
+The table is created on ``post_migrate`` and kept current by ``post_save``/
+``post_delete`` on GithbRepo. ``bulk_create`` and ``update()`` bypass signals,
+so bulk loaders call ``index_many`` and ``manage.py rebuild_search_index``
+re-indexes everything. On databases without FTS5 the same searches run as
+plain ``istartswith``/``icontains`` filters.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .models import AppDetail, GithbRepo
+
+TABLE = 'api_reposearch'
+START = '\x02\x02'
+PREFIX = 'prefix'
+SUBSTRING = 'substring'
+SELECTIVE_APPS = 5000
+
+_available = {}
+
+
+def available(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    if using not in _available:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            _available[using] = bool(cursor.fetchone()[0])
+    return _available[using]
+
+
+def create_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """``post_migrate`` receiver creating (and filling) the FTS table if it is missing."""
+    if not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [TABLE])
+        if cursor.fetchone() is None:
+            cursor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(name, tokenize='trigram')")
+            cursor.execute(
+                f"INSERT INTO {TABLE} (rowid, name) "
+                f"SELECT id, %s || repository FROM {GithbRepo._meta.db_table} WHERE repository IS NOT NULL",
+                [START],
+            )
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    if not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    create_index(using)
+
+
+def index_many(repos, using=DEFAULT_DB_ALIAS):
+    """(Re-)index repositories, e.g. after bulk_create."""
+    if not available(using):
+        return
+    repos = list(repos)
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(repo.pk,) for repo in repos])
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, name) VALUES (%s, %s)",
+            [(repo.pk, START + repo.repository) for repo in repos if repo.repository is not None],
+        )
+
+
+def reindex(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    index_many([instance], using)
+
+
+def unindex(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    if available(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [instance.pk])
+
+
+def match_expression(query, mode):
+    if mode == PREFIX:
+        query = START + query
+    return '"' + query.replace('"', '""') + '"'
+
+
+def filter_apps(region=None, framework=None):
+    apps = AppDetail.objects.all()
+    if region:
+        apps = apps.filter(region=region)
+    if framework:
+        apps = apps.filter(framework=framework)
+    return apps
+
+
+def selective(region=None, framework=None):
+    if not (region or framework):
+        return False
+    return filter_apps(region, framework)[:SELECTIVE_APPS].count() < SELECTIVE_APPS
+
+
+def search(query, mode=PREFIX, target='repos', region=None, framework=None, limit=20):
+    """
+    Repositories (or, with ``target='apps'``, their apps) whose name starts
+    with or contains ``query``, case-insensitively, in id order.
+    """
+    if not available() or selective(region, framework):
+        return list(search_queryset(query, mode, target, region, framework)[:limit])
+
+    sql = f"SELECT s.rowid FROM {TABLE} s WHERE s.name MATCH %s"
+    params = [match_expression(query, mode)]
+    if target == 'apps' or region or framework:
+        sql += f" AND EXISTS (SELECT 1 FROM {AppDetail._meta.db_table} a WHERE a.organizer_id = s.rowid"
+        if region:
+            sql += " AND a.region = %s"
+            params.append(region)
+        if framework:
+            sql += " AND a.framework = %s"
+            params.append(framework)
+        sql += ")"
+    sql += " ORDER BY s.rowid LIMIT %s"
+
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        ids = [row[0] for row in cursor.fetchall()]
+    if target == 'apps':
+        # The first `limit` apps in (repository, id) order belong to these repositories.
+        return list(filter_apps(region, framework).filter(organizer__in=ids).order_by('organizer', 'pk')[:limit])
+    found = GithbRepo.objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def search_queryset(query, mode=PREFIX, target='repos', region=None, framework=None):
+    """
+    ``search`` as a plain queryset, for selective app filters and databases
+    without FTS5.
+    """
+    lookup = 'repository__istartswith' if mode == PREFIX else 'repository__icontains'
+    apps = filter_apps(region, framework)
+    if target == 'apps':
+        return apps.filter(**{'organizer__' + lookup: query}).order_by('organizer', 'pk')
+    repos = GithbRepo.objects.filter(**{lookup: query})
+    if region or framework:
+        repos = repos.filter(pk__in=apps.values('organizer'))
+    return repos.order_by('pk')
@@ -1,5 +1,25 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import AppDetail, AppPlan, AuthUser, Plan, GithbRepo
+from .models import AppDetail, AppPlan, AuthUser, Node, OwnerUsageSummary, Plan, GithbRepo
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer that takes optional ``fields`` and ``omit`` arguments
+    controlling which fields are rendered.
+    """
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        if omit is not None:
+            for name in set(omit) & set(self.fields):
+                self.fields.pop(name)
 
 
 class GithubRepoSerializer(serializers.Serializer):
@@ -9,28 +29,94 @@ class CodeSerializer(serializers.Serializer):
     code = serializers.CharField(min_length=20, allow_blank=False, required=True)
 
 
-class OrganizerGithubSerializer(serializers.ModelSerializer):
+class OrganizerGithubSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = GithbRepo
         fields = '__all__'
 
-class OrganizerSerializer(serializers.ModelSerializer):
+class OrganizerSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = AppDetail
         fields = '__all__'
+        read_only_fields = ('current_plan', 'current_plan_assigned_at', 'node')
 
 
-class AppDetailSerializer(serializers.ModelSerializer):
+class AppDetailSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = AppDetail
         fields = '__all__'
+        read_only_fields = ('current_plan', 'current_plan_assigned_at', 'node')
+
+    def validate_region(self, value):
+        # A placed app's region is its node's; api.placement moves both.
+        if self.instance is not None and self.instance.node_id is not None and value != self.instance.region:
+            raise serializers.ValidationError("The region of a placed app follows its node; move it with place.")
+        return value
 
-class PlanSerializer(serializers.ModelSerializer):
+class PlanSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Plan
         fields = '__all__'
 
-class AppPlanSerializer(serializers.ModelSerializer):
+class AppPlanSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = AppPlan
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class NodeSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Node
+        fields = '__all__'
+        read_only_fields = ('cpu_used', 'memory_used')
+
+class PlacementQuerySerializer(serializers.Serializer):
+    app = serializers.IntegerField(required=False, help_text="Use this app's current plan as the demand.")
+    cpu = serializers.IntegerField(min_value=0, default=0)
+    memory = serializers.IntegerField(min_value=0, default=0)
+    region = serializers.CharField(max_length=255, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+class OwnerUsageSummarySerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = OwnerUsageSummary
+        fields = '__all__'
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+    match = serializers.ChoiceField(choices=['prefix', 'substring'], default='prefix')
+    type = serializers.ChoiceField(choices=['repos', 'apps'], default='repos')
+    region = serializers.CharField(max_length=255, required=False)
+    framework = serializers.ChoiceField(choices=AppDetail._meta.get_field('framework').choices, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate(self, data):
+        if data['match'] == 'substring' and len(data['q']) < 3:
+            raise serializers.ValidationError({'q': "Substring search needs at least 3 characters."})
+        return data
+
+class PlanRequirementSerializer(serializers.Serializer):
+    app = serializers.IntegerField(required=False, help_text="Echoed back, to tell batch results apart.")
+    cpu = serializers.IntegerField(min_value=0, default=0)
+    memory = serializers.IntegerField(min_value=0, default=0)
+    storage = serializers.IntegerField(min_value=0, default=0)
+    bandwidth = serializers.IntegerField(min_value=0, default=0)
+    max_cost = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False)
+
+class PlanMatchQuerySerializer(PlanRequirementSerializer):
+    pareto = serializers.BooleanField(default=False)
+
+class PlanMatchBatchSerializer(serializers.Serializer):
+    requirements = PlanRequirementSerializer(many=True, allow_empty=False, max_length=settings.PLAN_MATCH_MAX_BATCH)
+    pareto = serializers.BooleanField(default=False)
+
+class InvoiceQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        now = timezone.now()
+        data.setdefault('end', now)
+        data.setdefault('start', now.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError({'end': "Must be after start."})
+        return data
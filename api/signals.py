@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent with ``changes``, a list of ``(app_id, old_plan_id, new_plan_id)``,
+# whenever AppDetail.current_plan moves (see api.models.advance_current_plan).
+current_plan_changed = Signal()
+
+# Sent by Plan.save() on updates with ``plan`` and ``before``, the previous
+# values of Plan.TRACKED_FIELDS.
+plan_changed = Signal()
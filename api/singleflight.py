@@ -0,0 +1,134 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+Concurrent callers asking for the same key share one execution and its
+result (or exception). Threads and asyncio tasks within a process are
+coalesced in memory; with SINGLE_FLIGHT_SHARED enabled, workers are also
+coalesced through a lock and a short-lived result in the default cache.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = weakref.WeakKeyDictionary()
+        self._counts = Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        """Counts of executed calls and of calls coalesced locally or via the cache."""
+        with self._lock:
+            return {name: self._counts[name] for name in ('executed', 'coalesced', 'coalesced_shared')}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+    def do(self, key, fn):
+        """Call ``fn()`` unless an identical call is already in flight, and return its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._counts['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(key, fn)
+        except BaseException as exc:
+            # Any exception, or followers would take None for a result.
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, fn):
+        """asyncio counterpart of :meth:`do`; ``fn()`` must return an awaitable."""
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            self._count('coalesced')
+            return await asyncio.shield(future)
+
+        future = calls[key] = loop.create_future()
+        try:
+            self._count('executed')
+            result = await fn()
+        except asyncio.CancelledError:
+            # Followers must not wait for a leader that will never finish.
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark the exception retrieved in case nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+    def _execute(self, key, fn):
+        if not getattr(settings, 'SINGLE_FLIGHT_SHARED', False):
+            self._count('executed')
+            return fn()
+
+        lock_key = f'singleflight:{self.name}:lock:{key}'
+        result_key = f'singleflight:{self.name}:result:{key}'
+        timeout = settings.SINGLE_FLIGHT_TIMEOUT
+
+        if not cache.add(lock_key, 1, timeout):
+            # Another worker is fetching; wait for it to publish the result.
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                result = cache.get(result_key, _MISSING)
+                if result is not _MISSING:
+                    self._count('coalesced_shared')
+                    return result
+                if cache.get(lock_key) is None:
+                    break
+                time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            self._count('executed')
+            return fn()
+
+        try:
+            self._count('executed')
+            result = fn()
+            cache.set(result_key, result, settings.SINGLE_FLIGHT_RESULT_TTL)
+            return result
+        finally:
+            cache.delete(lock_key)
@@ -0,0 +1,84 @@
+"""
+Process startup: warming a worker before it serves, and reading
+``python -X importtime`` output for ``manage.py startup_profile``.
+
+``warm`` does the work a fresh process would otherwise do on its first
+requests: loading the URLconf (and with it every view, DRF and what they
+import), populating the URL resolvers and compiling their patterns, and
+building the plan catalog. Run in a gunicorn master with ``--preload``
+(STARTUP_WARMUP), it happens once and the forked workers share the result.
+"""
+import re
+import time
+from collections import defaultdict
+
+from django.db import DatabaseError, connections
+from django.urls import URLResolver, get_resolver
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+PHASE = re.compile(r'^phase: (\S+)$')
+
+
+def warm_urls(resolver=None):
+    """Populate ``resolver`` and everything included below it; returns the number of patterns."""
+    resolver = resolver or get_resolver()
+    resolver.reverse_dict
+    count = 0
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        count += warm_urls(pattern) if isinstance(pattern, URLResolver) else 1
+    return count
+
+
+def warm_plan_catalog():
+    from . import planmatch
+    try:
+        planmatch.catalog()
+    except DatabaseError:
+        # No tables yet, e.g. while building an image; built on first use.
+        pass
+
+
+def warm():
+    """Do the first-request work now; returns ``{step: seconds}``."""
+    steps = (
+        ('urls', warm_urls),
+        ('plan_catalog', warm_plan_catalog),
+    )
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - start
+    # Forked workers must not share the connection the catalog was read with.
+    connections.close_all()
+    return timings
+
+
+def parse_importtime(lines):
+    """
+    ``[(phase, module, self_us, cumulative_us, depth)]`` from ``-X importtime``
+    output. ``phase: <name>`` lines written between imports start a phase;
+    imports before the first one are the interpreter's own.
+    """
+    phase, imports = 'interpreter', []
+    for line in lines:
+        match = PHASE.match(line)
+        if match:
+            phase = match.group(1)
+            continue
+        match = IMPORTTIME.match(line.rstrip('\n'))
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((phase, module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+def by_package(imports):
+    """``{top-level package: (self microseconds, module count)}``."""
+    packages = defaultdict(lambda: [0, 0])
+    for _, module, self_us, _, _ in imports:
+        package = packages[module.partition('.')[0]]
+        package[0] += self_us
+        package[1] += 1
+    return {name: tuple(totals) for name, totals in packages.items()}
@@ -1,11 +1,47 @@
-from django.test import TestCase
-from rest_framework.test import APIClient, APITestCase
+import asyncio
+import gzip
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.contrib.auth import login
+from django.http import HttpResponse
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.test import TestCase, RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from django.urls import reverse
 from rest_framework import status
-from unittest.mock import patch
+from rest_framework.permissions import IsAuthenticated
+from unittest import skipUnless
+from unittest.mock import MagicMock, patch
+from django.apps import apps
 from django.conf import settings
 from .serializers import CodeSerializer, GithubRepoSerializer, AppDetailSerializer, PlanSerializer, AppPlanSerializer
-from .models import AppDetail, GithbRepo, AuthUser, Plan, AppPlan
+from .models import AppDetail, GithbRepo, AuthUser, Plan, AppPlan, AppPlanArchive, CacheGeneration, DatabasePlan, IdempotencyKey, ImportCheckpoint, Node, OwnerUsageSummary, UsageBucket
+from . import circuitbreaker, github, idempotency, loadtest, metering, metrics, placement, planmatch, profiling, responsecache, search, startup, tracing, usage
+from .fakegithub import FakeGitHub
+from .middleware import parse_accept_encoding
+from .parsers import ORJSONParser
+from .renderers import ORJSONRenderer
+from .singleflight import SingleFlight
+from .throttling import SlidingWindowThrottle
+from .views import AppDetailViewSet, AppPlanViewSet, FetchUserDetails, GithubRepository, OrganizerGithubViewSet, PlanViewSet
+from .writebehind import AuthUserWriteBuffer
 
 class GitHubAuthTestCase(TestCase):
     def setUp(self):
@@ -720,3 +756,2072 @@ class AppPlanViewSetTestCase(APITestCase):
 
 
 
+class AuthUserWriteBufferTests(TestCase):
+    def setUp(self):
+        self.user = AuthUser.objects.create(uid=42, provider="github", access_token="a" * 40)
+        self.buffer = AuthUserWriteBuffer()
+
+    def test_unchanged_access_token_skips_write(self):
+        # Recording the same token again must not touch the database
+        with self.assertNumQueries(0):
+            self.assertFalse(self.buffer.record(self.user, access_token="a" * 40))
+
+    def test_changed_access_token_is_written(self):
+        self.assertTrue(self.buffer.record(self.user, access_token="b" * 40))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.access_token, "b" * 40)
+
+    @override_settings(AUTH_USER_LAST_LOGIN_RESOLUTION=60)
+    def test_recent_last_login_is_not_rewritten(self):
+        now = timezone.now()
+        self.buffer.record(self.user, logged_in_at=now)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.buffer.record(self.user, logged_in_at=now + timedelta(seconds=30)))
+        self.assertTrue(self.buffer.record(self.user, logged_in_at=now + timedelta(seconds=90)))
+
+    @override_settings(AUTH_USER_WRITE_BEHIND=True, AUTH_USER_FLUSH_INTERVAL=60)
+    def test_write_behind_buffers_until_flush(self):
+        with self.assertNumQueries(0):
+            self.buffer.record(self.user, access_token="c" * 40)
+        self.assertEqual(self.buffer.pending(), {self.user.pk: {'access_token': "c" * 40}})
+        self.assertEqual(AuthUser.objects.get(pk=self.user.pk).access_token, "a" * 40)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(AuthUser.objects.get(pk=self.user.pk).access_token, "c" * 40)
+        self.assertEqual(self.buffer.pending(), {})
+
+    def test_background_flush_closes_its_connections(self):
+        with patch('api.writebehind.connections.close_all') as close_all, \
+                patch.object(self.buffer, 'flush', side_effect=RuntimeError):
+            thread = threading.Thread(target=lambda: self.assertRaises(RuntimeError, self.buffer.flush_in_background))
+            thread.start()
+            thread.join()
+        close_all.assert_called_once_with()
+
+    def test_login_routes_last_login_through_buffer(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        self.user.backend = 'django.contrib.auth.backends.ModelBackend'
+        login(request, self.user)
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+
+class ORJSONRendererParserTests(TestCase):
+    def test_render_handles_decimal_datetime_and_uuid(self):
+        value = uuid.uuid4()
+        data = {
+            'cost': Decimal('10.50'),
+            'created_at': datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc),
+            'id': value,
+        }
+        rendered = json.loads(ORJSONRenderer().render(data))
+
+        self.assertEqual(rendered['cost'], 10.5)
+        self.assertEqual(rendered['created_at'], '2024-01-02T03:04:05+00:00')
+        self.assertEqual(rendered['id'], str(value))
+
+    def test_render_escapes_line_separators(self):
+        self.assertEqual(ORJSONRenderer().render({'text': '\u2028'}), b'{"text":"\\u2028"}')
+
+    def test_parse_round_trip(self):
+        stream = io.BytesIO(b'{"access_token": "abc", "ids": [1, 2]}')
+        self.assertEqual(ORJSONParser().parse(stream), {'access_token': 'abc', 'ids': [1, 2]})
+
+    def test_invalid_json_body_returns_400(self):
+        response = self.client.post(reverse('plans-list'), data='{bad', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionMiddlewareTests(APITestCase):
+    def setUp(self):
+        for i in range(20):
+            Plan.objects.create(plan_type="starter", storage=i, bandwidth=i, memory=i, cpu=i)
+        self.url = reverse('plans-list')
+
+    def test_large_response_is_gzipped(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 20)
+
+    def test_no_compression_without_accept_encoding(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(COMPRESSION_MIN_SIZE=10 ** 6)
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_parse_accept_encoding_qvalues(self):
+        self.assertEqual(parse_accept_encoding('gzip;q=0.5, br, identity;q=0'), {'gzip': 0.5, 'br': 1.0, 'identity': 0.0})
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        self.auth_user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.auth_user, repository="sample-repo")
+        self.app_detail = AppDetail.objects.create(organizer=self.repo, region="us-west", framework="react")
+        self.app_list_url = reverse('apps-list')
+
+    def test_fields_trims_response(self):
+        response = self.client.get(self.app_list_url, {'fields': 'id,region,framework'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'id': self.app_detail.id, 'region': 'us-west', 'framework': 'react'}])
+
+    def test_omit_drops_fields(self):
+        response = self.client.get(reverse('apps-detail', args=[self.app_detail.id]), {'omit': 'created_at,updated_at'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data), {'id', 'organizer', 'region', 'framework', 'current_plan', 'current_plan_assigned_at', 'node'},
+        )
+
+    def test_fields_pushed_down_to_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.app_list_url, {'fields': 'id,region'})
+
+        select = queries.captured_queries[-1]['sql'].split(' FROM ')[0]
+        self.assertIn('"region"', select)
+        self.assertNotIn('"framework"', select)
+        self.assertNotIn('"created_at"', select)
+
+    def test_writes_ignore_fields_parameter(self):
+        data = {'organizer': self.repo.id, 'region': 'eu-west', 'framework': 'vuejs'}
+        response = self.client.post(f"{self.app_list_url}?fields=id", data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['region'], 'eu-west')
+
+
+def github_response(payload, status_code=200, chunk_size=16):
+    # Mock a streamed requests.Response for the GitHub client
+    body = json.dumps(payload).encode()
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = payload
+    response.iter_content.side_effect = lambda size: (body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+    return response
+
+
+class GithubProjectionTests(APITestCase):
+    def setUp(self):
+        self.access_token = 'a' * 40
+        self.repos = [
+            {
+                'id': i,
+                'name': f'Repo{i}',
+                'clone_url': f'https://github.com/testuser/repo{i}.git',
+                'private': False,
+                'url': f'https://api.github.com/repos/testuser/repo{i}',
+                'owner': {'login': 'testuser', 'id': 123, 'gravatar_id': ''},
+                'forks_url': 'https://api.github.com/repos/testuser/forks',
+                'topics': ['a', 'b'],
+            }
+            for i in range(3)
+        ]
+
+    def test_iter_json_yields_array_items_across_chunks(self):
+        body = b'[{"id": 1, "name": "a"}, 23, {"id": 2}]'
+        chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+
+        self.assertEqual(list(github.iter_json(chunks)), [{'id': 1, 'name': 'a'}, 23, {'id': 2}])
+
+    def test_load_projected_keeps_declared_fields(self):
+        body = json.dumps(self.repos).encode()
+        projected = github.load_projected([body[i:i + 5] for i in range(0, len(body), 5)], ('id', 'owner.login'))
+
+        self.assertEqual(projected, [{'id': i, 'owner': {'login': 'testuser'}} for i in range(3)])
+
+    def test_load_projected_single_object(self):
+        self.assertEqual(github.load_projected([b' {"id": 1, "x": 2}'], ('id',)), {'id': 1})
+
+    @patch('requests.get')
+    @patch.object(settings, 'USER_REPO_URL', 'https://example.com')
+    def test_github_repository_returns_projected_repos(self, mock_get):
+        mock_get.return_value = github_response(self.repos)
+
+        response = self.client.post(reverse('github-repo'), data={'access_token': self.access_token})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        repo = response.data['Repository'][0]
+        self.assertEqual(repo['owner'], {'login': 'testuser'})
+        self.assertNotIn('forks_url', repo)
+        self.assertNotIn('topics', repo)
+
+    @patch('requests.get')
+    @patch.object(settings, 'USER_INFO_URL', 'https://example.com/user')
+    @patch.object(settings, 'USER_REPO_URL', 'https://example.com/repos')
+    def test_fetch_user_details_persists_compact_extra_data(self, mock_get):
+        user_info = {'id': 123, 'login': 'testuser', 'name': None, 'followers_url': 'https://api.github.com/x'}
+        branches = [{'name': 'main', 'commit': {'sha': 'abc', 'url': 'https://api.github.com/c'}, 'protected': False}]
+        mock_get.side_effect = [github_response(user_info), github_response(self.repos)] + [github_response(branches) for _ in self.repos]
+
+        response = self.client.generic(
+            'GET', reverse('fetch-details'),
+            json.dumps({'access_token': self.access_token}), content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user_info'], {'id': 123, 'login': 'testuser', 'name': None})
+        self.assertEqual(response.data['repositories'][0]['branches'], [{'name': 'main', 'protected': False, 'commit': {'sha': 'abc'}}])
+        user = AuthUser.objects.get(uid=123)
+        self.assertEqual(user.extra_data, {'id': 123, 'login': 'testuser'})
+        self.assertEqual(user.access_token, self.access_token)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.flight = SingleFlight('test')
+
+    def test_concurrent_threads_share_one_call(self):
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.flight.do('key', fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Let every thread reach the in-flight call before releasing it
+        while self.flight.stats()['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(self.flight.stats(), {'executed': 1, 'coalesced': 4, 'coalesced_shared': 0})
+
+    def test_errors_are_shared_and_not_cached(self):
+        def fail():
+            raise ValueError('upstream down')
+
+        with self.assertRaises(ValueError):
+            self.flight.do('key', fail)
+        self.assertEqual(self.flight.do('key', lambda: 'ok'), 'ok')
+
+    def test_concurrent_tasks_share_one_call(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def run():
+            return await asyncio.gather(*(self.flight.ado('key', fetch) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flight.stats()['coalesced'], 4)
+
+    def test_base_exceptions_reach_followers(self):
+        class Abort(BaseException):
+            pass
+
+        started, release = threading.Event(), threading.Event()
+
+        def abort():
+            started.set()
+            release.wait(5)
+            raise Abort
+
+        errors = []
+
+        def follow():
+            try:
+                self.flight.do('key', lambda: 'follower ran')
+            except Abort as exc:
+                errors.append(exc)
+
+        leader = threading.Thread(target=lambda: self.assertRaises(Abort, self.flight.do, 'key', abort))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=follow)
+        follower.start()
+        while self.flight.stats()['coalesced'] < 1:
+            time.sleep(0.001)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(len(errors), 1)
+
+    def test_cancelled_leader_does_not_strand_followers(self):
+        async def fetch():
+            await asyncio.sleep(5)
+
+        async def run():
+            leader = asyncio.ensure_future(self.flight.ado('key', fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.flight.ado('key', fetch))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(follower, 1)
+
+        asyncio.run(run())
+        self.assertEqual(self.flight.stats()['coalesced'], 1)
+
+    @override_settings(SINGLE_FLIGHT_SHARED=True, SINGLE_FLIGHT_TIMEOUT=1)
+    def test_shared_cache_coalesces_across_workers(self):
+        # Simulate another worker holding the lock and publishing its result
+        cache.add('singleflight:test:lock:key', 1)
+        cache.set('singleflight:test:result:key', 'from-other-worker')
+        try:
+            self.assertEqual(self.flight.do('key', lambda: 'local'), 'from-other-worker')
+        finally:
+            cache.delete_many(['singleflight:test:lock:key', 'singleflight:test:result:key'])
+        self.assertEqual(self.flight.stats()['coalesced_shared'], 1)
+
+    @patch('requests.get')
+    def test_github_get_key_includes_token(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: github_response([{'id': 1}])
+
+        github.get('https://example.com', 'a' * 40, ('id',))
+        github.get('https://example.com', 'b' * 40, ('id',))
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertNotEqual(github.flight_key('https://example.com', 'a' * 40, ('id',)), github.flight_key('https://example.com', 'b' * 40, ('id',)))
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        Plan.objects.create(plan_type="starter", storage=50, bandwidth=100, memory=4, cpu=2)
+
+    def test_request_latency_size_and_db_time_are_recorded(self):
+        self.client.get(reverse('plans-list'))
+        body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('http_request_duration_seconds_count{method="GET",status="200",view="plans-list"} 1', body)
+        self.assertIn('http_response_size_bytes_bucket{view="plans-list",le="+Inf"} 1', body)
+        # The response-cache generation read, then the list itself.
+        self.assertIn('db_query_duration_seconds_count{view="plans-list"} 2', body)
+
+    @patch('requests.get')
+    def test_github_calls_are_counted_per_endpoint(self, mock_get):
+        mock_get.return_value = github_response([{'id': 1}], status_code=200)
+        github.fetch('https://example.com/repos', 'a' * 40, ('id',), endpoint='repos')
+        mock_get.return_value = github_response({'message': 'Bad credentials'}, status_code=401)
+        github.fetch('https://example.com/user', 'a' * 40, ('id',), endpoint='user')
+
+        body = metrics.render()
+        self.assertIn('github_requests_total{endpoint="repos",status="200"} 1', body)
+        self.assertIn('github_requests_total{endpoint="user",status="401"} 1', body)
+        self.assertIn('github_request_duration_seconds_count{endpoint="repos"} 1', body)
+
+    def test_snapshots_from_all_workers_are_summed(self):
+        metrics.registry.inc('github_requests_total', {'endpoint': 'repos', 'status': 200})
+        with tempfile.TemporaryDirectory() as directory:
+            # Another worker's snapshot
+            with open(os.path.join(directory, '1.json'), 'w') as fh:
+                json.dump({'counters': [['github_requests_total', [['endpoint', 'repos'], ['status', 200]], 2]], 'histograms': []}, fh)
+            with override_settings(METRICS_DIR=directory):
+                body = metrics.render()
+
+        self.assertIn('github_requests_total{endpoint="repos",status="200"} 3', body)
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.settings_override = override_settings(PROFILE_DIR=self.profile_dir, PROFILE_MAX_FILES=2)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def captured(self):
+        return sorted(os.listdir(self.profile_dir))
+
+    def test_unsigned_requests_are_not_profiled(self):
+        self.client.get(reverse('plans-list'), HTTP_X_PROFILE_REQUEST='forged')
+        self.assertEqual(self.captured(), [])
+
+    def test_signed_header_captures_collapsed_stacks(self):
+        self.client.get(reverse('plans-list'), HTTP_X_PROFILE_REQUEST=profiling.profile_token())
+
+        files = self.captured()
+        self.assertEqual([name.rsplit('.', 1)[1] for name in files], ['collapsed', 'json'])
+        summary = profiling.load_summaries()[0]
+        self.assertEqual(summary['view'], 'plans-list')
+        self.assertEqual(summary['status'], 200)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0)
+    def test_sampled_profiles_are_rotated(self):
+        for _ in range(3):
+            self.client.get(reverse('plans-list'))
+        self.assertEqual(len(self.captured()), 4)
+
+    def test_sampler_categorizes_stacks(self):
+        with profiling.Sampler(interval=0.001) as sampler:
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                list(Plan.objects.all())
+        self.assertGreater(sum(sampler.categories.values()), 0)
+        self.assertIn('orm', sampler.categories)
+        self.assertTrue(all(' ' in stack for stack in sampler.stacks))
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0)
+    def test_profiles_command_lists_slowest(self):
+        self.client.get(reverse('plans-list'))
+        out = io.StringIO()
+        call_command('profiles', stdout=out)
+        self.assertIn('GET /api/plans/ [plans-list] status=200', out.getvalue())
+
+
+@override_settings(TRACING_EXPORTER='memory')
+class TracingTests(APITestCase):
+    def setUp(self):
+        tracing.memory_exporter.clear()
+        Plan.objects.create(plan_type="starter", storage=50, bandwidth=100, memory=4, cpu=2)
+
+    def spans_by_name(self):
+        return {span.name: span for span in tracing.memory_exporter.spans}
+
+    def test_request_view_and_sql_spans_are_nested(self):
+        response = self.client.get(reverse('plans-list'))
+
+        spans = self.spans_by_name()
+        root, view, sql = spans['HTTP GET'], spans['PlanViewSet.get'], spans['sql']
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(view.parent_id, root.span_id)
+        self.assertEqual(sql.parent_id, view.span_id)
+        self.assertEqual({root.trace_id, view.trace_id, sql.trace_id}, {root.trace_id})
+        self.assertEqual(root.attributes['view'], 'plans-list')
+        self.assertEqual(response['traceparent'], root.traceparent)
+
+    def test_inbound_traceparent_is_continued(self):
+        trace_id, parent_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+        self.client.get(reverse('plans-list'), HTTP_TRACEPARENT=f'00-{trace_id}-{parent_id}-01')
+
+        root = self.spans_by_name()['HTTP GET']
+        self.assertEqual((root.trace_id, root.parent_id), (trace_id, parent_id))
+
+    def test_malformed_traceparent_starts_new_trace(self):
+        self.assertIsNone(tracing.parse_traceparent('00-' + '0' * 32 + '-00f067aa0ba902b7-01'))
+        self.assertIsNone(tracing.parse_traceparent('garbage'))
+
+    @patch('requests.get')
+    def test_outbound_github_calls_propagate_traceparent(self, mock_get):
+        mock_get.return_value = github_response([{'id': 1}])
+
+        with tracing.span('parent') as parent:
+            github.fetch('https://example.com/repos', 'a' * 40, ('id',), endpoint='repos')
+
+        github_span = self.spans_by_name()['github.repos']
+        self.assertEqual(github_span.parent_id, parent.span_id)
+        self.assertEqual(mock_get.call_args.kwargs['headers']['traceparent'], github_span.traceparent)
+
+    def test_jsonl_exporter_writes_one_span_per_line(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            with override_settings(TRACING_EXPORTER='jsonl', TRACING_FILE=path):
+                with tracing.span('outer'):
+                    with tracing.span('inner', rows=3):
+                        pass
+            with open(path) as fh:
+                lines = [json.loads(line) for line in fh]
+
+        self.assertEqual([line['name'] for line in lines], ['inner', 'outer'])
+        self.assertEqual(lines[0]['parent_id'], lines[1]['span_id'])
+        self.assertEqual(lines[0]['attributes'], {'rows': 3})
+
+    def test_jsonl_exporter_writes_each_trace_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            with override_settings(TRACING_EXPORTER='jsonl', TRACING_FILE=path), \
+                    patch('builtins.open', wraps=open) as opened:
+                with tracing.span('request'):
+                    for i in range(5):
+                        with tracing.span('sql', n=i):
+                            pass
+                self.assertEqual(opened.call_count, 1)
+            with open(path) as fh:
+                lines = [json.loads(line) for line in fh]
+        self.assertEqual([line['name'] for line in lines], ['sql'] * 5 + ['request'])
+
+    @override_settings(TRACING_EXPORTER=None)
+    def test_disabled_tracing_is_a_noop(self):
+        response = self.client.get(reverse('plans-list'))
+        self.assertFalse(response.has_header('traceparent'))
+        self.assertEqual(tracing.memory_exporter.spans, [])
+
+
+@override_settings(BREAKER_MIN_CALLS=3, BREAKER_FAILURE_RATE=0.5, BREAKER_WINDOW=30, BREAKER_RESET_TIMEOUT=60)
+class CircuitBreakerTests(APITestCase):
+    def setUp(self):
+        circuitbreaker.reset_all()
+        cache.clear()
+        self.addCleanup(circuitbreaker.reset_all)
+        self.addCleanup(cache.clear)
+        self.access_token = 'a' * 40
+
+    def test_breaker_opens_probes_and_closes(self):
+        breaker = circuitbreaker.CircuitBreaker('test')
+        for _ in range(3):
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        with override_settings(BREAKER_RESET_TIMEOUT=0):
+            # Only a single probe is let through while half-open
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record(True)
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        breaker = circuitbreaker.CircuitBreaker('test')
+        for _ in range(3):
+            breaker.record(False)
+        with override_settings(BREAKER_RESET_TIMEOUT=0):
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+
+    @patch('requests.get')
+    def test_malformed_body_during_probe_is_recorded(self, mock_get):
+        breaker = circuitbreaker.get_breaker('repos')
+        for _ in range(3):
+            breaker.record(False)
+        truncated = MagicMock(status_code=200)
+        truncated.iter_content.side_effect = lambda size: iter([b'[{"id": 1, "name": "re'])
+        mock_get.side_effect = [truncated, github_response([{'id': 2}])]
+
+        with override_settings(BREAKER_RESET_TIMEOUT=0):
+            # Nothing stale to serve: unavailable, as for a dropped connection.
+            with self.assertRaises(github.GitHubUnavailable):
+                github.fetch('https://example.com/repos', self.access_token, ('id',), endpoint='repos')
+            self.assertEqual(breaker.state, circuitbreaker.OPEN)
+            # The next probe goes through instead of the breaker being stuck half-open.
+            self.assertEqual(github.fetch('https://example.com/repos', self.access_token, ('id',), endpoint='repos'), (200, [{'id': 2}]))
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+
+    @patch('requests.get')
+    def test_malformed_body_serves_the_stale_response(self, mock_get):
+        truncated = MagicMock(status_code=200)
+        truncated.iter_content.side_effect = lambda size: iter([b'[{"id": 1, "name": "re'])
+        mock_get.side_effect = [github_response([{'id': 2}]), truncated]
+
+        fresh = github.fetch('https://example.com/repos', self.access_token, ('id',), endpoint='repos')
+        self.assertEqual(github.fetch('https://example.com/repos', self.access_token, ('id',), endpoint='repos'), fresh)
+
+    @override_settings(GITHUB_TIMEOUT=(0.5, 0.2))
+    def test_hanging_github_bounds_worker_occupancy(self):
+        # Fault injection: GitHub accepts connections but never answers
+        with FakeGitHub(mode='hang') as fake:
+            url = fake.url('/user/repos')
+            durations = []
+            for i in range(10):
+                start = time.perf_counter()
+                with self.assertRaises(github.GitHubUnavailable):
+                    github.get(url, str(i) * 40, github.REPO_FIELDS, endpoint='repos')
+                durations.append(time.perf_counter() - start)
+
+            # Each call is capped by the read timeout, and once the breaker
+            # opens calls fail fast without reaching GitHub at all
+            self.assertLess(max(durations), 1.0)
+            self.assertLess(max(durations[3:]), 0.05)
+            self.assertEqual(fake.requests, 3)
+
+    def test_stale_response_served_while_github_errors(self):
+        with FakeGitHub(repos=2) as fake:
+            url = fake.url('/user/repos')
+            status_code, fresh = github.get(url, self.access_token, github.REPO_FIELDS, endpoint='repos')
+            self.assertEqual((status_code, len(fresh)), (200, 2))
+
+            fake.mode = 'error'
+            for _ in range(5):
+                self.assertEqual(github.get(url, self.access_token, github.REPO_FIELDS, endpoint='repos'), (200, fresh))
+            # One good call plus two 502s open the breaker
+            self.assertEqual(circuitbreaker.get_breaker('repos').state, circuitbreaker.OPEN)
+            self.assertEqual(fake.requests, 3)
+
+    @patch.object(settings, 'USER_REPO_URL', 'https://example.com')
+    def test_open_breaker_without_stale_data_returns_503(self):
+        breaker = circuitbreaker.get_breaker('repos')
+        for _ in range(3):
+            breaker.record(False)
+
+        with patch('requests.get') as mock_get:
+            response = self.client.post(reverse('github-repo'), data={'access_token': self.access_token})
+
+        mock_get.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '60')
+
+
+class SlidingWindowThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        caches['throttle'].clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(caches['throttle'].clear)
+        self.url = reverse('github-repo')
+
+    @patch('requests.get')
+    @patch.object(settings, 'USER_REPO_URL', 'https://example.com')
+    def test_budget_exhaustion_returns_429_with_retry_after(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: github_response([])
+        rates = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'github_repos': '3/min'})
+        with override_settings(REST_FRAMEWORK=rates):
+            responses = [self.client.post(self.url, data={'access_token': str(i) * 40}) for i in range(4)]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 429])
+        self.assertGreater(int(responses[-1]['Retry-After']), 0)
+
+    def test_previous_window_is_weighted(self):
+        throttle = SlidingWindowThrottle()
+        # 10 hits in the previous window, 30s into the current 60s window:
+        # half of them still count, leaving room for 5 more in a 10/min budget.
+        throttle.timer = lambda: 60 * 1000 + 30
+        caches['throttle'].set('throttle:test:ip:1:999', 10)
+        results = [throttle.hit('throttle:test:ip:1', 10, 60, throttle.timer()) for _ in range(6)]
+        self.assertEqual(results, [True] * 5 + [False])
+        self.assertAlmostEqual(throttle.wait(), 6.0)
+
+    def test_scopes_and_tokens_have_separate_budgets(self):
+        rates = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'github_fan_out': '1/min', 'github_repos': '1/min'})
+        factory = APIRequestFactory()
+        throttle = SlidingWindowThrottle()
+        with override_settings(REST_FRAMEWORK=rates):
+            fan_out = FetchUserDetails()
+            repos = GithubRepository()
+            request = Request(factory.get('/', REMOTE_ADDR='10.0.0.1'))
+            self.assertTrue(throttle.allow_request(request, fan_out))
+            self.assertTrue(throttle.allow_request(request, repos))
+            self.assertFalse(throttle.allow_request(request, fan_out))
+            self.assertTrue(throttle.allow_request(Request(factory.get('/', REMOTE_ADDR='10.0.0.2')), fan_out))
+
+    def test_rejected_requests_use_no_budget_of_any_ident(self):
+        throttle = SlidingWindowThrottle()
+        throttle.timer = lambda: 60 * 1000
+        keys = ['throttle:test:ip:1', 'throttle:test:token:a']
+        self.assertTrue(throttle.hit_all(keys, 2, 60, throttle.timer()))
+        self.assertTrue(throttle.hit('throttle:test:token:a', 2, 60, throttle.timer()))
+        # The token is out of budget: the IP counter must not move either.
+        for _ in range(3):
+            self.assertFalse(throttle.hit_all(keys, 2, 60, throttle.timer()))
+        self.assertEqual(caches['throttle'].get('throttle:test:ip:1:1000'), 1)
+        self.assertTrue(throttle.hit_all(['throttle:test:ip:1', 'throttle:test:token:b'], 2, 60, throttle.timer()))
+
+    def test_unscoped_views_are_not_throttled(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get(reverse('plans-list')).status_code, status.HTTP_200_OK)
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.plan = Plan.objects.create(plan_type="starter", storage=50, bandwidth=100, memory=4, cpu=2)
+        self.other_plan = Plan.objects.create(plan_type="pro", storage=200, bandwidth=500, memory=16, cpu=4)
+        self.list_url = reverse('plans-list')
+        self.detail_url = reverse('plans-detail', args=[self.plan.id])
+
+    def test_repeat_list_only_reads_the_generation(self):
+        first = self.client.get(self.list_url)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.list_url)
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], 'application/json')
+
+    @override_settings(CACHE_SHARED=True)
+    def test_repeat_list_is_served_without_sql_from_a_shared_cache(self):
+        self.client.get(self.list_url)
+        self.plan.save()
+        self.client.get(self.list_url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    @override_settings(CACHE_SHARED=True)
+    def test_shared_generation_moves_when_the_save_commits(self):
+        before = responsecache.generation(Plan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.save()
+            self.assertEqual(responsecache.generation(Plan), before)
+        self.assertNotEqual(responsecache.generation(Plan), before)
+
+    def test_changes_made_by_another_worker_invalidate(self):
+        self.client.get(self.list_url)
+        self.plan.save()
+        self.client.get(self.list_url)
+        # Another worker's save: its own post_save bumps the shared row, and
+        # nothing in this process's cache changes.
+        CacheGeneration.objects.filter(key=responsecache.generation_key(Plan)).update(value=F('value') + 1)
+
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], 'MISS')
+
+    def test_permissions_are_checked_before_the_cache(self):
+        self.client.get(self.list_url)
+        with patch.object(PlanViewSet, 'permission_classes', [IsAuthenticated]):
+            response = self.client.get(self.list_url)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertNotIn('X-Cache', response)
+
+    def test_query_params_are_cached_separately(self):
+        self.client.get(self.list_url)
+        response = self.client.get(self.list_url, {'fields': 'id'})
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0], {'id': self.plan.id})
+
+    def test_save_invalidates_list_and_only_that_detail(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        other_detail_url = reverse('plans-detail', args=[self.other_plan.id])
+        self.client.get(other_detail_url)
+
+        self.other_plan.cpu = 8
+        self.other_plan.save()
+
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+        other = self.client.get(other_detail_url)
+        self.assertEqual(other['X-Cache'], 'MISS')
+        self.assertEqual(other.json()['cpu'], 8)
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], 'MISS')
+
+    def test_writes_through_the_api_invalidate(self):
+        self.client.get(self.list_url)
+        self.client.delete(self.detail_url)
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()), 1)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0, RESPONSE_CACHE_STALE=60)
+    def test_expired_entry_is_served_stale_while_revalidating(self):
+        self.client.get(self.list_url)
+        key = responsecache.entry_key(RequestFactory().get(self.list_url))
+        # Another request is currently re-rendering the entry
+        cache.add(f'{key}:revalidate', 1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'STALE')
+
+        cache.delete(f'{key}:revalidate')
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], 'MISS')
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.auth_user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.auth_user, repository="sample-repo")
+        self.apps = [
+            AppDetail.objects.create(organizer=self.repo, region=region, framework="react")
+            for region in ("us-west", "eu-west", "us-west", "us-west")
+        ]
+        self.url = reverse('apps-export')
+
+    def read_ndjson(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_ndjson_export_streams_every_row(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = self.read_ndjson(response)
+        self.assertEqual([row['id'] for row in rows], [app.id for app in self.apps])
+        self.assertEqual(rows[0]['organizer'], self.repo.id)
+        self.assertEqual(rows[0]['region'], 'us-west')
+
+    def test_filters_fields_and_resume_cursor(self):
+        response = self.client.get(self.url, {'region': 'us-west', 'after': self.apps[0].id, 'fields': 'region'})
+
+        self.assertEqual(self.read_ndjson(response), [
+            {'id': self.apps[2].id, 'region': 'us-west'},
+            {'id': self.apps[3].id, 'region': 'us-west'},
+        ])
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('app-plans-export'), {'output': 'csv'})
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(), ['id,app,plan,created_at,updated_at'])
+
+        response = self.client.get(reverse('organizer-repo-export'), {'output': 'csv', 'fields': 'repository'})
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(), ['id,repository', f'{self.repo.id},sample-repo'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'after': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_malformed_filter_values_are_per_field_errors(self):
+        response = self.client.get(self.url, {'organizer': 'abc', 'region': 'us-west'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.json()), ['organizer'])
+
+
+class BulkImportCommandTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.auth_user = AuthUser.objects.create(uid=1, provider="github")
+        self.repos = [GithbRepo.objects.create(organizer=self.auth_user, repository=f"repo-{i}") for i in range(3)]
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def run_import(self, *args):
+        out = io.StringIO()
+        call_command('bulk_import', *args, stdout=out)
+        return out.getvalue()
+
+    def test_ndjson_apps_resolve_foreign_keys_per_batch(self):
+        rows = [{'organizer': self.repos[i % 3].id, 'region': f'region-{i}', 'framework': 'react'} for i in range(30)]
+        path = self.write('apps.ndjson', ''.join(json.dumps(row) + '\n' for row in rows))
+
+        # Checkpoint get_or_create (4), then per batch of 10: in_bulk, savepoint,
+        # insert, checkpoint update and release - never one query per row
+        with self.assertNumQueries(4 + 3 * 5):
+            output = self.run_import('apps', path, '--batch-size', '10')
+
+        self.assertIn('Imported 30 apps', output)
+        self.assertEqual(AppDetail.objects.count(), 30)
+        self.assertEqual(AppDetail.objects.filter(organizer=self.repos[1]).count(), 10)
+
+    def test_invalid_rows_are_rejected_and_reported(self):
+        path = self.write('apps.ndjson', '\n'.join([
+            json.dumps({'organizer': self.repos[0].id, 'region': 'eu-west', 'framework': 'vuejs'}),
+            json.dumps({'organizer': 9999, 'region': 'eu-west', 'framework': 'vuejs'}),
+            json.dumps({'organizer': self.repos[0].id, 'framework': 'cobol'}),
+        ]))
+        errors_path = os.path.join(self.directory, 'errors.ndjson')
+
+        output = self.run_import('apps', path, '--errors', errors_path)
+
+        self.assertIn('Imported 1 apps', output)
+        self.assertIn('2 rejected', output)
+        with open(errors_path) as fh:
+            errors = [json.loads(line) for line in fh]
+        self.assertEqual([error['row'] for error in errors], [2, 3])
+        self.assertIn('organizer', errors[0]['errors'])
+        self.assertIn('framework', errors[1]['errors'])
+
+    def test_csv_plans_resume_from_checkpoint(self):
+        lines = ['plan_type,storage,bandwidth,memory,cpu,monthly_cost,price_per_hour']
+        lines += [f'starter,{i},100,4,2,10.00,0.01' for i in range(6)]
+        path = self.write('plans.csv', '\n'.join(lines) + '\n')
+        ImportCheckpoint.objects.create(source=f'plans:{os.path.abspath(path)}', rows_done=4)
+
+        output = self.run_import('plans', path)
+
+        self.assertIn('Resuming after 4 rows', output)
+        self.assertEqual(sorted(Plan.objects.values_list('storage', flat=True)), [4, 5])
+        self.assertEqual(ImportCheckpoint.objects.get().rows_done, 6)
+
+    def test_imported_plans_invalidate_cached_plans_and_the_catalog(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        Plan.objects.create(plan_type="starter", storage=50, bandwidth=100, memory=4, cpu=2, monthly_cost='30.00')
+        client = APIClient()
+        client.get(reverse('plans-list'))
+        self.assertIsNone(planmatch.catalog().cheapest((1, 1, 0, 0), Decimal('20.00')))
+
+        lines = ['plan_type,storage,bandwidth,memory,cpu,monthly_cost,price_per_hour', 'starter,10,100,4,2,10.00,0.01']
+        self.run_import('plans', self.write('plans.csv', '\n'.join(lines) + '\n'))
+
+        response = client.get(reverse('plans-list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(planmatch.catalog().cheapest((1, 1, 0, 0), Decimal('20.00'))['storage'], 10)
+
+    def test_keep_ids(self):
+        path = self.write('repos.ndjson', json.dumps({'id': 500, 'organizer': self.auth_user.id, 'repository': 'kept'}))
+        self.run_import('repos', path, '--keep-ids')
+        self.assertEqual(GithbRepo.objects.get(pk=500).repository, 'kept')
+        # bulk_create bypasses post_save; the command indexes imported repos itself.
+        self.assertEqual(search.search('kep'), [GithbRepo.objects.get(pk=500)])
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.auth_user = AuthUser.objects.create(uid=1, provider="github")
+        names = ['kubern-test', 'Kubernetes', 'mini-kube', 'django', 'db']
+        self.repos = {name: GithbRepo.objects.create(organizer=self.auth_user, repository=name) for name in names}
+        AppDetail.objects.create(organizer=self.repos['kubern-test'], region='eu-west', framework='react')
+        AppDetail.objects.create(organizer=self.repos['Kubernetes'], region='us-east', framework='vuejs')
+        AppDetail.objects.create(organizer=self.repos['mini-kube'], region='eu-west', framework='vuejs')
+
+    def names(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row.get('repository', row.get('organizer')) for row in response.data['results']]
+
+    def test_prefix_is_case_insensitive(self):
+        self.assertEqual(self.names(q='KUBE'), ['kubern-test', 'Kubernetes'])
+        self.assertEqual(self.names(q='k'), ['kubern-test', 'Kubernetes'])
+
+    def test_substring(self):
+        self.assertEqual(self.names(q='kube', match='substring'), ['kubern-test', 'Kubernetes', 'mini-kube'])
+        self.assertEqual(self.names(q='ANG', match='substring'), ['django'])
+        self.assertEqual(self.names(q='%_"', match='substring'), [])
+        self.assertEqual(self.names(q='d'), ['django', 'db'])
+        self.assertEqual(self.names(q='db'), ['db'])
+
+    def test_unindexed_fallback_matches(self):
+        with patch.object(search, 'SELECTIVE_APPS', 1):
+            for params in [('kube', 'substring', 'repos', 'eu-west', None), ('K', 'prefix', 'apps', None, 'vuejs')]:
+                self.assertEqual(search.search(*params), list(search.search_queryset(*params)))
+
+    def test_region_and_framework_filters(self):
+        self.assertEqual(self.names(q='kube', match='substring', region='eu-west'), ['kubern-test', 'mini-kube'])
+        self.assertEqual(self.names(q='kube', match='substring', framework='vuejs'), ['Kubernetes', 'mini-kube'])
+        self.assertEqual(
+            self.names(q='kube', match='substring', type='apps', region='eu-west', framework='vuejs'),
+            [self.repos['mini-kube'].id],
+        )
+
+    def test_index_follows_saves_and_deletes(self):
+        repo = self.repos['django']
+        repo.repository = 'flask'
+        repo.save()
+        self.assertEqual(self.names(q='dj'), [])
+        self.assertEqual(self.names(q='fla'), ['flask'])
+
+        repo.delete()
+        self.assertEqual(self.names(q='fla'), [])
+
+        # update() bypasses signals until the index is rebuilt.
+        GithbRepo.objects.filter(repository='db').update(repository='mini-db')
+        self.assertEqual(self.names(q='mini'), ['mini-kube'])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.names(q='mini'), ['mini-kube', 'mini-db'])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        self.assertEqual(self.names(q='mini'), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.names(q='mini'), ['mini-kube'])
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('search'), {'framework': 'cobol'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('q', response.data)
+        self.assertIn('framework', response.data)
+
+        response = self.client.get(reverse('search'), {'q': 'ku', 'match': 'substring'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('q', response.data)
+
+
+class FilterTests(APITestCase):
+    def setUp(self):
+        self.user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.user, repository="kubern-test")
+        self.apps = [
+            AppDetail.objects.create(organizer=self.repo, region=region, framework=framework)
+            for region, framework in [('eu-west', 'react'), ('eu-west', 'vuejs'), ('us-east', 'react')]
+        ]
+        AppDetail.objects.filter(pk=self.apps[0].pk).update(created_at=datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+        self.pro = Plan.objects.create(plan_type='pro', storage=10, bandwidth=10, memory=2, cpu=1)
+        self.starter = Plan.objects.create(plan_type='starter', storage=1, bandwidth=1, memory=1, cpu=1)
+        AppPlan.objects.create(app=self.apps[0], plan=self.pro)
+        AppPlan.objects.create(app=self.apps[1], plan=self.starter)
+
+    def ids(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.data]
+
+    def test_filters(self):
+        url = reverse('apps-list')
+        self.assertEqual(self.ids(url, region='eu-west'), [self.apps[0].id, self.apps[1].id])
+        self.assertEqual(self.ids(url, region='eu-west', framework='react'), [self.apps[0].id])
+        self.assertEqual(self.ids(url, created_before='2024-06-01'), [self.apps[0].id])
+        self.assertEqual(self.ids(url, created_after='2024-06-01T00:00:00Z'), [self.apps[1].id, self.apps[2].id])
+        self.assertEqual(self.ids(url, organizer=self.repo.id + 1), [])
+        self.assertEqual(len(self.ids(reverse('app-plans-list'), plan__plan_type='pro')), 1)
+
+    def test_ordering_is_whitelisted(self):
+        url = reverse('apps-list')
+        self.assertEqual(self.ids(url), [app.id for app in self.apps])
+        self.assertEqual(self.ids(url, ordering='-created_at'), [app.id for app in reversed(self.apps)])
+        # Not whitelisted: ignored rather than sorting on an unindexed column.
+        self.assertEqual(self.ids(url, ordering='-region'), [app.id for app in self.apps])
+        self.assertEqual(self.ids(url, ordering='-id'), [app.id for app in self.apps])
+        self.assertEqual(len(self.client.get(reverse('plans-list'), {'ordering': '-cpu'}).data), 2)
+
+    def test_malformed_values_are_rejected(self):
+        response = self.client.get(reverse('apps-list'), {'organizer': 'abc', 'created_after': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'organizer', 'created_after'})
+
+
+class FilterPlanTests(TestCase):
+    # Every combination of declared filters, under every whitelisted
+    # ordering, must be answered from an index: no full table scans.
+    viewsets = (OrganizerGithubViewSet, AppDetailViewSet, AppPlanViewSet)
+    values = {
+        'organizer': '1', 'repository': 'kubern-test', 'region': 'eu-west', 'framework': 'react',
+        'app': '1', 'plan': '1', 'plan__plan_type': 'pro',
+        'created_after': '2024-01-01', 'created_before': '2025-01-01',
+    }
+
+    def plan(self, viewset, params):
+        view = viewset(action='list', kwargs={}, format_kwarg=None)
+        view.request = Request(APIRequestFactory().get('/', params))
+        return view.filter_queryset(view.get_queryset()).explain()
+
+    def test_no_full_table_scans(self):
+        for viewset in self.viewsets:
+            names = list(viewset.filter_fields)
+            combos = [combo for size in range(1, len(names) + 1) for combo in itertools.combinations(names, size)]
+            # None: the view's default ordering.
+            orderings = [None] + [prefix + field for field in viewset.ordering_fields for prefix in ('', '-')]
+            for combo in combos:
+                for ordering in orderings:
+                    params = {name: self.values[name] for name in combo}
+                    if ordering:
+                        params['ordering'] = ordering
+                    plan = self.plan(viewset, params)
+                    with self.subTest(viewset=viewset.__name__, params=params):
+                        self.assertNotIn('SCAN', plan)
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.user, repository="kubern-test")
+        self.app = AppDetail.objects.create(organizer=self.repo, region="eu-west", framework="react")
+        self.plan = Plan.objects.create(plan_type="pro", storage=10, bandwidth=10, memory=2, cpu=1)
+        self.assign_url = reverse('app-plans-assign-plan', args=[self.app.id])
+
+    def test_create_is_replayed(self):
+        data = {'organizer': self.repo.id, 'region': 'us-east', 'framework': 'vuejs'}
+        first = self.client.post(reverse('apps-list'), data, HTTP_IDEMPOTENCY_KEY='k1')
+        second = self.client.post(reverse('apps-list'), data, HTTP_IDEMPOTENCY_KEY='k1')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((second.status_code, second.content), (first.status_code, first.content))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(AppDetail.objects.filter(region='us-east').count(), 1)
+
+        # Without a key, or with another one, the request runs again.
+        self.client.post(reverse('apps-list'), data)
+        self.client.post(reverse('apps-list'), data, HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(AppDetail.objects.filter(region='us-east').count(), 3)
+
+    def test_assign_plan_is_replayed(self):
+        for _ in range(3):
+            response = self.client.post(self.assign_url, {'plan_id': self.plan.id}, HTTP_IDEMPOTENCY_KEY='assign-1')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(AppPlan.objects.filter(app=self.app).count(), 1)
+
+    def test_client_errors_are_replayed(self):
+        self.client.post(self.assign_url, {'plan_id': 999}, HTTP_IDEMPOTENCY_KEY='missing')
+        Plan.objects.create(pk=999, plan_type="starter", storage=1, bandwidth=1, memory=1, cpu=1)
+        response = self.client.post(self.assign_url, {'plan_id': 999}, HTTP_IDEMPOTENCY_KEY='missing')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_key_reused_with_other_body(self):
+        self.client.post(self.assign_url, {'plan_id': self.plan.id}, HTTP_IDEMPOTENCY_KEY='k')
+        response = self.client.post(self.assign_url, {'plan_id': 999}, HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 422)
+
+    def test_keys_are_scoped_per_client(self):
+        self.client.post(self.assign_url, {'plan_id': self.plan.id}, HTTP_IDEMPOTENCY_KEY='k', HTTP_AUTHORIZATION='a')
+        response = self.client.post(self.assign_url, {'plan_id': self.plan.id}, HTTP_IDEMPOTENCY_KEY='k', HTTP_AUTHORIZATION='b')
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(AppPlan.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=0.1)
+    def test_duplicate_gives_up_with_409(self):
+        request = RequestFactory().post('/api/apps/', {'a': 1})
+        IdempotencyKey.objects.create(
+            key=idempotency.scope_key(request, 'k'), fingerprint=idempotency.fingerprint(request), created_at=timezone.now(),
+        )
+        response = idempotency.run(request, 'k', lambda: self.fail("duplicate must not execute"))
+        self.assertEqual(response.status_code, 409)
+
+    def test_abandoned_claim_is_taken_over(self):
+        request = RequestFactory().post('/api/apps/', {'a': 1})
+        IdempotencyKey.objects.create(
+            key=idempotency.scope_key(request, 'k'), fingerprint=idempotency.fingerprint(request),
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TTL + 1),
+        )
+        response = idempotency.run(request, 'k', lambda: HttpResponse(b'ok', status=201))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get().status, 201)
+
+    def test_purge(self):
+        now = timezone.now()
+        IdempotencyKey.objects.create(key='expired', fingerprint='x', status=201, created_at=now - timedelta(seconds=settings.IDEMPOTENCY_TTL + 1))
+        IdempotencyKey.objects.create(key='abandoned', fingerprint='x', created_at=now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TTL + 1))
+        IdempotencyKey.objects.create(key='done', fingerprint='x', status=201, created_at=now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TTL + 1))
+        IdempotencyKey.objects.create(key='running', fingerprint='x', created_at=now)
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn("Deleted 2 idempotency keys", out.getvalue())
+        self.assertEqual(sorted(IdempotencyKey.objects.values_list('key', flat=True)), ['done', 'running'])
+
+
+class IdempotencyWorkerTests(TransactionTestCase):
+    # Originals and duplicates run on separate threads, i.e. separate
+    # database connections, as they would in separate workers.
+
+    def test_concurrent_duplicates_wait_for_the_original(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def handler():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return HttpResponse(b'{"ok": true}', status=201, content_type='application/json')
+
+        request = RequestFactory().post('/api/apps/', {'a': 1})
+        responses = []
+        original = threading.Thread(target=lambda: responses.append(idempotency.run(request, 'k', handler)))
+        original.start()
+        started.wait(5)
+        duplicate = threading.Thread(target=lambda: responses.append(idempotency.run(request, 'k', handler)))
+        duplicate.start()
+        time.sleep(0.2)
+        release.set()
+        original.join(5)
+        duplicate.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=0.1)
+    def test_claim_outlives_the_wait_timeout(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def handler():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return HttpResponse(b'{"ok": true}', status=201, content_type='application/json')
+
+        request = RequestFactory().post('/api/apps/', {'a': 1})
+        original = threading.Thread(target=lambda: idempotency.run(request, 'k', handler))
+        original.start()
+        started.wait(5)
+        time.sleep(0.2)
+        # Past IDEMPOTENCY_LOCK_TIMEOUT the duplicate gives up, but does not run.
+        self.assertEqual(idempotency.run(request, 'k', handler).status_code, 409)
+        release.set()
+        original.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(idempotency.run(request, 'k', handler)['Idempotent-Replayed'], 'true')
+
+    def test_server_errors_are_not_stored(self):
+        request = RequestFactory().post('/api/apps/', {'a': 1})
+        idempotency.run(request, 'k', lambda: HttpResponse(status=503))
+        response = idempotency.run(request, 'k', lambda: HttpResponse(status=201))
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+
+class CurrentPlanTests(APITestCase):
+    def setUp(self):
+        self.user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.user, repository="kubern-test")
+        self.app = AppDetail.objects.create(organizer=self.repo, region="eu-west", framework="react")
+        self.starter = Plan.objects.create(plan_type="starter", storage=1, bandwidth=1, memory=1, cpu=1)
+        self.pro = Plan.objects.create(plan_type="pro", storage=10, bandwidth=10, memory=2, cpu=1)
+        self.url = reverse('apps-current-plan', args=[self.app.id])
+
+    def assign(self, plan):
+        response = self.client.post(reverse('app-plans-assign-plan', args=[self.app.id]), {'plan_id': plan.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_assignment_moves_the_pointer(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assign(self.starter)
+        self.assign(self.pro)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['plan_type'], 'pro')
+        self.assertEqual(AppPlan.objects.filter(app=self.app).count(), 2)
+
+    def test_deleting_the_current_assignment_falls_back(self):
+        self.assign(self.starter)
+        self.assign(self.pro)
+        self.client.delete(reverse('app-plans-detail', args=[AppPlan.objects.latest('id').id]))
+
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.current_plan, self.starter)
+        AppPlan.objects.get().delete()
+        self.app.refresh_from_db()
+        self.assertIsNone(self.app.current_plan)
+
+    def test_deleting_the_current_plan_falls_back(self):
+        self.assign(self.starter)
+        self.assign(self.pro)
+        self.pro.delete()
+
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.current_plan, self.starter)
+        self.assertEqual(self.app.current_plan_assigned_at, AppPlan.objects.get().created_at)
+        # The usage summary followed the change through current_plan_changed.
+        self.assertEqual(usage.check(), [])
+        self.assertEqual(OwnerUsageSummary.objects.get(owner=self.user).apps, 1)
+
+        Plan.objects.filter(pk=self.starter.pk).delete()
+        self.app.refresh_from_db()
+        self.assertEqual((self.app.current_plan, self.app.current_plan_assigned_at), (None, None))
+
+    def test_older_assignment_does_not_win(self):
+        newer = AppPlan.objects.create(app=self.app, plan=self.pro)
+        older = AppPlan(app=self.app, plan=self.starter)
+        older.created_at = newer.created_at - timedelta(seconds=1)
+        # Simulates a transaction that committed after a newer assignment.
+        with patch.object(AppPlan._meta.get_field('created_at'), 'pre_save', lambda obj, add: obj.created_at):
+            older.save()
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.current_plan, self.pro)
+
+    def test_pointer_is_read_only_through_the_api(self):
+        self.assign(self.starter)
+        response = self.client.patch(reverse('apps-detail', args=[self.app.id]), {'current_plan': self.pro.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['current_plan'], self.starter.id)
+
+    def test_bulk_import_updates_pointers(self):
+        path = os.path.join(tempfile.mkdtemp(), 'app-plans.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(json.dumps({'app': self.app.id, 'plan': self.pro.id}) + '\n')
+        call_command('bulk_import', 'app-plans', path, stdout=io.StringIO())
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.current_plan, self.pro)
+
+
+class CompactAppPlansTests(TestCase):
+    def setUp(self):
+        user = AuthUser.objects.create(uid=1, provider="github")
+        repo = GithbRepo.objects.create(organizer=user, repository="kubern-test")
+        self.app = AppDetail.objects.create(organizer=repo, region="eu-west", framework="react")
+        self.a = Plan.objects.create(plan_type="starter", storage=1, bandwidth=1, memory=1, cpu=1)
+        self.b = Plan.objects.create(plan_type="pro", storage=10, bandwidth=10, memory=2, cpu=1)
+
+    def history(self, *entries):
+        # (plan, days ago) pairs, oldest first.
+        for plan, days in entries:
+            app_plan = AppPlan.objects.create(app=self.app, plan=plan)
+            AppPlan.objects.filter(pk=app_plan.pk).update(created_at=timezone.now() - timedelta(days=days))
+        AppDetail.objects.filter(pk=self.app.pk).update(current_plan=None, current_plan_assigned_at=None)
+
+    def compact(self):
+        call_command('compact_app_plans', '--older-than', '30', '--batch-size', '1', stdout=io.StringIO())
+
+    def runs(self):
+        return list(AppPlanArchive.objects.order_by('first_assigned_at').values_list('plan_id', 'assignments'))
+
+    def test_runs_are_collapsed_and_recent_history_kept(self):
+        self.history((self.a, 100), (self.a, 90), (self.b, 80), (self.a, 70), (self.b, 10))
+        self.compact()
+
+        self.assertEqual(self.runs(), [(self.a.id, 2), (self.b.id, 1), (self.a.id, 1)])
+        self.assertEqual(list(AppPlan.objects.values_list('plan_id', flat=True)), [self.b.id])
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.current_plan, self.b)
+
+    def test_current_assignment_is_never_archived(self):
+        self.history((self.a, 100), (self.b, 90))
+        self.compact()
+        self.assertEqual(self.runs(), [(self.a.id, 1)])
+        self.assertEqual(list(AppPlan.objects.values_list('plan_id', flat=True)), [self.b.id])
+
+        # A later run extends the last archived run instead of adding a row.
+        self.history((self.b, 50), (self.a, 5))
+        self.compact()
+        self.assertEqual(self.runs(), [(self.a.id, 1), (self.b.id, 2)])
+        self.assertEqual(list(AppPlan.objects.values_list('plan_id', flat=True)), [self.a.id])
+
+
+class OwnerUsageSummaryTests(APITestCase):
+    def setUp(self):
+        self.user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.user, repository="kubern-test")
+        self.app = AppDetail.objects.create(organizer=self.repo, region="eu-west", framework="react")
+        self.starter = Plan.objects.create(plan_type="starter", storage=1, bandwidth=2, memory=1, cpu=1, monthly_cost=Decimal('5.00'))
+        self.pro = Plan.objects.create(plan_type="pro", storage=10, bandwidth=20, memory=4, cpu=2, monthly_cost=Decimal('25.50'))
+
+    def summary(self):
+        return OwnerUsageSummary.objects.get(owner=self.user)
+
+    def assertConsistent(self):
+        self.assertEqual(usage.check(), [])
+
+    def test_assignment_applies_the_difference(self):
+        AppPlan.objects.create(app=self.app, plan=self.starter)
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        summary = self.summary()
+        self.assertEqual((summary.apps, summary.monthly_cost, summary.cpu, summary.storage), (1, Decimal('25.50'), 2, 10))
+        self.assertConsistent()
+
+    def test_database_plans_count(self):
+        AppPlan.objects.create(app=self.app, plan=self.starter)
+        database = DatabasePlan.objects.create(owner=self.user, database_type='mysql', plan=self.pro)
+        self.assertEqual(self.summary().monthly_cost, Decimal('30.50'))
+        database.plan = self.starter
+        database.save()
+        self.assertEqual(self.summary().monthly_cost, Decimal('10.00'))
+        database.delete()
+        self.assertEqual((self.summary().databases, self.summary().monthly_cost), (0, Decimal('5.00')))
+        self.assertConsistent()
+
+    def test_price_change_reaches_every_owner(self):
+        other = AuthUser.objects.create(uid=2, provider="github")
+        other_repo = GithbRepo.objects.create(organizer=other, repository="other")
+        for repo in (self.repo, self.repo, other_repo):
+            AppPlan.objects.create(app=AppDetail.objects.create(organizer=repo, region="eu-west"), plan=self.starter)
+        self.starter.monthly_cost = Decimal('6.00')
+        self.starter.cpu = 2
+        self.starter.save()
+        self.assertEqual((self.summary().monthly_cost, self.summary().cpu), (Decimal('12.00'), 4))
+        self.assertEqual(OwnerUsageSummary.objects.get(owner=other).monthly_cost, Decimal('6.00'))
+        self.assertConsistent()
+
+    def test_app_and_plan_deletes(self):
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        second = AppDetail.objects.create(organizer=self.repo, region="eu-west")
+        AppPlan.objects.create(app=second, plan=self.starter)
+        self.app.delete()
+        self.assertEqual((self.summary().apps, self.summary().monthly_cost), (1, Decimal('5.00')))
+        self.starter.delete()
+        self.assertEqual((self.summary().apps, self.summary().monthly_cost), (0, Decimal('0.00')))
+        self.repo.delete()
+        self.assertConsistent()
+
+    def test_owner_delete_cascades(self):
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        DatabasePlan.objects.create(owner=self.user, plan=self.pro)
+        self.user.delete()
+        self.assertFalse(OwnerUsageSummary.objects.exists())
+
+    def test_rebuild_command_checks_and_repairs(self):
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        OwnerUsageSummary.objects.filter(owner=self.user).update(cpu=99)
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_usage_summaries', '--check', stdout=out)
+        self.assertIn(f"owner {self.user.id}: cpu is 99, expected 2", out.getvalue())
+
+        call_command('rebuild_usage_summaries', stdout=io.StringIO())
+        self.assertEqual(self.summary().cpu, 2)
+        call_command('rebuild_usage_summaries', '--check', stdout=io.StringIO())
+
+    def test_missing_row_is_rebuilt_on_next_change(self):
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        OwnerUsageSummary.objects.all().delete()
+        DatabasePlan.objects.create(owner=self.user, plan=self.starter)
+        self.assertEqual(self.summary().monthly_cost, Decimal('30.50'))
+
+    def test_endpoint(self):
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        idle = AuthUser.objects.create(uid=2, provider="github")
+        response = self.client.get(reverse('usage-detail', args=[self.user.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['monthly_cost'], response.data['apps']), ('25.50', 1))
+
+        response = self.client.get(reverse('usage-detail', args=[idle.id]))
+        self.assertEqual((response.status_code, response.data['monthly_cost']), (status.HTTP_200_OK, '0.00'))
+        self.assertFalse(OwnerUsageSummary.objects.filter(owner=idle).exists())
+        self.assertEqual(self.client.get(reverse('usage-detail', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse('usage-list'), {'ordering': '-monthly_cost'})
+        self.assertEqual(response.data[0]['owner'], self.user.id)
+
+    def test_missing_row_is_aggregated_without_writing(self):
+        AppPlan.objects.create(app=self.app, plan=self.pro)
+        OwnerUsageSummary.objects.all().delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('usage-detail', args=[self.user.id]))
+        self.assertEqual((response.data['monthly_cost'], response.data['cpu']), ('25.50', 2))
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertFalse(OwnerUsageSummary.objects.exists())
+
+
+class MeteringTests(APITestCase):
+    DAY_START = int(datetime(2026, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+
+    def setUp(self):
+        self.user = AuthUser.objects.create(uid=1, provider="github")
+        self.repo = GithbRepo.objects.create(organizer=self.user, repository="kubern-test")
+        self.app = AppDetail.objects.create(organizer=self.repo, region="eu-west", framework="react")
+        self.plan = Plan.objects.create(
+            plan_type="pro", storage=5, bandwidth=1, memory=4, cpu=2, price_per_hour=Decimal('0.40'),
+        )
+        # Assigned before the usage the tests record.
+        self.assign(self.app, self.plan, datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+        self.url = reverse('metering-events')
+        self.addCleanup(metering.usage_buffer.flush)
+        # App ids are reused between tests.
+        self.addCleanup(metering.known_apps.clear)
+
+    def event(self, offset, **values):
+        return {'app': self.app.id, 'ts': self.DAY_START + offset, **values}
+
+    def assign(self, app, plan, at):
+        app_plan = AppPlan.objects.create(app=app, plan=plan)
+        AppPlan.objects.filter(pk=app_plan.pk).update(created_at=at)
+
+    def bucket(self, resolution, offset):
+        return UsageBucket.objects.get(
+            app=self.app, resolution=resolution, start=datetime.fromtimestamp(self.DAY_START + offset, dt_timezone.utc),
+        )
+
+    @override_settings(METERING_WRITE_BEHIND=False)
+    def test_events_roll_up_into_minutes_hours_and_days(self):
+        response = self.client.post(self.url, {'events': [
+            self.event(5, cpu_seconds=1.5, bytes_out=100, gb_stored=2),
+            self.event(50, cpu_seconds=0.5, bytes_out=50, gb_stored=3),
+            self.event(3600 + 10, cpu_seconds=2, gb_stored=1),
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'accepted': 3, 'rejected': []})
+
+        minute = self.bucket(UsageBucket.MINUTE, 0)
+        self.assertEqual((minute.cpu_seconds, minute.bytes_out, minute.gb_stored, minute.events), (2.0, 150, 3.0, 2))
+        self.assertEqual(UsageBucket.objects.filter(resolution=UsageBucket.HOUR).count(), 2)
+        day = self.bucket(UsageBucket.DAY, 0)
+        self.assertEqual((day.cpu_seconds, day.bytes_out, day.gb_stored, day.events), (4.0, 150, 3.0, 3))
+
+        # Later batches add to the same buckets.
+        self.client.post(self.url, [self.event(20, cpu_seconds=1)], format='json')
+        self.assertEqual(self.bucket(UsageBucket.DAY, 0).cpu_seconds, 5.0)
+        self.assertEqual(self.bucket(UsageBucket.MINUTE, 0).events, 3)
+
+    @override_settings(METERING_WRITE_BEHIND=False)
+    def test_invalid_events_are_rejected_individually(self):
+        response = self.client.post(self.url, {'events': [
+            self.event(0, cpu_seconds=1),
+            {'app': 999, 'ts': self.DAY_START},
+            {'app': self.app.id},
+            self.event(0, cpu_seconds=-1),
+            self.event(0, bytes_out=True),
+            {'app': self.app.id, 'ts': 'yesterday'},
+            'not an event',
+            self.event(10 ** 20),
+            {'app': self.app.id, 'ts': '2026-01-01T00:00:10Z', 'cpu_seconds': 2},
+        ]}, format='json')
+        self.assertEqual(response.data['accepted'], 2)
+        self.assertEqual([error['index'] for error in response.data['rejected']], [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.bucket(UsageBucket.MINUTE, 0).cpu_seconds, 3.0)
+
+    def test_batch_limits(self):
+        self.assertEqual(self.client.post(self.url, {'events': 'x'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(METERING_MAX_EVENTS=1):
+            response = self.client.post(self.url, [self.event(0), self.event(1)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_buffered_until_flush(self):
+        for _ in range(3):
+            self.client.post(self.url, [self.event(0, cpu_seconds=1), self.event(90, cpu_seconds=1)], format='json')
+        self.assertFalse(UsageBucket.objects.exists())
+        self.assertEqual(metering.usage_buffer.pending(), {
+            (self.app.id, self.DAY_START): [3, 0, 0, 3],
+            (self.app.id, self.DAY_START + 60): [3, 0, 0, 3],
+        })
+
+        # Savepoint, app check, one executemany for every bucket, release.
+        with self.assertNumQueries(4):
+            self.assertEqual(metering.usage_buffer.flush(), 2)
+        self.assertEqual(self.bucket(UsageBucket.DAY, 0).cpu_seconds, 6.0)
+        self.assertEqual(metering.usage_buffer.pending(), {})
+
+    def test_flush_at_max_pending(self):
+        with override_settings(METERING_FLUSH_MAX_PENDING=2):
+            self.client.post(self.url, [self.event(0)], format='json')
+            self.assertFalse(UsageBucket.objects.exists())
+            self.client.post(self.url, [self.event(60)], format='json')
+        self.assertEqual(UsageBucket.objects.filter(resolution=UsageBucket.MINUTE).count(), 2)
+
+    def test_failed_flush_keeps_usage(self):
+        self.client.post(self.url, [self.event(0, cpu_seconds=1)], format='json')
+        with patch.object(metering, 'write', side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                metering.usage_buffer.flush()
+        self.client.post(self.url, [self.event(0, cpu_seconds=1)], format='json')
+        metering.usage_buffer.flush()
+        self.assertEqual(self.bucket(UsageBucket.MINUTE, 0).cpu_seconds, 2.0)
+
+    def test_background_flush_closes_its_connections(self):
+        with patch('api.metering.connections.close_all') as close_all, \
+                patch.object(metering.usage_buffer, 'flush', side_effect=RuntimeError):
+            thread = threading.Thread(target=lambda: self.assertRaises(RuntimeError, metering.usage_buffer.flush_in_background))
+            thread.start()
+            thread.join()
+        close_all.assert_called_once_with()
+
+    def test_failing_write_at_max_pending_does_not_retry_at_once(self):
+        failure = OperationalError("database is locked")
+        with override_settings(METERING_FLUSH_MAX_PENDING=2), \
+                patch.object(metering, 'write', side_effect=failure) as write:
+            for second in range(0, 300, 60):
+                response = self.client.post(self.url, [self.event(second, cpu_seconds=1)], format='json')
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            # One attempt at the limit, then the timer's backoff.
+            self.assertEqual(write.call_count, 1)
+            self.assertEqual(len(metering.usage_buffer.pending()), 5)
+            with self.assertRaises(OperationalError):
+                metering.usage_buffer.flush()
+            self.assertEqual(write.call_count, 2)
+        metering.usage_buffer.flush()
+        self.assertEqual(UsageBucket.objects.filter(resolution=UsageBucket.MINUTE).count(), 5)
+
+    def test_usage_of_deleted_apps_is_dropped_on_flush(self):
+        self.client.post(self.url, [self.event(0, cpu_seconds=1)], format='json')
+        self.app.delete()
+        metering.usage_buffer.flush()
+        self.assertFalse(UsageBucket.objects.exists())
+
+    def test_cover_uses_the_coarsest_buckets(self):
+        start = self.DAY_START + 23 * 3600 + 59 * 60
+        end = self.DAY_START + 2 * 86400 + 3600 + 60
+        self.assertEqual(sorted(metering.cover(start, end)), [
+            (UsageBucket.MINUTE, start, self.DAY_START + 86400),
+            (UsageBucket.MINUTE, self.DAY_START + 2 * 86400 + 3600, end),
+            (UsageBucket.HOUR, self.DAY_START + 2 * 86400, self.DAY_START + 2 * 86400 + 3600),
+            (UsageBucket.DAY, self.DAY_START + 86400, self.DAY_START + 2 * 86400),
+        ])
+
+    def test_invoice_prices_every_app_in_one_query(self):
+        other_repo = GithbRepo.objects.create(organizer=AuthUser.objects.create(uid=2), repository="other")
+        other_app = AppDetail.objects.create(organizer=other_repo)
+        second = AppDetail.objects.create(organizer=self.repo)
+        metering.write(metering.parse_events([
+            self.event(10 * 3600, cpu_seconds=3600, bytes_out=2 * 10 ** 9, gb_stored=7),
+            self.event(86400 + 1800, cpu_seconds=3600, bytes_out=10 ** 9, gb_stored=4),
+            self.event(86400 + 7200, cpu_seconds=3600),
+            {'app': second.id, 'ts': self.DAY_START, 'bytes_out': 10 ** 9},
+            {'app': other_app.id, 'ts': self.DAY_START, 'cpu_seconds': 3600},
+        ])[0])
+
+        start = datetime.fromtimestamp(self.DAY_START, dt_timezone.utc)
+        with self.assertNumQueries(1):
+            bill = metering.invoice(self.user.id, start, start + timedelta(days=1, hours=1))
+        first, other = bill['apps']
+        # 2 core-hours at 0.40/h for 2 cores, 2 GB over the 1 GB allowance, 2 GB over 5 GB of storage.
+        self.assertEqual((first['compute'], first['bandwidth'], first['storage']), (Decimal('0.40'), Decimal('0.18'), Decimal('0.20')))
+        self.assertEqual((first['cpu_seconds'], first['events']), (7200.0, 2))
+        # No plan: no compute price and no allowances.
+        self.assertEqual((other['app'], other['plan'], other['total']), (second.id, None, Decimal('0.09')))
+        self.assertEqual(bill['total'], Decimal('0.87'))
+
+    def test_invoice_prices_usage_at_the_plan_then_in_effect(self):
+        cheap = Plan.objects.create(plan_type="basic", storage=1, bandwidth=1, memory=1, cpu=1, price_per_hour=Decimal('0.10'))
+        self.assign(self.app, cheap, datetime.fromtimestamp(self.DAY_START + 86400, dt_timezone.utc))
+        metering.write(metering.parse_events([
+            self.event(3600, cpu_seconds=7200, gb_stored=3),
+            self.event(86400 + 3600, cpu_seconds=3600, gb_stored=2),
+        ])[0])
+
+        start = datetime.fromtimestamp(self.DAY_START, dt_timezone.utc)
+        with self.assertNumQueries(1):
+            bill = metering.invoice(self.user.id, start, start + timedelta(days=2))
+        app, = bill['apps']
+        # 2 core-hours at 0.40/h for 2 cores, then 1 core-hour at 0.10/h for 1 core.
+        self.assertEqual(app['plans'], [
+            {'plan': self.plan.id, 'cpu_seconds': 7200.0, 'compute': Decimal('0.40')},
+            {'plan': cheap.id, 'cpu_seconds': 3600.0, 'compute': Decimal('0.10')},
+        ])
+        # Storage is measured against the plan in effect last: 3 GB over 1 GB.
+        self.assertEqual((app['plan'], app['compute'], app['storage']), (cheap.id, Decimal('0.50'), Decimal('0.20')))
+
+        # Usage from before the first assignment has no price.
+        AppPlan.objects.filter(app=self.app).update(created_at=start + timedelta(days=3))
+        self.assertEqual(metering.invoice(self.user.id, start, start + timedelta(days=2))['apps'][0]['compute'], Decimal('0.00'))
+
+    def test_invoice_endpoint(self):
+        metering.write(metering.parse_events([self.event(60, cpu_seconds=36000)])[0])
+        url = reverse('metering-invoice', args=[self.user.id])
+        response = self.client.get(url, {'start': '2026-01-01T00:01:00Z', 'end': '2026-01-01T00:02:00Z'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], Decimal('2.00'))
+
+        response = self.client.get(url, {'start': '2026-01-01T00:02:00Z', 'end': '2026-01-01T00:01:00Z'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('metering-invoice', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PlanMatchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        def plan(plan_type, cpu, memory, storage, bandwidth, cost):
+            return Plan.objects.create(
+                plan_type=plan_type, cpu=cpu, memory=memory, storage=storage, bandwidth=bandwidth,
+                monthly_cost=Decimal(cost),
+            )
+        self.small = plan("starter", 1, 1, 10, 100, '5.00')
+        self.medium = plan("pro", 2, 4, 50, 500, '20.00')
+        self.dominated = plan("pro", 2, 2, 20, 200, '25.00')
+        self.large = plan("enterprise", 8, 16, 200, 2000, '80.00')
+        self.storage = plan("pro", 1, 2, 500, 500, '30.00')
+        self.url = reverse('plans-match')
+
+    def test_frontier_drops_dominated_plans(self):
+        frontier = [entry[-1] for entry in planmatch.catalog().frontier]
+        self.assertEqual(frontier, [self.small.id, self.medium.id, self.storage.id, self.large.id])
+
+    def test_cheapest_match(self):
+        response = self.client.get(self.url, {'cpu': 2, 'memory': 3})
+        self.assertEqual(response.data['id'], self.medium.id)
+        self.assertEqual(self.client.get(self.url, {'storage': 100}).data['id'], self.storage.id)
+
+        response = self.client.get(self.url, {'storage': 100, 'max_cost': '25'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(self.url, {'cpu': -1}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pareto_set(self):
+        response = self.client.get(self.url, {'storage': 50, 'pareto': 'true'})
+        self.assertEqual([plan['id'] for plan in response.data['plans']], [self.medium.id, self.storage.id, self.large.id])
+        response = self.client.get(self.url, {'storage': 50, 'max_cost': '30', 'pareto': 'true'})
+        self.assertEqual([plan['id'] for plan in response.data['plans']], [self.medium.id, self.storage.id])
+
+    def test_catalog_follows_plan_changes(self):
+        self.assertEqual(self.client.get(self.url, {'cpu': 2, 'memory': 2}).data['id'], self.medium.id)
+        self.client.patch(reverse('plans-detail', args=[self.medium.id]), {'monthly_cost': '100.00'}, format='json')
+        self.assertEqual(self.client.get(self.url, {'cpu': 2, 'memory': 2}).data['id'], self.dominated.id)
+
+        self.dominated.delete()
+        self.assertEqual(self.client.get(self.url, {'cpu': 2, 'memory': 2}).data['id'], self.large.id)
+
+    def test_catalog_follows_changes_made_by_another_worker(self):
+        built = planmatch.catalog()
+        # A save in another worker: no signal here, only its generation bump.
+        Plan.objects.filter(pk=self.medium.pk).update(monthly_cost=Decimal('100.00'))
+        CacheGeneration.objects.filter(key=responsecache.generation_key(Plan)).update(value=F('value') + 1)
+
+        self.assertIsNot(planmatch.catalog(), built)
+        self.assertEqual(self.client.get(self.url, {'cpu': 2, 'memory': 2}).data['id'], self.dominated.id)
+
+    def test_batch(self):
+        records = [
+            {'app': 1, 'cpu': 2, 'memory': 3},
+            {'app': 2, 'cpu': 64},
+            {'app': 3, 'storage': 100, 'max_cost': '50'},
+        ]
+        planmatch.catalog()
+        # Only the catalog's generation check.
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'requirements': records * 1000}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 3000)
+        self.assertEqual(
+            [(result['app'], result['plan'] and result['plan']['id']) for result in results[:3]],
+            [(1, self.medium.id), (2, None), (3, self.storage.id)],
+        )
+
+        response = self.client.post(self.url, {'requirements': records[:1], 'pareto': True}, format='json')
+        self.assertEqual([plan['id'] for plan in response.data['results'][0]['plans']], [self.medium.id, self.large.id])
+
+        response = self.client.post(self.url, {'requirements': [{'cpu': 1}, {'cpu': 'many'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cpu', response.data['requirements'][1])
+
+
+class PlacementTests(APITestCase):
+    def setUp(self):
+        self.repo = GithbRepo.objects.create(organizer=AuthUser.objects.create(uid=1), repository="kubern-test")
+        self.small = Plan.objects.create(plan_type="starter", storage=1, bandwidth=1, memory=2, cpu=1)
+        self.big = Plan.objects.create(plan_type="pro", storage=1, bandwidth=1, memory=8, cpu=4)
+        self.eu_a = Node.objects.create(region="eu", name="a", cpu=4, memory=8)
+        self.eu_b = Node.objects.create(region="eu", name="b", cpu=8, memory=16)
+        self.us_a = Node.objects.create(region="us", name="a", cpu=2, memory=4)
+
+    def app(self, plan, region="eu"):
+        app = AppDetail.objects.create(organizer=self.repo, region=region)
+        AppPlan.objects.create(app=app, plan=plan)
+        return app
+
+    def used(self, node):
+        node.refresh_from_db()
+        return node.cpu_used, node.memory_used
+
+    def assertCountersConsistent(self):
+        counters = list(Node.objects.order_by('pk').values_list('cpu_used', 'memory_used'))
+        placement.refresh_usage()
+        self.assertEqual(counters, list(Node.objects.order_by('pk').values_list('cpu_used', 'memory_used')))
+
+    def test_place_picks_the_best_fit(self):
+        app = self.app(self.small)
+        response = self.client.post(reverse('apps-place', args=[app.id]), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['id'], response.data['cpu_used']), (self.eu_a.id, 1))
+        app.refresh_from_db()
+        self.assertEqual((app.node, app.region), (self.eu_a, "eu"))
+
+    def test_capacity_is_respected_and_moves_release_it(self):
+        apps = [self.app(self.big) for _ in range(4)]
+        self.assertEqual([placement.place(app.id).pk for app in apps[:3]], [self.eu_a.id, self.eu_b.id, self.eu_b.id])
+        response = self.client.post(reverse('apps-place', args=[apps[3].id]), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        small = self.app(self.small)
+        placement.place(small.id, "us")
+        self.assertEqual(self.used(self.us_a), (1, 2))
+        with self.assertRaises(placement.NoCapacity):
+            placement.place(small.id, "eu")
+        self.assertEqual(self.used(self.us_a), (1, 2))
+        self.assertCountersConsistent()
+
+    def test_counters_follow_plans_and_deletes(self):
+        app = self.app(self.small)
+        placement.place(app.id, "eu")
+        AppPlan.objects.create(app=app, plan=self.big)
+        self.assertEqual(self.used(self.eu_a), (4, 8))
+
+        self.big.cpu = 6
+        self.big.save()
+        # Overcommitted until the next rebalance.
+        self.assertEqual(self.used(self.eu_a), (6, 8))
+        self.assertCountersConsistent()
+
+        app.delete()
+        self.assertEqual(self.used(self.eu_a), (0, 0))
+
+    def test_fit_query(self):
+        placement.place(self.app(self.small).id, "eu")
+        url = reverse('placement-fit')
+        response = self.client.get(url, {'cpu': 3, 'memory': 4})
+        self.assertEqual([node['id'] for node in response.data['nodes']], [self.eu_a.id, self.eu_b.id])
+        self.assertEqual(response.data['regions'], {'eu': 2})
+
+        app = self.app(self.big, region=None)
+        response = self.client.get(url, {'app': app.id})
+        self.assertEqual((response.data['cpu'], [node['id'] for node in response.data['nodes']]), (4, [self.eu_b.id]))
+
+        self.eu_b.schedulable = False
+        self.eu_b.save()
+        self.assertEqual(self.client.get(url, {'app': app.id}).data['nodes'], [])
+        self.assertEqual(self.client.get(url, {'cpu': 1, 'region': 'us'}).data['regions'], {'us': 1, 'eu': 1})
+
+    def test_rebalance(self):
+        upgraded, other = self.app(self.small), self.app(self.small)
+        placement.place(upgraded.id, "eu")
+        placement.place(other.id, "eu")
+        AppPlan.objects.create(app=upgraded, plan=self.big)   # eu/a now needs 5 CPU of 4
+        drained = self.app(self.small, region="us")
+        placement.place(drained.id, "us")
+        Node.objects.filter(pk=self.us_a.pk).update(schedulable=False)
+        Node.objects.create(region="us", name="b", cpu=2, memory=4)
+        unplaced = self.app(self.small, region="mars")
+
+        out = io.StringIO()
+        call_command('rebalance_placement', '--apply', stdout=out)
+        self.assertIn("1 overcommitted nodes, 3 moves, 0 apps without room", out.getvalue())
+
+        nodes = {app.id: app.node for app in AppDetail.objects.select_related('node')}
+        self.assertEqual(nodes[upgraded.id], self.eu_b)
+        self.assertEqual(nodes[other.id], self.eu_a)
+        self.assertEqual(str(nodes[drained.id]), "us/b")
+        self.assertIsNotNone(nodes[unplaced.id])
+        for node in Node.objects.all():
+            self.assertLessEqual((node.cpu_used, node.memory_used), (node.cpu, node.memory))
+        self.assertCountersConsistent()
+
+
+    def test_evicted_app_without_room_keeps_its_place(self):
+        node = Node.objects.create(region="asia", name="a", cpu=4, memory=100)
+        three, two = (Plan.objects.create(plan_type="pro", storage=1, bandwidth=1, memory=1, cpu=cpu) for cpu in (3, 2))
+        evicted, staying = self.app(three, region="asia"), self.app(two, region="asia")
+        AppDetail.objects.filter(pk__in=[evicted.pk, staying.pk]).update(node=node)
+        waiting = self.app(two, region="asia")
+
+        rebalance = placement.plan_rebalance("asia")
+        # The evicted app's room is not handed to the waiting one, which
+        # would leave the node at 7 of 4 CPUs instead of 5.
+        self.assertEqual(rebalance.moves, [])
+        self.assertEqual(sorted(rebalance.unplaceable), sorted([evicted.pk, waiting.pk]))
+
+    def test_region_of_a_placed_app_is_read_only(self):
+        app = self.app(self.small)
+        placement.place(app.id, "eu")
+        url = reverse('apps-detail', args=[app.id])
+        response = self.client.patch(url, {'region': 'us'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('region', response.data)
+        self.assertEqual(self.client.patch(url, {'region': 'eu', 'framework': 'react'}, format='json').status_code, status.HTTP_200_OK)
+
+        unplaced = self.app(self.small)
+        response = self.client.patch(reverse('apps-detail', args=[unplaced.id]), {'region': 'us'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@skipUnless(apps.is_installed('django.contrib.admin'), "RUNTIME_PROFILE=api serves no admin")
+class AdminTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.plan = Plan.objects.create(plan_type="starter", storage=1, bandwidth=1, memory=2, cpu=1)
+
+    def populate(self, n):
+        for i in range(n):
+            user = AuthUser.objects.create(uid=1000 + i, extra_data={"login": f"user{i}"})
+            repo = GithbRepo.objects.create(organizer=user, repository=f"repo-{i}")
+            app = AppDetail.objects.create(organizer=repo, region="eu-west", framework="react")
+            AppPlan.objects.create(app=app, plan=self.plan)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:api_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return queries
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.populate(2)
+        before = {model: len(self.changelist_queries(model)) for model in ('authuser', 'githbrepo', 'appdetail', 'appplan')}
+        self.populate(8)
+        after = {model: len(self.changelist_queries(model)) for model in before}
+        self.assertEqual(before, after)
+
+    def test_changelists_do_not_load_extra_data(self):
+        self.populate(2)
+        for model in ('authuser', 'githbrepo'):
+            queries = self.changelist_queries(model)
+            self.assertFalse([q['sql'] for q in queries if 'extra_data' in q['sql']], model)
+
+    def test_paginator_uses_estimate_or_capped_count(self):
+        from . import admin as api_admin
+        self.populate(3)
+        with patch.object(api_admin, 'COUNT_LIMIT', 2):
+            queries = self.changelist_queries('authuser')
+            self.assertTrue(any('MAX(rowid)' in q['sql'] for q in queries))
+            self.assertFalse([q['sql'] for q in queries if 'COUNT(*)' in q['sql'] and 'LIMIT' not in q['sql']])
+            # Filtered lists count at most COUNT_LIMIT rows.
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('admin:api_appdetail_changelist'), {'framework__exact': 'react'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts = [q['sql'] for q in queries if 'COUNT(' in q['sql']]
+            self.assertTrue(counts)
+            self.assertTrue(all('LIMIT 2' in sql for sql in counts))
+
+    def test_search_uses_typed_and_prefix_lookups(self):
+        self.populate(3)
+        url = reverse('admin:api_githbrepo_changelist')
+        response = self.client.get(url, {'q': 'repo-'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get(url, {'q': 'repo-1'})
+        self.assertEqual([repo.repository for repo in response.context['cl'].result_list], ["repo-1"])
+        # Text never reaches the integer fields, and numbers match ids.
+        response = self.client.get(reverse('admin:api_authuser_changelist'), {'q': 'not-a-number'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['cl'].result_count, 0)
+        response = self.client.get(reverse('admin:api_authuser_changelist'), {'q': '1001'})
+        self.assertEqual([user.uid for user in response.context['cl'].result_list], [1001])
+
+    def test_change_views_and_plan_autocomplete(self):
+        self.populate(1)
+        app_plan = AppPlan.objects.get()
+        user = AuthUser.objects.get()
+        for url in (
+            reverse('admin:api_appplan_change', args=[app_plan.pk]),
+            reverse('admin:api_appdetail_change', args=[app_plan.app_id]),
+            reverse('admin:api_authuser_change', args=[user.pk]),
+        ):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK, url)
+        self.assertContains(self.client.get(reverse('admin:api_authuser_change', args=[user.pk])), "user0")
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'star', 'app_label': 'api', 'model_name': 'appplan', 'field_name': 'plan',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in response.json()['results']], [str(self.plan.pk)])
+
+
+class StartupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_warm_builds_resolvers_and_plan_catalog(self):
+        Plan.objects.create(plan_type="starter", storage=1, bandwidth=1, memory=2, cpu=1)
+        planmatch._current = (None, None)
+        # Closing connections is for the pre-fork master, not a test transaction.
+        with patch.object(startup.connections, 'close_all') as close_all:
+            timings = startup.warm()
+        self.assertEqual(set(timings), {'urls', 'plan_catalog'})
+        close_all.assert_called_once()
+        self.assertIsNotNone(planmatch._current[1])
+        self.assertGreater(startup.warm_urls(), 20)
+
+    def test_parse_importtime(self):
+        lines = [
+            "import time: self [us] | cumulative | imported package",
+            "phase: setup",
+            "import time:       120 |        120 |     encodings.idna",
+            "import time:       300 |        420 |   django.utils",
+            "phase: warmup",
+            "import time:      5000 |       9000 | requests",
+        ]
+        imports = startup.parse_importtime(lines)
+        self.assertEqual(imports, [
+            ('setup', 'encodings.idna', 120, 120, 2),
+            ('setup', 'django.utils', 300, 420, 1),
+            ('warmup', 'requests', 5000, 9000, 0),
+        ])
+        self.assertEqual(startup.by_package(imports)['django'], (300, 1))
+
+    def test_api_profile_leaves_out_web_apps(self):
+        out = io.StringIO()
+        call_command('startup_profile', profile='api', no_warmup=True, limit=1000, stdout=out)
+        output = out.getvalue()
+        packages = output.split("Packages by own import time")[1].split()
+        self.assertIn("Profile 'api'", output)
+        # The first request's imports are part of the cold start.
+        self.assertIn("first_request", output)
+        for name in ('django', 'rest_framework', 'requests'):
+            self.assertIn(name, packages)
+        # DRF's router imports django.contrib.admin modules (through
+        # admindocs) either way; what the profile leaves out is allauth and
+        # the admin app's URLs, templates and middleware.
+        self.assertNotIn('allauth', packages)
+
+
+class LoadTestTests(TestCase):
+    def test_scenarios_are_validated(self):
+        for name in loadtest.SCENARIOS:
+            self.assertTrue(loadtest.load_scenario(name).requests)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'bad.json')
+        for data, message in (
+            ({'requests': []}, "has no requests"),
+            ({'requests': [{'path': 'api/plans/'}]}, "path starting with /"),
+            ({'requests': [{'path': '/api/plans/', 'weight': 0}]}, "positive weight"),
+            ({'requests': [{'path': '/api/plans/'}], 'slo': {'p42_ms': 1}}, "Unknown SLO keys"),
+        ):
+            with open(path, 'w') as f:
+                json.dump(data, f)
+            with self.assertRaisesMessage(loadtest.ScenarioError, message):
+                loadtest.load_scenario(path)
+        with self.assertRaisesMessage(CommandError, "built-in scenarios are"):
+            call_command('loadtest', os.path.join(directory, 'missing.json'))
+        with self.assertRaisesMessage(CommandError, "KEY=NUMBER"):
+            call_command('loadtest', 'read', slo=['p99_ms=fast'])
+
+    def test_percentiles_and_slo_misses(self):
+        ordered = [i / 1000 for i in range(1, 101)]
+        self.assertEqual((loadtest.percentile(ordered, 0.5), loadtest.percentile(ordered, 0.99)), (0.05, 0.099))
+        self.assertIsNone(loadtest.percentile([], 0.5))
+        summary = loadtest.summarize(ordered, errors=2, duration=2)
+        self.assertEqual((summary['rps'], summary['error_rate'], summary['p95_ms']), (50.0, 0.02, 95.0))
+        missed = loadtest.missed_slos(summary, {'p99_ms': 50, 'p50_ms': 100, 'error_rate': 0.01, 'min_rps': 60}, 'overall')
+        self.assertEqual(missed, [
+            "overall: p99_ms 99.0 > 50",
+            "overall: error_rate 0.02 > 0.01",
+            "overall: min_rps 50.0 < 60",
+        ])
+
+    def test_seeded_plans_invalidate_cached_plans(self):
+        gen = responsecache.generation(Plan)
+        loadtest.seed(0)
+        self.assertEqual(Plan.objects.count(), 3)
+        self.assertNotEqual(responsecache.generation(Plan), gen)
+
+    def test_slow_requests_are_left_behind_at_the_timeout_and_deadline(self):
+        class SlowTarget:
+            # Like an in-process ASGI request: cancelling it waits for the
+            # sync view's thread.
+            label = 'slow'
+
+            async def request(self, client, method, path, headers, body):
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    await asyncio.sleep(5)
+
+            async def close(self):
+                pass
+
+        scenario = loadtest.Scenario(name='slow', requests=[loadtest.RequestSpec(name='slow', path='/')])
+        report = asyncio.run(loadtest.run(scenario, SlowTarget(), {}, clients=2, duration=0.5, timeout=0.2))
+
+        self.assertLess(report['duration'], 0.7)
+        self.assertEqual(report['requests']['slow']['statuses'], {'timeout': 4})
+        self.assertLess(report['overall']['max_ms'], 300)
+        self.assertEqual(report['unfinished'], 2)
+
+    def test_http_target_keeps_connections_alive(self):
+        scenario = loadtest.Scenario(name='fake', requests=[
+            loadtest.RequestSpec(name='repos', path='/user/repos'),
+            loadtest.RequestSpec(name='missing', path='/nowhere', expect=(404,)),
+        ])
+        with FakeGitHub(repos=3) as fake:
+            report = asyncio.run(loadtest.run(scenario, loadtest.HTTPTarget(fake.url()), {}, clients=4, max_requests=40))
+        self.assertEqual(report['overall']['requests'], 40)
+        self.assertEqual(report['overall']['errors'], 0)
+        self.assertEqual(fake.requests, 40)
+        self.assertLessEqual(fake.max_in_flight, 4)
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    # The in-process targets serve requests on other threads, which only see
+    # committed rows.
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_asgi_run_with_fake_github(self):
+        scenario = os.path.join(self.directory, 'smoke.json')
+        with open(scenario, 'w') as f:
+            json.dump({
+                'requests': [
+                    {'name': 'plans', 'path': '/api/plans/', 'weight': 2},
+                    {'name': 'app', 'path': '/api/apps/{app}/current_plan/'},
+                    {'name': 'repos', 'method': 'POST', 'path': '/api/auth/github/repo/', 'body': {'access_token': '{token}'}},
+                ],
+                'fake_github': {'repos': 2},
+                'slo': {'error_rate': 0},
+            }, f)
+        report_path = os.path.join(self.directory, 'report.json')
+        out = io.StringIO()
+        call_command('loadtest', scenario, seed=5, clients=8, requests=60, json=report_path, stdout=out)
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report['overall']['requests'], 60)
+        self.assertEqual(report['missed_slos'], [])
+        for name, row in report['requests'].items():
+            self.assertEqual(list(row['statuses']), ['200'], name)
+        self.assertEqual(AppDetail.objects.count(), 5)
+        self.assertIn("all SLOs met", out.getvalue())
+
+    def test_report_without_requests(self):
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, "overall: no requests completed"):
+            call_command('loadtest', 'read', seed=1, clients=2, requests=0, stdout=out)
+        self.assertIn(f"  {'overall':<20} {0:8d} {0:8.1f}   0.00% {' '.join(['       -'] * 5)}", out.getvalue())
+
+    def test_wsgi_run_fails_on_missed_slo(self):
+        with self.assertRaisesMessage(CommandError, "overall: p50_ms"):
+            call_command('loadtest', 'read', target='wsgi', threads=2, seed=3, clients=3, requests=12, slo=['p50_ms=0'], stdout=io.StringIO())
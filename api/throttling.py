@@ -0,0 +1,115 @@
+"""
+Cache-backed throttling for the GitHub-backed endpoints.
+
+Uses a sliding-window counter: one counter per (scope, client, window) that
+is bumped with the cache's atomic ``incr``, weighted against the previous
+window's counter. Unlike DRF's SimpleRateThrottle it never stores
+per-request history, so a check costs a few cache round-trips per identity
+regardless of the rate, and nothing touches the database.
+
+Counters live in the ``throttle`` cache, which all workers share only with
+CACHE_BACKEND=redis; otherwise each worker keeps its own (see settings).
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``'10/min'`` -> ``(10, 60)``."""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Throttles views that set ``throttle_scope`` at the rate configured for
+    that scope in DEFAULT_THROTTLE_RATES, per client IP and, when the request
+    carries one, per user (authenticated user or GitHub access token).
+    """
+    timer = time.time
+
+    @property
+    def cache(self):
+        return caches['throttle']
+
+    def get_idents(self, request, view):
+        idents = [f'ip:{self.get_ident(request)}']
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            idents.append(f'user:{user.pk}')
+        else:
+            token = request.data.get('access_token') if hasattr(request.data, 'get') else None
+            if token:
+                idents.append(f'token:{hashlib.sha256(str(token).encode()).hexdigest()[:32]}')
+        return idents
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return True
+
+        num_requests, duration = parse_rate(rate)
+        keys = [f'throttle:{scope}:{ident}' for ident in self.get_idents(request, view)]
+        return self.hit_all(keys, num_requests, duration, self.timer())
+
+    def hit(self, key, num_requests, duration, now):
+        return self.hit_all([key], num_requests, duration, now)
+
+    def hit_all(self, keys, num_requests, duration, now):
+        """
+        Count one request against every key, or against none of them when
+        any is out of budget, so a rejected request uses up no budget.
+        """
+        window, offset = divmod(now, duration)
+        window = int(window)
+        weight = 1 - offset / duration
+        current_keys = [f'{key}:{window}' for key in keys]
+        previous_keys = [f'{key}:{window - 1}' for key in keys]
+        counts = self.cache.get_many(current_keys + previous_keys)
+        previous = [counts.get(key, 0) for key in previous_keys]
+
+        # Check every counter first...
+        for current_key, before in zip(current_keys, previous):
+            current = counts.get(current_key, 0)
+            if before * weight + current + 1 > num_requests:
+                return self.reject(current, before, num_requests, duration, offset, weight)
+
+        # ...then count, undoing everything if a concurrent request got in first.
+        counted = []
+        for current_key, before in zip(current_keys, previous):
+            self.cache.add(current_key, 0, duration * 2)
+            try:
+                current = self.cache.incr(current_key)
+            except ValueError:
+                # Evicted between add() and incr().
+                self.cache.set(current_key, 1, duration * 2)
+                current = 1
+            counted.append(current_key)
+            if before * weight + current > num_requests:
+                for key in counted:
+                    try:
+                        self.cache.decr(key)
+                    except ValueError:
+                        pass
+                return self.reject(current - 1, before, num_requests, duration, offset, weight)
+        return True
+
+    def reject(self, current, previous, num_requests, duration, offset, weight):
+        if current >= num_requests or not previous:
+            self.wait_seconds = duration - offset
+        else:
+            # Wait until the previous window's weight has decayed enough.
+            needed_weight = (num_requests - current - 1) / previous
+            self.wait_seconds = max(0.0, (weight - needed_weight) * duration)
+        return False
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,183 @@
+"""
+Lightweight request tracing.
+
+Spans form a parent/child tree per request through a context variable, so
+they follow both threads and asyncio tasks. Incoming W3C ``traceparent``
+headers are continued and outgoing GitHub calls carry one. Finished spans
+go to the exporter chosen by TRACING_EXPORTER:
+
+* ``'jsonl'``  - one JSON object per line appended to TRACING_FILE, written
+  in one append per trace when its outermost local span ends
+* ``'memory'`` - kept in ``memory_exporter.spans`` (for tests)
+* ``None``     - tracing disabled; ``span()`` is a no-op
+"""
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+traceparent_re = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, root=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start = time.time_ns()
+        self.end = None
+        # The outermost span of this trace in this process; it holds its
+        # finished descendants until it ends itself.
+        self.root = root or self
+        self.finished = []
+
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': (self.end - self.start) / 1e6 if self.end else None,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    traceparent = None
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+noop_span = _NoopSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.time_ns()
+        if exc_type is not None:
+            self.span.status = 'error'
+            self.span.attributes.setdefault('error', repr(exc))
+        current_span.reset(self.token)
+        export(self.span)
+        return False
+
+
+class InMemoryExporter:
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+class JsonlExporter:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        root = span.root
+        if span is not root and root.end is None:
+            root.finished.append(span)
+            return
+        spans = [*root.finished, span] if span is root else [span]
+        root.finished = []
+        lines = ''.join(json.dumps(finished.as_dict()) + '\n' for finished in spans)
+        with self._lock:
+            with open(settings.TRACING_FILE, 'a') as fh:
+                fh.write(lines)
+
+
+memory_exporter = InMemoryExporter()
+jsonl_exporter = JsonlExporter()
+
+
+def enabled():
+    return getattr(settings, 'TRACING_EXPORTER', None) in ('jsonl', 'memory')
+
+
+def export(span):
+    if settings.TRACING_EXPORTER == 'memory':
+        memory_exporter.export(span)
+    elif settings.TRACING_EXPORTER == 'jsonl':
+        jsonl_exporter.export(span)
+
+
+def parse_traceparent(value):
+    """Return ``(trace_id, parent_span_id)`` from a traceparent header, or None."""
+    match = traceparent_re.match((value or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+def span(name, traceparent=None, **attributes):
+    """
+    Start a child of the current span (or a new trace) as a context manager.
+    ``traceparent`` continues a remote trace instead.
+    """
+    if not enabled():
+        return noop_span
+    remote = parse_traceparent(traceparent) if traceparent else None
+    parent = current_span.get()
+    if remote is not None:
+        trace_id, parent_id = remote
+        parent = None
+    else:
+        trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        parent_id = parent.span_id if parent is not None else None
+    return _ActiveSpan(Span(name, trace_id, parent_id, attributes, root=parent.root if parent is not None else None))
+
+
+def inject(headers):
+    """Add the current span's traceparent to outgoing request ``headers``."""
+    active = current_span.get()
+    if active is not None and enabled():
+        headers['traceparent'] = active.traceparent
+    return headers
+
+
+class TracedViewMixin:
+    """Wraps each view handler in a span named ``<View>.<method>``."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with span(f'{type(self).__name__}.{request.method.lower()}'):
+            return super().dispatch(request, *args, **kwargs)
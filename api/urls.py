@@ -1,5 +1,5 @@
 from django.urls import path, include
-from .views import GitHubAuth, GitHubCallback,GithubRepository, AppDetailViewSet, PlanViewSet, AppPlanViewSet, FetchUserDetails, GenerateAccessToken, OrganizerGithubViewSet
+from .views import GitHubAuth, GitHubCallback,GithubRepository, AppDetailViewSet, PlanViewSet, AppPlanViewSet, FetchUserDetails, GenerateAccessToken, OrganizerGithubViewSet, OwnerUsageSummaryViewSet, SearchView, UsageEventsView, InvoiceView, NodeViewSet, PlacementFitView
 from rest_framework.routers import DefaultRouter
 
 # Create a router and register our viewsets with it.
@@ -8,6 +8,8 @@ router.register(r'apps', AppDetailViewSet, basename="apps")
 router.register(r'plans', PlanViewSet, basename="plans")
 router.register(r'app-plans', AppPlanViewSet, basename="app-plans")
 router.register(r'organizer-repo', OrganizerGithubViewSet, basename="organizer-repo")
+router.register(r'usage', OwnerUsageSummaryViewSet, basename="usage")
+router.register(r'nodes', NodeViewSet, basename="nodes")
 
 
 
@@ -17,5 +19,9 @@ urlpatterns = [
     path('auth/github/fetch-details/', FetchUserDetails.as_view(), name="fetch-details"),
     path('auth/github/access-token/', GenerateAccessToken.as_view(), name="access-token"),
     path('auth/github/repo/', GithubRepository.as_view(), name="github-repo"),
+    path('search/', SearchView.as_view(), name="search"),
+    path('placement/fit/', PlacementFitView.as_view(), name="placement-fit"),
+    path('metering/events/', UsageEventsView.as_view(), name="metering-events"),
+    path('metering/invoice/<int:owner>/', InvoiceView.as_view(), name="metering-invoice"),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,205 @@
+"""
+Per-owner resource and cost rollups (OwnerUsageSummary).
+
+An owner's usage is the plan of each of their apps (``AppDetail.current_plan``)
+plus the plan of each of their DatabasePlans. Instead of re-aggregating that on
+every read, the summary row is adjusted by deltas in the same transaction as
+the change that causes them:
+
+* ``current_plan_changed`` (plan assignment, AppPlan edits and deletes),
+* ``pre_delete`` of an AppDetail that has a plan,
+* ``plan_changed``/``pre_delete`` of a Plan, applying the price/resource change
+  once per owner using it,
+* ``post_save``/``post_delete`` of a DatabasePlan.
+
+An owner without a summary row gets one computed from scratch on their next
+change; until then reads aggregate one without storing it (``unsaved``), so a
+GET never writes. ``manage.py rebuild_usage_summaries`` recomputes everything (or,
+with ``--check``, reports rows that drifted, e.g. after a raw SQL fix or an
+app moved to another owner's repository, which is not tracked).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import AppDetail, DatabasePlan, OwnerUsageSummary, Plan
+
+FIELDS = Plan.TRACKED_FIELDS
+COUNTS = ('apps', 'databases')
+
+
+def empty():
+    return {'apps': 0, 'databases': 0, 'monthly_cost': Decimal('0.00'), 'cpu': 0, 'memory': 0, 'storage': 0, 'bandwidth': 0}
+
+
+def plan_values(plan):
+    return {name: Plan._meta.get_field(name).to_python(getattr(plan, name)) for name in FIELDS}
+
+
+def compute(owner_ids=None):
+    """``{owner_id: totals}`` aggregated from apps and database plans."""
+    apps = AppDetail.objects.filter(current_plan__isnull=False, organizer__organizer__isnull=False)
+    databases = DatabasePlan.objects.filter(plan__isnull=False, owner__isnull=False)
+    if owner_ids is not None:
+        apps = apps.filter(organizer__organizer__in=owner_ids)
+        databases = databases.filter(owner__in=owner_ids)
+
+    totals = defaultdict(empty)
+    for queryset, owner, plan, count in (
+        (apps, 'organizer__organizer', 'current_plan__', 'apps'),
+        (databases, 'owner', 'plan__', 'databases'),
+    ):
+        rows = queryset.values(user=F(owner)).annotate(
+            n=Count('pk'), **{name: Sum(plan + name) for name in FIELDS}
+        ).order_by()
+        for row in rows:
+            total = totals[row['user']]
+            total[count] += row['n']
+            for name in FIELDS:
+                total[name] += row[name] or 0
+    return dict(totals)
+
+
+def recompute(owner_ids=None):
+    """Rewrite the summaries of ``owner_ids`` (default: everyone) from scratch."""
+    totals = compute(owner_ids)
+    for owner_id in owner_ids or ():
+        # Listed owners get a row even without any plans.
+        totals.setdefault(int(owner_id), empty())
+    with transaction.atomic():
+        stored = OwnerUsageSummary.objects.all()
+        if owner_ids is not None:
+            stored = stored.filter(owner__in=owner_ids)
+        stored.update(updated_at=timezone.now(), **empty())
+        OwnerUsageSummary.objects.bulk_create(
+            [OwnerUsageSummary(owner_id=owner_id, **total) for owner_id, total in totals.items()],
+            update_conflicts=True,
+            unique_fields=['owner'],
+            update_fields=[*COUNTS, *FIELDS, 'updated_at'],
+            batch_size=1000,
+        )
+    return len(totals)
+
+
+def unsaved(owner_id):
+    """An owner's summary aggregated from scratch, not stored."""
+    total = compute([owner_id]).get(owner_id, empty())
+    return OwnerUsageSummary(owner_id=owner_id, updated_at=timezone.now(), **total)
+
+
+def check():
+    """``[(owner_id, field, stored, expected)]`` for every summary that drifted."""
+    totals = compute()
+    stored = {row['owner_id']: row for row in OwnerUsageSummary.objects.values('owner_id', *COUNTS, *FIELDS)}
+    drift = []
+    for owner_id in sorted(totals.keys() | stored.keys()):
+        expected = totals.get(owner_id, empty())
+        row = stored.get(owner_id)
+        for name in (*COUNTS, *FIELDS):
+            value = None if row is None else row[name]
+            if value != expected[name] and not (row is None and not expected[name]):
+                drift.append((owner_id, name, value, expected[name]))
+    return drift
+
+
+def add(owner_id, deltas):
+    """Apply ``deltas`` to an owner's summary, creating it from scratch if missing."""
+    deltas = {name: value for name, value in deltas.items() if value}
+    if owner_id is None or not deltas:
+        return
+    updated = OwnerUsageSummary.objects.filter(owner_id=owner_id).update(
+        updated_at=timezone.now(), **{name: F(name) + value for name, value in deltas.items()}
+    )
+    if not updated and any(value > 0 for value in deltas.values()):
+        # No row yet (or it was never built): the database already reflects
+        # the change, so a recompute includes it.
+        recompute([owner_id])
+
+
+def scaled(values, factor):
+    return {name: value * factor for name, value in values.items()}
+
+
+def app_owners(app_ids):
+    return dict(AppDetail.objects.filter(pk__in=app_ids).values_list('pk', 'organizer__organizer'))
+
+
+def plan_users(plan_id):
+    """``{owner_id: number of apps and databases on the plan}``."""
+    users = defaultdict(int)
+    for queryset, owner in (
+        (AppDetail.objects.filter(current_plan=plan_id), 'organizer__organizer'),
+        (DatabasePlan.objects.filter(plan=plan_id), 'owner'),
+    ):
+        for owner_id, n in queryset.values_list(owner).annotate(n=Count('pk')).order_by():
+            if owner_id is not None:
+                users[owner_id] += n
+    return users
+
+
+def current_plan_moved(sender, changes, **kwargs):
+    owners = app_owners([app_id for app_id, _, _ in changes])
+    plans = Plan.objects.in_bulk({plan_id for _, old, new in changes for plan_id in (old, new) if plan_id})
+    deltas = defaultdict(lambda: defaultdict(int))
+    for app_id, old, new in changes:
+        owner_deltas = deltas[owners.get(app_id)]
+        for plan_id, sign in ((old, -1), (new, 1)):
+            if plan_id in plans:
+                owner_deltas['apps'] += sign
+                for name, value in plan_values(plans[plan_id]).items():
+                    owner_deltas[name] += sign * value
+    for owner_id, owner_deltas in deltas.items():
+        add(owner_id, owner_deltas)
+
+
+def app_deleting(sender, instance, **kwargs):
+    # Read the pointer from the database: it moves through update(), so the
+    # instance being deleted may hold a stale one.
+    row = AppDetail.objects.filter(pk=instance.pk).values_list('current_plan', 'organizer__organizer').first()
+    if row is None or row[0] is None:
+        return
+    plan = Plan.objects.get(pk=row[0])
+    add(row[1], {'apps': -1, **scaled(plan_values(plan), -1)})
+
+
+def plan_updated(sender, plan, before, **kwargs):
+    diff = {name: value - before[name] for name, value in plan_values(plan).items()}
+    if not any(diff.values()):
+        return
+    for owner_id, n in plan_users(plan.pk).items():
+        add(owner_id, scaled(diff, n))
+
+
+def plan_deleting(sender, instance, **kwargs):
+    # Apps fall back to no plan through SET_NULL, which sends no signals;
+    # the cascaded DatabasePlan deletes go through database_plan_deleted.
+    values = plan_values(instance)
+    rows = AppDetail.objects.filter(current_plan=instance.pk).values_list('organizer__organizer').annotate(n=Count('pk'))
+    for owner_id, n in rows.order_by():
+        add(owner_id, {'apps': -n, **scaled(values, -n)})
+
+
+def database_plan_saving(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._usage_before = DatabasePlan.objects.filter(pk=instance.pk).values_list('owner', 'plan').first()
+
+
+def database_plan_saved(sender, instance, created, raw=False, **kwargs):
+    before = instance.__dict__.pop('_usage_before', None)
+    if raw or before == (instance.owner_id, instance.plan_id):
+        return
+    if before is not None:
+        database_plan_deleted(sender, DatabasePlan(owner_id=before[0], plan_id=before[1]))
+    if instance.owner_id is not None and instance.plan_id is not None:
+        add(instance.owner_id, {'databases': 1, **plan_values(instance.plan)})
+
+
+def database_plan_deleted(sender, instance, **kwargs):
+    if instance.owner_id is None or instance.plan_id is None:
+        return
+    plan = Plan.objects.filter(pk=instance.plan_id).first()
+    if plan is not None:
+        add(instance.owner_id, {'databases': -1, **scaled(plan_values(plan), -1)})
@@ -1,15 +1,19 @@
-from django.shortcuts import redirect
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.contrib.auth import login
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from .models import AppDetail, Plan, AppPlan, AuthUser,GithbRepo
+from .models import AppDetail, Plan, AppPlan, AuthUser, GithbRepo, Node, OwnerUsageSummary
 from django.conf import settings
-import requests
-from .serializers import AppDetailSerializer, PlanSerializer, AppPlanSerializer, GithubRepoSerializer, CodeSerializer, OrganizerGithubSerializer
+from .serializers import AppDetailSerializer, PlanSerializer, AppPlanSerializer, GithubRepoSerializer, CodeSerializer, OrganizerGithubSerializer, OwnerUsageSummarySerializer, SearchQuerySerializer, InvoiceQuerySerializer, PlanMatchBatchSerializer, PlanMatchQuerySerializer, NodeSerializer, PlacementQuerySerializer
+from . import github, metering, metrics, placement, planmatch, search, tracing, usage
+from .mixins import CachedResponseMixin, ExportMixin, IdempotencyMixin, SparseFieldsetMixin
+from .tracing import TracedViewMixin
+from .writebehind import auth_user_writes
 
-class GitHubAuth(APIView):
+class GitHubAuth(TracedViewMixin, APIView):
     def get(self, request):
         client_id = settings.CLIENT_ID  # Replace with your GitHub client ID
         scope = 'user'
@@ -17,7 +21,7 @@ class GitHubAuth(APIView):
         auth_url = f'https://github.com/login/oauth/authorize?client_id={client_id}&scope={scope}&redirect_uri={redirect_uri}'
         return Response({"Authorize URL": auth_url}, status=status.HTTP_200_OK)
 
-class GitHubCallback(APIView):
+class GitHubCallback(TracedViewMixin, APIView):
     def get(self, request):
         code = request.GET.get('code')
         print('code: ', code)
@@ -26,66 +30,56 @@ class GitHubCallback(APIView):
         
         return Response({"code":code}, status=status.HTTP_200_OK)
     
-class GenerateAccessToken(APIView):
+class GenerateAccessToken(TracedViewMixin, APIView):
     serializers_class  = CodeSerializer 
+    throttle_scope = 'github_token'
     def get(self, request):
         serializer = self.serializers_class(data = request.data)
         if serializer.is_valid():
             code = serializer.validated_data['code']
 
             # Exchange the code for an access token
-            token_url = settings.TOKEN_URL
-            data = {
-                'client_id': settings.CLIENT_ID,  # Replace with your GitHub client ID
-                'client_secret': settings.CLIENT_SECRET,  # Replace with your GitHub client secret
-                'code': code
-            }
-            headers = {'Accept': 'application/json'}
-            response = requests.post(token_url, data=data, headers=headers)
-            token_data = response.json()
+            token_data = github.exchange_code(code)
             return Response({"data": token_data}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=400)
     
-class FetchUserDetails(APIView):
+class FetchUserDetails(TracedViewMixin, APIView):
     serializers_class  = GithubRepoSerializer 
+    throttle_scope = 'github_fan_out'
     def get(self, request):
         serializer = self.serializers_class(data = request.data)
         if serializer.is_valid():
             access_token = serializer.validated_data['access_token']
 
             if access_token:
-                user_info_url = settings.USER_INFO_URL
-                headers = {
-                    "Authorization": f"token {access_token}"
-                }
-                user_response = requests.get(user_info_url, headers=headers)
-                user_info = user_response.json()
-
-                url = settings.USER_REPO_URL
-                response = requests.get(url, headers=headers)
+                status_code, user_info = github.get(settings.USER_INFO_URL, access_token, github.USER_FIELDS, endpoint='user')
+
+                status_code, repos = github.get(settings.USER_REPO_URL, access_token, github.REPO_FIELDS, endpoint='repos')
                 repositories = []
-                for data in response.json():
+                for data in repos:
                     repo_url = f"{data.get('url')}/branches"
-                    branches_response = requests.get(repo_url, headers=headers)
-                    repositories.append({"id":data.get('id'), "name":data.get('name'), "clone_url":data.get('clone_url'), "private": data.get("private"), 'branches':branches_response.json()})
+                    branches_status, branches = github.get(repo_url, access_token, github.BRANCH_FIELDS, endpoint='branches')
+                    repositories.append({"id":data.get('id'), "name":data.get('name'), "clone_url":data.get('clone_url'), "private": data.get("private"), 'branches':branches})
 
-                print(f"Failed to fetch repositories: {response.status_code}")
+                print(f"Failed to fetch repositories: {status_code}")
 
                 # Create or get the user in your database
-                user, created = AuthUser.objects.get_or_create(
-                    uid=user_info['id'],
-                    provider='github',
-                    defaults={
-                        'extra_data': user_info
-                    }
-                )
+                with tracing.span('AuthUser.get_or_create'):
+                    user, created = AuthUser.objects.get_or_create(
+                        uid=user_info['id'],
+                        provider='github',
+                        defaults={
+                            'extra_data': github.compact(user_info)
+                        }
+                    )
 
 
                 user.backend = 'django.contrib.auth.backends.ModelBackend'
 
-                login(request, user)  # Log the user in (this requires that user is a valid Django user)
-                user.access_token = str(access_token)
-                user.save()
+                with tracing.span('login'):
+                    login(request, user)  # Log the user in (this requires that user is a valid Django user)
+                with tracing.span('AuthUser.save'):
+                    auth_user_writes.record(user, access_token=str(access_token))
                 return Response({
                     'user_info': user_info,
                     'repositories': repositories
@@ -93,46 +87,132 @@ class FetchUserDetails(APIView):
             return Response({'error': 'Failed to obtain access token'}, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=400)
 
-class GithubRepository(APIView):
+class GithubRepository(TracedViewMixin, APIView):
     serializers_class  = GithubRepoSerializer 
+    throttle_scope = 'github_repos'
     def post(self, request):
         serializer = self.serializers_class(data = request.data)
         if serializer.is_valid():
             access_token = serializer.validated_data['access_token']
-            url = settings.USER_REPO_URL
-            headers = {
-                "Authorization": f"token {access_token}"
-            }
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                repositories = response.json()
+            status_code, repositories = github.get(settings.USER_REPO_URL, access_token, github.REPO_FIELDS, endpoint='repos')
+            if status_code == 200:
                 return Response({"Repository":repositories}, status=status.HTTP_200_OK)
             else:
-                print(f"Failed to fetch repositories: {response.status_code}")
+                print(f"Failed to fetch repositories: {status_code}")
                 return Response({"msg": "Login Required", "URL":f"{settings.HOST_URL}/api/auth/github/"})
         else:
             # Return validation errors if serializer is not valid
             return Response(serializer.errors, status=400)
 
-class OrganizerGithubViewSet(viewsets.ModelViewSet):
+class SearchView(TracedViewMixin, APIView):
+    """Prefix/substring search on repository names, optionally by app region and framework."""
+    def get(self, request):
+        params = SearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        results = search.search(
+            data['q'], data['match'], data['type'], data.get('region'), data.get('framework'), data['limit'],
+        )
+        serializer_class = AppDetailSerializer if data['type'] == 'apps' else OrganizerGithubSerializer
+        return Response({'results': serializer_class(results, many=True).data})
+
+class OrganizerGithubViewSet(TracedViewMixin, IdempotencyMixin, ExportMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = GithbRepo.objects.all()
     serializer_class = OrganizerGithubSerializer
+    export_filter_fields = ('organizer', 'repository')
+    filter_fields = {
+        'organizer': 'organizer',
+        'repository': 'repository',
+        'created_after': 'created_at__gte',
+        'created_before': 'created_at__lt',
+    }
+    ordering_fields = ('created_at',)
+    ordering = ('created_at', 'id')
 
-class AppDetailViewSet(viewsets.ModelViewSet):
+class AppDetailViewSet(TracedViewMixin, IdempotencyMixin, ExportMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = AppDetail.objects.all()
     serializer_class = AppDetailSerializer
+    export_filter_fields = ('organizer', 'region', 'framework')
+    filter_fields = {
+        'organizer': 'organizer',
+        'region': 'region',
+        'framework': 'framework',
+        'created_after': 'created_at__gte',
+        'created_before': 'created_at__lt',
+    }
+    ordering_fields = ('created_at',)
+    ordering = ('created_at', 'id')
+
+    @action(detail=True, methods=['get'])
+    def current_plan(self, request, pk=None):
+        app = get_object_or_404(AppDetail.objects.select_related('current_plan'), pk=pk)
+        if app.current_plan is None:
+            return Response({"error": "No plan assigned"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            **PlanSerializer(app.current_plan).data,
+            'assigned_at': app.current_plan_assigned_at,
+        })
+
+    @action(detail=True, methods=['post'])
+    def place(self, request, pk=None):
+        """Place (or move) the app on the best-fitting node in ``region`` (default: the app's region)."""
+        app = get_object_or_404(AppDetail, pk=pk)
+        try:
+            node = placement.place(app.pk, request.data.get('region') or app.region)
+        except placement.NoCapacity as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(NodeSerializer(node).data)
 
-class PlanViewSet(viewsets.ModelViewSet):
-    queryset = Plan.objects.all()
+class PlanViewSet(TracedViewMixin, IdempotencyMixin, CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Plan.objects.order_by('pk')
     serializer_class = PlanSerializer
 
-class AppPlanViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get', 'post'])
+    def match(self, request):
+        """
+        GET: the cheapest plan meeting ``cpu``/``memory``/``storage``/``bandwidth``
+        (and ``max_cost``), or with ``pareto=true`` every Pareto-optimal one.
+        POST: the same for a batch, ``{"requirements": [...], "pareto": false}``.
+        """
+        if request.method == 'GET':
+            params = PlanMatchQuerySerializer(data=request.query_params)
+            params.is_valid(raise_exception=True)
+            pareto = params.validated_data['pareto']
+            result, = planmatch.match([params.validated_data], pareto)
+            if pareto:
+                return Response({'plans': result})
+            if result is None:
+                return Response({"error": "No plan matches"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(result)
+
+        batch = PlanMatchBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        records, pareto = batch.validated_data['requirements'], batch.validated_data['pareto']
+        key = 'plans' if pareto else 'plan'
+        results = [
+            {'app': record.get('app'), key: result}
+            for record, result in zip(records, planmatch.match(records, pareto))
+        ]
+        return Response({'results': results})
+
+class AppPlanViewSet(TracedViewMixin, IdempotencyMixin, ExportMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = AppPlan.objects.all()
     serializer_class = AppPlanSerializer
+    export_filter_fields = ('app', 'plan')
+    filter_fields = {
+        'app': 'app',
+        'plan': 'plan',
+        'plan__plan_type': 'plan__plan_type',
+        'created_after': 'created_at__gte',
+        'created_before': 'created_at__lt',
+    }
+    ordering_fields = ('created_at',)
+    ordering = ('created_at', 'id')
 
     @action(detail=True, methods=['post'])
     def assign_plan(self, request, pk=None):
-        app = self.get_object()
+        # `pk` is the AppDetail the plan is assigned to, not an AppPlan.
+        app = get_object_or_404(AppDetail, pk=pk)
         plan_id = request.data.get('plan_id')
         try:
             plan = Plan.objects.get(id=plan_id)
@@ -140,3 +220,77 @@ class AppPlanViewSet(viewsets.ModelViewSet):
             return Response({"status": "Plan assigned successfully"}, status=status.HTTP_201_CREATED)
         except Plan.DoesNotExist:
             return Response({"error": "Plan not found"}, status=status.HTTP_404_NOT_FOUND)
+
+class NodeViewSet(TracedViewMixin, IdempotencyMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Node.objects.order_by('pk')
+    serializer_class = NodeSerializer
+    filter_fields = {'region': 'region'}
+
+class PlacementFitView(TracedViewMixin, APIView):
+    """Nodes with room for ``cpu``/``memory`` (or an ``app``'s plan), best fit first, and the regions that have any."""
+    def get(self, request):
+        params = PlacementQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        cpu, memory = data['cpu'], data['memory']
+        if 'app' in data:
+            app = get_object_or_404(AppDetail.objects.select_related('current_plan'), pk=data['app'])
+            if app.current_plan is not None:
+                cpu, memory = app.current_plan.cpu, app.current_plan.memory
+        nodes = placement.fits(cpu, memory, data.get('region'))[:data['limit']]
+        return Response({
+            'cpu': cpu,
+            'memory': memory,
+            'nodes': NodeSerializer(nodes, many=True).data,
+            'regions': placement.fitting_regions(cpu, memory),
+        })
+
+class OwnerUsageSummaryViewSet(TracedViewMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
+    # Looked up by owner (AuthUser) id: /api/usage/<owner>/.
+    queryset = OwnerUsageSummary.objects.all()
+    serializer_class = OwnerUsageSummarySerializer
+    ordering_fields = ('monthly_cost',)
+    ordering = ('owner',)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            pk = self.kwargs[self.lookup_field]
+            if not (str(pk).isdigit() and AuthUser.objects.filter(pk=pk).exists()):
+                raise
+        # Owners get a row on their first change; aggregate one for anyone
+        # asking earlier, without writing on a read.
+        summary = usage.unsaved(int(pk))
+        self.check_object_permissions(self.request, summary)
+        return summary
+
+class UsageEventsView(TracedViewMixin, APIView):
+    """Batched metering events, as a list or ``{"events": [...]}``; see api.metering."""
+    def post(self, request):
+        events = request.data.get('events') if isinstance(request.data, dict) else request.data
+        if not isinstance(events, list):
+            return Response({"error": "Expected a list of events"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(events) > settings.METERING_MAX_EVENTS:
+            return Response(
+                {"error": f"At most {settings.METERING_MAX_EVENTS} events per request"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        accepted, rejected = metering.ingest(events)
+        return Response({'accepted': accepted, 'rejected': rejected}, status=status.HTTP_202_ACCEPTED)
+
+class InvoiceView(TracedViewMixin, APIView):
+    """
+    Metered charges of an owner's apps, priced at the plan each app had when
+    the usage was recorded; the period defaults to the current month.
+    """
+    def get(self, request, owner):
+        params = InvoiceQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        owner = get_object_or_404(AuthUser, pk=owner)
+        return Response(metering.invoice(owner.pk, params.validated_data['start'], params.validated_data['end']))
+
+
+def metrics_view(request):
+    """Prometheus text exposition of the api metrics."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
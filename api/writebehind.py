@@ -0,0 +1,107 @@
+"""
+Write-behind buffer for AuthUser login bookkeeping.
+
+Every FetchUserDetails call used to rewrite the AuthUser row (once from the
+``user_logged_in`` signal and once more from ``user.save()``). Under login
+bursts those writes are what holds the SQLite write lock, so changes are now
+only written when ``access_token`` or ``last_login`` actually change, and can
+optionally be batched and flushed in bulk.
+"""
+import atexit
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import models as auth_models
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import AuthUser
+
+
+class AuthUserWriteBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'AUTH_USER_WRITE_BEHIND', False)
+
+    def record(self, user, access_token=None, logged_in_at=None):
+        """
+        Record the login bookkeeping for ``user``. Returns True when something
+        changed and a write was issued or queued.
+        """
+        changes = {}
+        if access_token is not None and user.access_token != access_token:
+            changes['access_token'] = access_token
+        if logged_in_at is not None:
+            resolution = timedelta(seconds=getattr(settings, 'AUTH_USER_LAST_LOGIN_RESOLUTION', 0))
+            if user.last_login is None or logged_in_at - user.last_login >= resolution:
+                changes['last_login'] = logged_in_at
+        if not changes:
+            return False
+
+        for field, value in changes.items():
+            setattr(user, field, value)
+
+        if not self.enabled:
+            AuthUser.objects.filter(pk=user.pk).update(**changes)
+            return True
+
+        with self._lock:
+            self._pending.setdefault(user.pk, {}).update(changes)
+            pending = len(self._pending)
+            if self._timer is None:
+                self._timer = threading.Timer(settings.AUTH_USER_FLUSH_INTERVAL, self.flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if pending >= settings.AUTH_USER_FLUSH_MAX_PENDING:
+            self.flush()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return {pk: dict(changes) for pk, changes in self._pending.items()}
+
+    def flush(self):
+        """Write every buffered change, grouped into one bulk_update per field set."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        batches = {}
+        for pk, changes in pending.items():
+            batches.setdefault(tuple(sorted(changes)), []).append(AuthUser(pk=pk, **changes))
+        with transaction.atomic():
+            for fields, users in batches.items():
+                AuthUser.objects.bulk_update(users, fields)
+        return len(pending)
+
+    def flush_in_background(self):
+        # Runs on the timer's own thread, whose connection nothing else closes.
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
+
+
+auth_user_writes = AuthUserWriteBuffer()
+atexit.register(auth_user_writes.flush)
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    Replacement for django.contrib.auth's ``user_logged_in`` receiver that
+    routes AuthUser logins through the write buffer.
+    """
+    if isinstance(user, AuthUser):
+        auth_user_writes.record(user, logged_in_at=timezone.now())
+    else:
+        auth_models.update_last_login(sender, user, **kwargs)
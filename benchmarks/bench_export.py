@@ -0,0 +1,79 @@
+"""
+Stream a large AppDetail table through /api/apps/export/ and track RSS.
+
+    python benchmarks/bench_export.py [--rows 5000000] [--output ndjson|csv]
+
+Builds a throwaway SQLite database, so it never touches db.sqlite3.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+
+def rss_mb():
+    with open('/proc/self/status') as fh:
+        for line in fh:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--output', default='ndjson', choices=('ndjson', 'csv'))
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+
+    from django.core.management import call_command
+    from django.db import connection
+    from rest_framework.test import APIRequestFactory
+
+    from api.views import AppDetailViewSet
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO api_appdetail (organizer_id, region, framework, created_at, updated_at) "
+            "WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < %s) "
+            "SELECT NULL, 'region-' || (x %% 40), 'react', datetime('now'), datetime('now') FROM seq",
+            [args.rows],
+        )
+    print(f'inserted {args.rows} rows in {time.perf_counter() - start:.1f}s')
+
+    view = AppDetailViewSet.as_view({'get': 'export'})
+    request = APIRequestFactory().get('/api/apps/export/', {'output': args.output})
+    baseline = peak = rss_mb()
+
+    start = time.perf_counter()
+    response = view(request)
+    total_bytes = lines = 0
+    for chunk in response.streaming_content:
+        total_bytes += len(chunk)
+        lines += chunk.count(b'\n')
+        peak = max(peak, rss_mb())
+    elapsed = time.perf_counter() - start
+
+    rows = lines - (1 if args.output == 'csv' else 0)
+    print(f'exported {rows} rows, {total_bytes / 1e6:.1f} MB in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)')
+    print(f'RSS baseline {baseline:.1f} MB, peak {peak:.1f} MB (+{peak - baseline:.1f} MB)')
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
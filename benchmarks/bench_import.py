@@ -0,0 +1,63 @@
+"""
+Throughput of `manage.py bulk_import` on a throwaway SQLite database.
+
+    python benchmarks/bench_import.py [--rows 200000] [--batch-size 5000]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+
+    from django.core.management import call_command
+
+    from api.models import AppDetail, AuthUser, GithbRepo
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    owner = AuthUser.objects.create(uid=1)
+    repo_ids = [repo.id for repo in GithbRepo.objects.bulk_create(
+        GithbRepo(organizer=owner, repository=f'repo-{i}') for i in range(1000)
+    )]
+
+    path = os.path.join(directory, 'apps.ndjson')
+    frameworks = ('vuejs', 'react', 'expressjs', 'rubyonrails')
+    with open(path, 'w') as fh:
+        for i in range(args.rows):
+            fh.write(json.dumps({
+                'organizer': repo_ids[i % len(repo_ids)],
+                'region': f'region-{i % 40}',
+                'framework': frameworks[i % 4],
+            }) + '\n')
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        call_command('bulk_import', 'apps', path, '--batch-size', str(args.batch_size), stdout=devnull)
+    elapsed = time.perf_counter() - start
+
+    print(f'imported {AppDetail.objects.count()} apps in {elapsed:.1f}s ({args.rows / elapsed:,.0f} rows/s)')
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
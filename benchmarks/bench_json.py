@@ -0,0 +1,76 @@
+"""
+Serialize time and bytes-on-wire for a 1,000-repo GithubRepository payload.
+
+    python benchmarks/bench_json.py [--repos 1000] [--rounds 20]
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from api.middleware import brotli  # noqa: E402
+from api.renderers import ORJSONRenderer  # noqa: E402
+
+
+def make_repo(i):
+    # Roughly the shape (and ~100 keys) of a GitHub /user/repos item.
+    owner = {f'owner_field_{n}': f'https://api.github.com/users/octocat/{n}' for n in range(18)}
+    repo = {
+        'id': i,
+        'node_id': str(uuid.uuid4()),
+        'name': f'repo-{i}',
+        'full_name': f'octocat/repo-{i}',
+        'private': bool(i % 2),
+        'owner': owner,
+        'description': 'A sample repository used to size API responses ' * 2,
+        'created_at': datetime(2024, 1, 1, tzinfo=timezone.utc),
+        'pushed_at': datetime(2024, 6, 1, tzinfo=timezone.utc),
+        'size': Decimal('1234.50'),
+        'stargazers_count': i * 3,
+    }
+    for n in range(85):
+        repo[f'url_{n}'] = f'https://api.github.com/repos/octocat/repo-{i}/endpoint_{n}'
+    return repo
+
+
+def timed(fn, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repos', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    payload = {'Repository': [make_repo(i) for i in range(args.repos)]}
+
+    print(f'{"renderer":<16}{"serialize ms":>14}{"raw bytes":>12}{"gzip bytes":>12}{"br bytes":>12}')
+    for name, renderer in (('stdlib json', JSONRenderer()), ('orjson', ORJSONRenderer())):
+        seconds, body = timed(lambda: renderer.render(payload), args.rounds)
+        gzipped = len(gzip.compress(body, compresslevel=6))
+        brotlied = len(brotli.compress(body, quality=6)) if brotli else '-'
+        print(f'{name:<16}{seconds * 1000:>14.2f}{len(body):>12}{gzipped:>12}{brotlied:>12}')
+
+
+if __name__ == '__main__':
+    main()
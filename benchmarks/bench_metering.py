@@ -0,0 +1,97 @@
+"""
+Metering ingestion throughput through POST /api/metering/events/, the cost
+of flushing the buffer, and the invoice query, on a throwaway SQLite database.
+
+    python benchmarks/bench_metering.py [--events 1000000] [--batch 10000] [--apps 5000]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--batch', type=int, default=10_000)
+    parser.add_argument('--apps', type=int, default=5000)
+    parser.add_argument('--rate', type=int, default=100_000, help="Simulated events per second of event time.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    settings.METERING_FLUSH_INTERVAL = 3600
+
+    from datetime import datetime, timedelta, timezone
+
+    from django.core.management import call_command
+    from django.test import Client
+
+    from api import metering
+    from api.models import AppDetail, AuthUser, GithbRepo, UsageBucket
+    from api.renderers import orjson
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    owners = AuthUser.objects.bulk_create(AuthUser(uid=i) for i in range(args.apps // 50))
+    repos = GithbRepo.objects.bulk_create(GithbRepo(organizer=owners[i % len(owners)]) for i in range(args.apps))
+    apps = [app.id for app in AppDetail.objects.bulk_create(AppDetail(organizer=repo) for repo in repos)]
+
+    # Event timestamps advance at --rate events per second, and the buffer is
+    # flushed once per second of event time, as METERING_FLUSH_INTERVAL would.
+    rng = random.Random(0)
+    start_ts = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+    bodies = []
+    for offset in range(0, args.events, args.batch):
+        ts = start_ts + offset / args.rate
+        bodies.append(orjson.dumps({'events': [
+            {'app': rng.choice(apps), 'ts': ts + rng.random() * args.batch / args.rate, 'cpu_seconds': rng.random(),
+             'bytes_out': rng.randrange(100_000), 'gb_stored': rng.random() * 10}
+            for _ in range(min(args.batch, args.events - offset))
+        ]}))
+
+    client = Client()
+    flush_time = 0
+    start = time.perf_counter()
+    per_flush = max(args.rate // args.batch, 1)
+    for index, body in enumerate(bodies, 1):
+        response = client.post('/api/metering/events/', body, content_type='application/json')
+        assert response.status_code == 202, response.content
+        if index % per_flush == 0:
+            flush_start = time.perf_counter()
+            metering.usage_buffer.flush()
+            flush_time += time.perf_counter() - flush_start
+    flush_start = time.perf_counter()
+    metering.usage_buffer.flush()
+    flush_time += time.perf_counter() - flush_start
+    elapsed = time.perf_counter() - start
+
+    print(f'ingested {args.events:,} events in {elapsed:.1f}s ({args.events / elapsed:,.0f} events/s), '
+          f'{flush_time:.1f}s of it flushing {UsageBucket.objects.count():,} buckets')
+
+    period_start = datetime.fromtimestamp(start_ts, timezone.utc)
+    period_end = period_start + timedelta(seconds=args.events // args.rate + 60)
+    timings = []
+    for owner in owners[:100]:
+        query_start = time.perf_counter()
+        metering.invoice(owner.id, period_start, period_end)
+        timings.append(time.perf_counter() - query_start)
+    timings.sort()
+    print(f'invoice of {args.apps // len(owners)} apps: p50 {timings[len(timings) // 2] * 1000:.1f} ms, '
+          f'max {timings[-1] * 1000:.1f} ms')
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
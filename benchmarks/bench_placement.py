@@ -0,0 +1,109 @@
+"""
+Placement at fleet scale on a throwaway SQLite database: "where does this fit"
+queries, single placements, and a full rebalance of --apps apps over
+--regions regions.
+
+    python benchmarks/bench_placement.py [--apps 100000] [--regions 40] [--nodes 80]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return f'p50 {timings[len(timings) // 2] * 1000:.2f} ms, p99 {timings[int(len(timings) * 0.99)] * 1000:.2f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apps', type=int, default=100_000)
+    parser.add_argument('--regions', type=int, default=40)
+    parser.add_argument('--nodes', type=int, default=80, help="Nodes per region.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+
+    from django.core.management import call_command
+
+    from api import placement
+    from api.models import AppDetail, AuthUser, GithbRepo, Node, Plan
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    rng = random.Random(0)
+    plans = [
+        Plan.objects.create(plan_type='pro', cpu=cpu, memory=memory, storage=10, bandwidth=100)
+        for cpu, memory in ((1, 1), (1, 2), (2, 4), (4, 8), (8, 32))
+    ]
+    regions = [f'region-{i}' for i in range(args.regions)]
+    nodes = Node.objects.bulk_create(
+        Node(region=region, name=f'node-{i}', cpu=64, memory=256) for region in regions for i in range(args.nodes)
+    )
+    by_region = {region: [node for node in nodes if node.region == region] for region in regions}
+    owner = AuthUser.objects.create(uid=1)
+    repo = GithbRepo.objects.create(organizer=owner, repository='bench')
+
+    # 90% of the apps sit on random nodes of their region regardless of
+    # capacity (so some nodes are overcommitted); the rest are unplaced.
+    apps = []
+    for i in range(args.apps):
+        region = rng.choice(regions)
+        node = rng.choice(by_region[region]) if i % 10 else None
+        apps.append(AppDetail(
+            organizer=repo, region=region, node=node, current_plan=rng.choices(plans, (40, 30, 20, 8, 2))[0],
+        ))
+    AppDetail.objects.bulk_create(apps, batch_size=5000)
+    Node.objects.filter(pk__in=[node.pk for node in nodes[::50]]).update(schedulable=False)
+    placement.refresh_usage()
+
+    timings = []
+    for _ in range(500):
+        start = time.perf_counter()
+        list(placement.fits(rng.choice((1, 2, 4, 8)), rng.choice((2, 8, 32)), rng.choice(regions))[:10])
+        timings.append(time.perf_counter() - start)
+    print(f'fit query in one region: {percentiles(timings)}')
+
+    timings = []
+    for _ in range(200):
+        start = time.perf_counter()
+        placement.fitting_regions(rng.choice((1, 2, 4, 8)), rng.choice((2, 8, 32)))
+        timings.append(time.perf_counter() - start)
+    print(f'fitting regions across {len(nodes)} nodes: {percentiles(timings)}')
+
+    start = time.perf_counter()
+    rebalance = placement.plan_rebalance()
+    planned = time.perf_counter() - start
+    placement.apply_rebalance(rebalance)
+    applied = time.perf_counter() - start - planned
+    print(f'rebalance of {args.apps:,} apps on {len(nodes):,} nodes: planned in {planned:.2f}s '
+          f'({rebalance.overcommitted} overcommitted nodes, {len(rebalance.moves):,} moves, '
+          f'{len(rebalance.unplaceable):,} without room), applied in {applied:.2f}s')
+
+    timings = []
+    for app_id in AppDetail.objects.order_by('?').values_list('pk', flat=True)[:300]:
+        start = time.perf_counter()
+        try:
+            placement.place(app_id, rng.choice(regions))
+        except placement.NoCapacity:
+            pass
+        timings.append(time.perf_counter() - start)
+    print(f'place/move one app: {percentiles(timings)}')
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Latency of /api/search/ against a large repository table.
+
+    python benchmarks/bench_search.py [--repos 1000000] [--queries 500]
+
+Builds a throwaway SQLite database, so it never touches db.sqlite3.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+WORDS = ['api', 'web', 'kube', 'data', 'core', 'auth', 'cli', 'docs', 'infra', 'ml', 'app', 'site', 'bot', 'lib']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repos', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+
+    from django.core.management import call_command
+    from django.db import connection
+    from rest_framework.test import APIRequestFactory
+
+    from api.views import SearchView
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    start = time.perf_counter()
+    words = ', '.join(f"({i}, '{word}')" for i, word in enumerate(WORDS))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO api_githbrepo (organizer_id, repository, created_at, updated_at) "
+            f"WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < %s), "
+            f"words(i, w) AS (VALUES {words}) "
+            f"SELECT NULL, a.w || '-' || b.w || '-' || x, datetime('now'), datetime('now') FROM seq "
+            f"JOIN words a ON a.i = x %% {len(WORDS)} JOIN words b ON b.i = (x / {len(WORDS)}) %% {len(WORDS)}",
+            [args.repos],
+        )
+        cursor.execute(
+            "INSERT INTO api_appdetail (organizer_id, region, framework, created_at, updated_at) "
+            "SELECT id, 'region-' || (id / 4 % 40), 'react', datetime('now'), datetime('now') "
+            "FROM api_githbrepo WHERE id % 4 = 0"
+        )
+    print(f'inserted {args.repos} repos in {time.perf_counter() - start:.1f}s')
+    start = time.perf_counter()
+    call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+    print(f'built index in {time.perf_counter() - start:.1f}s')
+
+    rng = random.Random(0)
+    cases = []
+    for _ in range(args.queries):
+        word = rng.choice(WORDS)
+        cases.append(rng.choice([
+            {'q': word[:rng.randint(1, len(word))]},
+            {'q': f'{word}-{rng.choice(WORDS)}'},
+            {'q': str(rng.randint(100, args.repos)), 'match': 'substring'},
+            {'q': f'-{word}', 'match': 'substring'},
+            {'q': f'{word}-', 'match': 'substring', 'region': f'region-{rng.randrange(40)}'},
+            {'q': word, 'type': 'apps', 'region': f'region-{rng.randrange(40)}'},
+            {'q': f'-{word}', 'match': 'substring', 'region': 'region-40'},
+        ]))
+
+    view = SearchView.as_view()
+    factory = APIRequestFactory()
+    timings = []
+    for params in cases:
+        request = factory.get('/api/search/', params)
+        begin = time.perf_counter()
+        response = view(request)
+        timings.append((time.perf_counter() - begin) * 1000)
+        assert response.status_code == 200, response.data
+    timings.sort()
+    print(
+        f'{len(timings)} searches: p50 {statistics.median(timings):.2f} ms, '
+        f'p99 {timings[int(len(timings) * 0.99) - 1]:.2f} ms, max {timings[-1]:.2f} ms'
+    )
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Per-request cost of SlidingWindowThrottle against the configured cache.
+
+    python benchmarks/bench_throttle.py [--requests 20000] [--clients 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kubern_test.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from api.throttling import SlidingWindowThrottle  # noqa: E402
+from api.views import FetchUserDetails  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=500)
+    args = parser.parse_args()
+
+    factory = APIRequestFactory()
+    view = FetchUserDetails()
+    requests = [
+        Request(factory.get('/', REMOTE_ADDR=f'10.0.{i // 256}.{i % 256}'))
+        for i in range(args.clients)
+    ]
+    throttle = SlidingWindowThrottle()
+
+    timings = []
+    allowed = 0
+    for i in range(args.requests):
+        request = requests[i % args.clients]
+        start = time.perf_counter()
+        allowed += throttle.allow_request(request, view)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    pct = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))] * 1e6  # noqa: E731
+    print(f'checks: {args.requests}  allowed: {allowed}  clients: {args.clients}')
+    print(f'mean {sum(timings) / len(timings) * 1e6:.1f} us  p50 {pct(0.5):.1f} us  '
+          f'p99 {pct(0.99):.1f} us  max {timings[-1] * 1e6:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -54,7 +54,11 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ProfilingMiddleware',
+    'api.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -96,6 +100,126 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# CACHE_BACKEND is 'locmem' (per process), 'file' (shared by the processes of
+# one host) or 'redis' (shared by every worker, CACHE_LOCATION is its URL).
+# CACHE_SHARED is True when every worker sees the same cache with an atomic
+# incr; features that coordinate workers through the cache rely on it.
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+CACHE_SHARED = CACHE_BACKEND == 'redis'
+
+LOCMEM_CACHE = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    # Throttle counters are one key per client and window; the default of
+    # 300 entries would cull them under load.
+    'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000))},
+}
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_LOCATION or 'redis://127.0.0.1:6379/0',
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION or BASE_DIR / '.cache',
+        }
+    }
+else:
+    CACHES = {'default': {**LOCMEM_CACHE, 'LOCATION': CACHE_LOCATION or 'kubern-test'}}
+
+# Throttle counters need an atomic incr, which the file cache does not have.
+# Without redis they are kept per process, so each worker enforces the full
+# rate on its own: the effective limit is the rate times the worker count.
+CACHES['throttle'] = CACHES['default'] if CACHE_SHARED else {**LOCMEM_CACHE, 'LOCATION': 'kubern-test-throttle'}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/4.2/topics/http/sessions/#configuring-the-session-engine
+# 'db' keeps one row per login in django_session, 'cached_db' serves reads
+# from the cache and 'signed_cookies' keeps sessions out of the database.
+
+SESSION_STRATEGY = os.getenv('SESSION_STRATEGY', 'cached_db')
+
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_STRATEGY]
+
+
+# AuthUser login bookkeeping
+# With write-behind enabled, access_token/last_login changes are buffered and
+# flushed in bulk every AUTH_USER_FLUSH_INTERVAL seconds. last_login is only
+# rewritten once it is older than AUTH_USER_LAST_LOGIN_RESOLUTION seconds.
+
+AUTH_USER_WRITE_BEHIND = os.getenv('AUTH_USER_WRITE_BEHIND') == 'True'
+AUTH_USER_FLUSH_INTERVAL = float(os.getenv('AUTH_USER_FLUSH_INTERVAL', 5))
+AUTH_USER_FLUSH_MAX_PENDING = int(os.getenv('AUTH_USER_FLUSH_MAX_PENDING', 500))
+AUTH_USER_LAST_LOGIN_RESOLUTION = int(os.getenv('AUTH_USER_LAST_LOGIN_RESOLUTION', 60))
+
+
+# Single-flight coalescing of identical GitHub requests. Within a process
+# this is always on; SINGLE_FLIGHT_SHARED extends it across workers through
+# the default cache.
+
+SINGLE_FLIGHT_SHARED = os.getenv('SINGLE_FLIGHT_SHARED') == 'True'
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', 30))
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv('SINGLE_FLIGHT_RESULT_TTL', 2))
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+
+# Metrics
+# Set METRICS_DIR to a directory shared by all workers (e.g. under /dev/shm)
+# so /metrics aggregates across gunicorn processes.
+
+METRICS_DIR = os.getenv('METRICS_DIR', None)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+
+
+# Per-request profiling
+# Requests are profiled when they carry a PROFILE_HEADER value from
+# `manage.py profiles --token`, or at random with PROFILE_SAMPLE_RATE.
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.002))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+PROFILE_HEADER = 'X-Profile-Request'
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+
+# Tracing
+# TRACING_EXPORTER is 'jsonl' (append spans to TRACING_FILE), 'memory' or
+# empty to disable tracing.
+
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER') or None
+TRACING_FILE = os.getenv('TRACING_FILE', str(BASE_DIR / 'traces.jsonl'))
+
+
+# GitHub client resilience
+# (connect, read) timeouts in seconds for every GitHub call, per-endpoint
+# circuit breaker thresholds, and how long the last good response of each
+# request is kept to be served while GitHub is failing.
+
+GITHUB_TIMEOUT = (
+    float(os.getenv('GITHUB_CONNECT_TIMEOUT', 3.05)),
+    float(os.getenv('GITHUB_READ_TIMEOUT', 10)),
+)
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', 30))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 15))
+GITHUB_STALE_TTL = int(os.getenv('GITHUB_STALE_TTL', 60 * 60 * 24))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -166,4 +290,86 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_FILTER_BACKENDS': (
+        'api.filters.FieldFilterBackend',
+        'api.filters.WhitelistOrderingFilter',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.SlidingWindowThrottle',
+    ),
+    # Budgets per upstream cost class: one GitHub call, one listing, and
+    # the user + repos + per-repo branches fan-out.
+    'DEFAULT_THROTTLE_RATES': {
+        'github_token': os.getenv('THROTTLE_GITHUB_TOKEN', '60/min'),
+        'github_repos': os.getenv('THROTTLE_GITHUB_REPOS', '60/min'),
+        'github_fan_out': os.getenv('THROTTLE_GITHUB_FAN_OUT', '20/min'),
+    },
 }
+
+# Rendered-response cache for read-mostly viewsets: seconds an entry is
+# fresh, and how much longer it may be served while being re-rendered.
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+RESPONSE_CACHE_STALE = int(os.getenv('RESPONSE_CACHE_STALE', 60))
+
+# Idempotency-Key: how long responses are replayed, how long a duplicate
+# waits for the original request before giving up with 409, and after how
+# long an unfinished claim counts as abandoned (keep it above the longest a
+# request can run, e.g. the server's worker timeout).
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 86400))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 30))
+IDEMPOTENCY_LOCK_TTL = int(os.getenv('IDEMPOTENCY_LOCK_TTL', 3600))
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+# Usage metering: events are summed per app-minute in memory and flushed
+# every METERING_FLUSH_INTERVAL seconds or at METERING_FLUSH_MAX_PENDING
+# app-minutes. Overage prices are per GB beyond the plan's allowance.
+METERING_WRITE_BEHIND = os.getenv('METERING_WRITE_BEHIND', 'True') == 'True'
+METERING_FLUSH_INTERVAL = float(os.getenv('METERING_FLUSH_INTERVAL', 1))
+METERING_FLUSH_MAX_PENDING = int(os.getenv('METERING_FLUSH_MAX_PENDING', 50000))
+METERING_MAX_EVENTS = int(os.getenv('METERING_MAX_EVENTS', 100000))
+METERING_BANDWIDTH_PRICE_PER_GB = os.getenv('METERING_BANDWIDTH_PRICE_PER_GB', '0.09')
+METERING_STORAGE_PRICE_PER_GB = os.getenv('METERING_STORAGE_PRICE_PER_GB', '0.10')
+
+# Most requirement records accepted by one POST /api/plans/match/.
+PLAN_MATCH_MAX_BATCH = int(os.getenv('PLAN_MATCH_MAX_BATCH', 10000))
+
+# Responses smaller than this many bytes are not compressed.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', 6))
+
+# Runtime profile
+# 'full' serves everything. 'api' is for API-only pods: it leaves out the
+# admin, allauth and the templates, messages, static files and browsable API
+# that only HTML pages use, so workers start faster and use less memory.
+# STARTUP_WARMUP makes the WSGI/ASGI module do its first-request work (the
+# URLconf and the views it imports, URL resolvers, the plan catalog) at
+# import time, which with gunicorn --preload is once, before the workers are
+# forked.
+
+RUNTIME_PROFILE = os.getenv('RUNTIME_PROFILE', 'full')
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP') == 'True'
+
+if RUNTIME_PROFILE == 'api':
+    WEB_ONLY_APPS = {
+        'django.contrib.admin', 'django.contrib.messages', 'django.contrib.staticfiles', 'django.contrib.sites',
+        'allauth', 'allauth.account', 'allauth.socialaccount', 'allauth.socialaccount.providers.github',
+    }
+    WEB_ONLY_MIDDLEWARE = {
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        'allauth.account.middleware.AccountMiddleware',
+    }
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in WEB_ONLY_APPS]
+    MIDDLEWARE = [name for name in MIDDLEWARE if name not in WEB_ONLY_MIDDLEWARE]
+    TEMPLATES = []
+    AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.ModelBackend',)
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = ('api.renderers.ORJSONRenderer',)